@@ -0,0 +1,294 @@
+"""
+Admission control for face compute.
+
+Two layers, both per worker process:
+
+  * token buckets per org, branch and device (RATE_LIMIT_* settings); a
+    request that finds any of its buckets empty gets 429 with Retry-After;
+  * a compute gate with FACE_COMPUTE_SLOTS concurrent requests and a bounded
+    wait queue. Waiting requests are queued per tenant (org/branch) and
+    granted in weighted fair order (start-time fair queueing), so one busy
+    branch only lengthens its own queue. When the queue is full a newcomer
+    displaces the newest waiter of the tenant holding the most places; if it
+    cannot, or waits longer than ADMISSION_QUEUE_TIMEOUT_MS, it gets 503 with
+    Retry-After.
+
+Routes opt in with dependencies=[Depends(admit_face_compute)]. A route whose
+work outlives the handler (a streamed body) takes the ComputeSlot as a
+parameter and detach()es it; the slot is then freed by slot.release() when
+the stream ends.
+"""
+
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from fastapi import Depends, HTTPException
+
+from .core.config import settings
+from .tenant_guard import tenant_context
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Seconds until one token is available (0 if one is available now)."""
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Per-org, per-branch and per-device token buckets over a shared window."""
+
+    MAX_BUCKETS = 10000
+
+    def __init__(self, window_s: float, org_limit: int, branch_limit: int, device_limit: int):
+        self.window = max(1e-3, window_s)
+        self.limits = {"org": org_limit, "branch": branch_limit, "device": device_limit}
+        self._buckets: dict[tuple, TokenBucket] = {}
+        self.rejected = 0
+
+    def _bucket(self, level: str, key: str) -> Optional[TokenBucket]:
+        limit = self.limits[level]
+        if limit <= 0:
+            return None
+        b = self._buckets.get((level, key))
+        if b is None:
+            if len(self._buckets) >= self.MAX_BUCKETS:
+                self._prune()
+            b = self._buckets[(level, key)] = TokenBucket(limit / self.window, limit)
+        return b
+
+    def _prune(self) -> None:
+        # Full buckets carry no state worth keeping
+        now = time.monotonic()
+        for k, b in list(self._buckets.items()):
+            b.refill(now)
+            if b.tokens >= b.capacity:
+                del self._buckets[k]
+
+    def check(self, org: str, branch: str, device: Optional[str]) -> float:
+        """Take one token from every bucket; returns 0, or the Retry-After in seconds if any is empty."""
+        now = time.monotonic()
+        keys = [("org", org), ("branch", f"{org}/{branch}")]
+        if device:
+            keys.append(("device", f"{org}/{branch}/{device}"))
+        buckets = [b for b in (self._bucket(level, key) for level, key in keys) if b is not None]
+        for b in buckets:
+            b.refill(now)
+        # All or nothing: a request denied by its device bucket must not drain the org's budget
+        wait = max((b.wait_time() for b in buckets), default=0.0)
+        if wait > 0:
+            self.rejected += 1
+            return wait
+        for b in buckets:
+            b.tokens -= 1
+        return 0.0
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, retry_after: float, reason: str):
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class FairScheduler:
+    """Bounded compute gate; queued requests are granted by lowest per-tenant virtual time."""
+
+    def __init__(self, slots: int, max_queue: int, weights: Optional[dict] = None):
+        self.slots = max(1, slots)
+        self.max_queue = max(0, max_queue)
+        self.weights = weights or {}
+        self._active = 0
+        self._queued = 0
+        self._queues: dict[str, deque] = {}
+        self._vtime: dict[str, float] = {}
+        self._vclock = 0.0
+        self._service_ms = 0.0  # EWMA of slot hold time, for Retry-After
+        self.admitted = 0
+        self.rejected_full = 0
+        self.timeouts = 0
+
+    def _retry_after(self) -> float:
+        per_slot = (self._service_ms or 100.0) / 1000.0
+        return max(1.0, per_slot * (self._queued + 1) / self.slots)
+
+    async def acquire(self, tenant: str, timeout: float) -> None:
+        if self._active < self.slots and self._queued == 0:
+            self._active += 1
+            self.admitted += 1
+            return
+        if self._queued >= self.max_queue and not self._evict_for(tenant):
+            self.rejected_full += 1
+            raise AdmissionRejected(self._retry_after(), "Compute queue full")
+        fut = asyncio.get_running_loop().create_future()
+        q = self._queues.get(tenant)
+        if not q:
+            q = self._queues[tenant] = deque()
+            # A tenant that was idle starts at the current clock, not with banked credit
+            self._vtime[tenant] = max(self._vtime.get(tenant, 0.0), self._vclock)
+        q.append(fut)
+        self._queued += 1
+        try:
+            await asyncio.wait_for(fut, timeout)
+        except BaseException as exc:
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                self.release(0.0)  # granted at the same moment we gave up
+            elif fut in q:
+                q.remove(fut)
+                self._queued -= 1
+            if isinstance(exc, asyncio.TimeoutError):
+                self.timeouts += 1
+                raise AdmissionRejected(self._retry_after(), "Compute queue timeout")
+            raise
+        self.admitted += 1
+
+    def _evict_for(self, tenant: str) -> bool:
+        """Full queue: push out the newest waiter of the most-queued tenant if it holds more than `tenant`."""
+        own = len(self._queues.get(tenant, ()))
+        heaviest = max(self._queues, key=lambda t: len(self._queues[t]), default=None)
+        if heaviest is None or len(self._queues[heaviest]) <= own + 1:
+            return False
+        fut = self._queues[heaviest].pop()
+        self._queued -= 1
+        self.rejected_full += 1
+        if not fut.done():
+            fut.set_exception(AdmissionRejected(self._retry_after(), "Compute queue full"))
+        return True
+
+    def release(self, held_ms: float) -> None:
+        if held_ms:
+            self._service_ms = held_ms if not self._service_ms else 0.9 * self._service_ms + 0.1 * held_ms
+        self._active -= 1
+        self._grant()
+
+    def _grant(self) -> None:
+        while self._active < self.slots and self._queued:
+            tenant = min((t for t, q in self._queues.items() if q), key=self._vtime.__getitem__)
+            q = self._queues[tenant]
+            fut = q.popleft()
+            self._queued -= 1
+            if not q:
+                del self._queues[tenant]
+            if fut.done():  # waiter already gone
+                continue
+            self._vclock = self._vtime[tenant]
+            self._vtime[tenant] += 1.0 / self.weights.get(tenant.split("/", 1)[-1], 1.0)
+            self._active += 1
+            fut.set_result(True)
+
+    def stats(self) -> dict:
+        return {
+            "slots": self.slots,
+            "active": self._active,
+            "queued": self._queued,
+            "max_queue": self.max_queue,
+            "queued_by_tenant": {t: len(q) for t, q in self._queues.items() if q},
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_full,
+            "queue_timeouts": self.timeouts,
+            "avg_service_ms": round(self._service_ms, 2),
+        }
+
+
+def _parse_weights(raw: str) -> dict:
+    """'branch_code:weight,...' -> {branch_code: weight}"""
+    weights = {}
+    for item in filter(None, (p.strip() for p in raw.split(","))):
+        code, _, w = item.rpartition(":")
+        if not code:
+            raise ValueError(f"ADMISSION_TENANT_WEIGHTS entry {item!r} must be branch_code:weight")
+        weights[code] = float(w)
+    return weights
+
+
+rate_limiter = RateLimiter(
+    settings.RATE_LIMIT_WINDOW,
+    settings.RATE_LIMIT_ORG_REQUESTS,
+    settings.RATE_LIMIT_BRANCH_REQUESTS,
+    settings.RATE_LIMIT_REQUESTS,
+)
+scheduler = FairScheduler(
+    settings.FACE_COMPUTE_SLOTS,
+    settings.ADMISSION_QUEUE_MAX,
+    _parse_weights(settings.ADMISSION_TENANT_WEIGHTS),
+)
+
+
+def _retry_header(seconds: float) -> dict:
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+
+class ComputeSlot:
+    """One held compute slot. release() is idempotent and safe from any thread."""
+
+    def __init__(self, held: bool):
+        self._held = held
+        self._detached = False
+        self._lock = threading.Lock()
+        self._loop = asyncio.get_running_loop() if held else None
+        self._t0 = time.perf_counter()
+
+    def detach(self) -> "ComputeSlot":
+        """Keep the slot past the end of the handler; the caller now owns release()."""
+        self._detached = True
+        return self
+
+    def release(self) -> None:
+        with self._lock:
+            if not self._held:
+                return
+            self._held = False
+        held_ms = (time.perf_counter() - self._t0) * 1000
+        # The scheduler's futures belong to the event loop
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            scheduler.release(held_ms)
+        else:
+            self._loop.call_soon_threadsafe(scheduler.release, held_ms)
+
+
+async def admit_face_compute(tenant=Depends(tenant_context)):
+    """Route dependency: rate-limit the tenant, then hold a compute slot for the request.
+
+    Keys come from the branch row tenant_context resolved, not from the raw
+    headers, so a client cannot mint fresh buckets or queue tenants, and an
+    unknown branch is turned away before it takes a place in the queue.
+    """
+    if not settings.ADMISSION_ENABLED:
+        yield ComputeSlot(False)
+        return
+    org, branch = tenant["org_id"], tenant["branch_code"]
+    wait = rate_limiter.check(org, str(tenant["branch_id"]), tenant["device_code"])
+    if wait:
+        raise HTTPException(429, "Rate limit exceeded", headers=_retry_header(wait))
+    try:
+        await scheduler.acquire(f"{org}/{branch}", settings.ADMISSION_QUEUE_TIMEOUT_MS / 1000.0)
+    except AdmissionRejected as exc:
+        raise HTTPException(503, exc.reason, headers=_retry_header(exc.retry_after))
+    slot = ComputeSlot(True)
+    try:
+        yield slot
+    finally:
+        if not slot._detached:
+            slot.release()
+
+
+def stats() -> dict:
+    return {"enabled": settings.ADMISSION_ENABLED, "rate_limited": rate_limiter.rejected, **scheduler.stats()}
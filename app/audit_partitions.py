@@ -0,0 +1,75 @@
+"""
+Partition maintenance for auth_audit (monthly range partitions).
+
+Partitions are named auth_audit_yYYYYmMM by auth_audit_ensure_partition() in
+migrations.sql. Dropping a whole partition is how retention is enforced; no
+row-level DELETE ever runs against the audit table. created_at and the rollup
+buckets are naive UTC, so months and cutoffs are taken in UTC as well.
+"""
+
+import datetime
+import re
+
+from sqlalchemy import text
+
+from .core.config import settings
+from .database import engine
+
+_PART_RE = re.compile(r"^auth_audit_y(\d{4})m(\d{2})$")
+
+
+def _this_month() -> datetime.date:
+    return datetime.datetime.now(datetime.timezone.utc).date().replace(day=1)
+
+
+def _add_months(d: datetime.date, months: int) -> datetime.date:
+    y, m = divmod(d.year * 12 + (d.month - 1) + months, 12)
+    return datetime.date(y, m + 1, 1)
+
+
+def ensure_partitions(conn, months_ahead: int) -> list[str]:
+    """Create partitions for the current month and the next months_ahead months."""
+    this_month = _this_month()
+    return [
+        conn.execute(text("SELECT auth_audit_ensure_partition(:m)"), {"m": _add_months(this_month, i)}).scalar()
+        for i in range(months_ahead + 1)
+    ]
+
+
+def drop_expired_partitions(conn, retention_months: int) -> list[str]:
+    """Detach and drop partitions whose whole month is older than the retention window."""
+    cutoff = _add_months(_this_month(), -retention_months)
+    rows = conn.execute(text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'auth_audit'::regclass
+    """)).fetchall()
+    dropped = []
+    for (name,) in rows:
+        m = _PART_RE.match(name)
+        if not m:
+            continue
+        month_end = _add_months(datetime.date(int(m.group(1)), int(m.group(2)), 1), 1)
+        if month_end <= cutoff:
+            conn.execute(text(f'ALTER TABLE auth_audit DETACH PARTITION "{name}"'))
+            conn.execute(text(f'DROP TABLE "{name}"'))
+            dropped.append(name)
+    return dropped
+
+
+def prune_rollups(conn, retention_days: int) -> int:
+    res = conn.execute(text("""
+        DELETE FROM auth_audit_hourly WHERE bucket < (NOW() AT TIME ZONE 'UTC') - make_interval(days => :d)
+    """), {"d": retention_days})
+    return res.rowcount or 0
+
+
+def maintain() -> dict:
+    """Run all audit maintenance in one transaction; safe to call from every worker."""
+    with engine.begin() as conn:
+        # Serialize concurrent callers (startup of several workers, cron)
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('auth_audit_maintenance'))"))
+        created = ensure_partitions(conn, settings.AUDIT_PARTITION_PREMAKE_MONTHS)
+        dropped = drop_expired_partitions(conn, settings.AUDIT_RETENTION_MONTHS)
+        pruned = prune_rollups(conn, settings.AUDIT_ROLLUP_RETENTION_DAYS)
+    return {"partitions": created, "dropped": dropped, "rollup_rows_pruned": pruned}
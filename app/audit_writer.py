@@ -0,0 +1,303 @@
+"""
+Buffered, asynchronous writer for auth_audit.
+
+Verification endpoints enqueue audit rows and return immediately; a background
+thread drains the queue in batches (COPY on psycopg, multi-row INSERT otherwise)
+when AUDIT_BATCH_SIZE rows are pending or AUDIT_FLUSH_INTERVAL_MS has elapsed.
+Async routes enqueue with asubmit/asubmit_rows, which never hold up the event
+loop on a full queue.
+"""
+
+import datetime
+import os
+import threading
+import time
+from collections import deque
+from typing import Iterable, Optional
+
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+
+from .core.config import settings
+from .database import engine
+
+AUDIT_COLUMNS = ("user_id", "branch_id", "device_code", "challenge", "ok", "confidence", "created_at")
+
+_INSERT_SQL = text("""
+  INSERT INTO auth_audit(user_id, branch_id, device_code, challenge, ok, confidence, created_at)
+  VALUES(:user_id, :branch_id, :device_code, :challenge, :ok, :confidence, :created_at)
+""")
+
+_ROLLUP_SQL = text("""
+  INSERT INTO auth_audit_hourly AS h
+    (branch_id, device_code, bucket, attempts, successes, confidence_sum, confidence_hist)
+  VALUES (:branch_id, :device_code, :bucket, :attempts, :successes, :confidence_sum, CAST(:hist AS BIGINT[]))
+  ON CONFLICT (branch_id, device_code, bucket) DO UPDATE SET
+    attempts = h.attempts + EXCLUDED.attempts,
+    successes = h.successes + EXCLUDED.successes,
+    confidence_sum = h.confidence_sum + EXCLUDED.confidence_sum,
+    confidence_hist = ARRAY(
+      SELECT x + y FROM unnest(h.confidence_hist, EXCLUDED.confidence_hist) WITH ORDINALITY AS u(x, y, i)
+      ORDER BY i
+    )
+""")
+
+HIST_BUCKETS = 10
+
+
+def audit_row(user_id, branch_id, device_code, challenge, ok, confidence) -> tuple:
+    """Build a row in AUDIT_COLUMNS order, stamped with the time of the event."""
+    return (user_id, branch_id, device_code, challenge, bool(ok), float(confidence),
+            datetime.datetime.now(datetime.timezone.utc))
+
+
+def _utc(ts: datetime.datetime) -> datetime.datetime:
+    """auth_audit stores naive UTC (TIMESTAMP columns); a naive input is taken to be UTC already."""
+    if ts.tzinfo is None:
+        return ts
+    return ts.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _rollup(rows: list[tuple]) -> list[dict]:
+    """Aggregate a batch of naive-UTC rows into per (branch, device, UTC hour) rollup increments."""
+    acc: dict[tuple, dict] = {}
+    for _, branch_id, device_code, _, ok, confidence, created_at in rows:
+        bucket = created_at.replace(minute=0, second=0, microsecond=0)
+        key = (branch_id if branch_id is not None else -1, device_code or "", bucket)
+        agg = acc.get(key)
+        if agg is None:
+            agg = acc[key] = {"branch_id": key[0], "device_code": key[1], "bucket": bucket,
+                              "attempts": 0, "successes": 0, "confidence_sum": 0.0,
+                              "hist": [0] * HIST_BUCKETS}
+        agg["attempts"] += 1
+        agg["successes"] += 1 if ok else 0
+        agg["confidence_sum"] += confidence
+        agg["hist"][min(max(int(confidence * HIST_BUCKETS), 0), HIST_BUCKETS - 1)] += 1
+    return list(acc.values())
+
+
+def write_audit_rows(conn, rows: list[tuple]) -> None:
+    """Write audit rows plus rollup increments on an open connection (caller owns the transaction)."""
+    if not rows:
+        return
+    # Either path would otherwise cast an aware datetime differently (COPY drops the offset,
+    # a bound parameter converts to the session time zone)
+    rows = [row[:-1] + (_utc(row[-1]),) for row in rows]
+    raw = conn.connection.driver_connection
+    if conn.dialect.driver == "psycopg":
+        with raw.cursor() as cur:
+            with cur.copy(f"COPY auth_audit ({', '.join(AUDIT_COLUMNS)}) FROM STDIN") as cp:
+                for row in rows:
+                    cp.write_row(row)
+    else:
+        conn.execute(_INSERT_SQL, [dict(zip(AUDIT_COLUMNS, row)) for row in rows])
+    if conn.dialect.name == "postgresql":
+        # Sorted so concurrent workers lock rollup rows in the same order
+        increments = sorted(_rollup(rows), key=lambda r: (r["branch_id"], r["device_code"], r["bucket"]))
+        conn.execute(_ROLLUP_SQL, increments)
+
+
+def write_audit_batch(rows: list[tuple]) -> None:
+    """Write rows in a transaction of their own, bypassing the queue: all of them or none."""
+    with engine.begin() as conn:
+        write_audit_rows(conn, rows)
+
+
+class AuditWriter:
+    """Bounded in-process queue of audit rows with a single flushing thread."""
+
+    POLICIES = ("block", "drop_newest", "drop_oldest")
+
+    def __init__(self, batch_size: int, flush_interval_ms: int, max_queue: int,
+                 policy: str = "block", block_timeout_ms: int = 250, max_retries: int = 3):
+        if policy not in self.POLICIES:
+            raise ValueError(f"AUDIT_QUEUE_POLICY must be one of {self.POLICIES}")
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(1, flush_interval_ms) / 1000.0
+        self.max_queue = max(self.batch_size, max_queue)
+        self.policy = policy
+        self.block_timeout = block_timeout_ms / 1000.0
+        self.max_retries = max_retries
+        self._reset()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.last_flush_rows = 0
+        self.last_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def _reset(self) -> None:
+        # Called again in a forked child: locks and threads do not survive fork
+        self._pid = os.getpid()
+        self._queue: deque = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closing = False
+        self._force = False
+        self._inflight = 0
+
+    def _ensure_thread(self) -> None:
+        if self._pid != os.getpid():
+            self._reset()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    # ---- producer side ------------------------------------------------------
+    def submit(self, user_id, branch_id, device_code, challenge, ok, confidence) -> bool:
+        return self.submit_rows([audit_row(user_id, branch_id, device_code, challenge, ok, confidence)])
+
+    def submit_rows(self, rows: Iterable[tuple]) -> bool:
+        """Enqueue rows; returns False if any were dropped by the backpressure policy.
+
+        Under "block" this waits up to AUDIT_BLOCK_TIMEOUT_MS in all for room, so
+        async code must use asubmit/asubmit_rows instead.
+        """
+        accepted, _ = self._put(list(rows), self.block_timeout)
+        return accepted
+
+    async def asubmit(self, user_id, branch_id, device_code, challenge, ok, confidence) -> bool:
+        return await self.asubmit_rows([audit_row(user_id, branch_id, device_code, challenge, ok, confidence)])
+
+    async def asubmit_rows(self, rows: Iterable[tuple]) -> bool:
+        """submit_rows for the event loop: a full queue is waited on in the threadpool, not here."""
+        accepted, rest = self._put(list(rows), 0.0)
+        if rest:
+            accepted = await run_in_threadpool(self.submit_rows, rest) and accepted
+        return accepted
+
+    def _put(self, rows: list[tuple], timeout: float) -> tuple[bool, list[tuple]]:
+        """Enqueue rows, waiting at most timeout in all; (nothing dropped, rows left over by a 0 wait)."""
+        with self._cond:
+            self._ensure_thread()
+            accepted = True
+            deadline = time.monotonic() + timeout
+            for i, row in enumerate(rows):
+                if len(self._queue) >= self.max_queue:
+                    if self.policy == "drop_oldest":
+                        self._queue.popleft()
+                        self.dropped += 1
+                        accepted = False
+                    elif self.policy == "block":
+                        if timeout <= 0:
+                            self._cond.notify_all()
+                            return accepted, rows[i:]
+                        self._cond.notify_all()
+                        while len(self._queue) >= self.max_queue and not self._closing:
+                            remaining = deadline - time.monotonic()
+                            if remaining <= 0:
+                                break
+                            self._cond.wait(remaining)
+                    if len(self._queue) >= self.max_queue:
+                        self.dropped += 1
+                        accepted = False
+                        continue
+                self._queue.append(row)
+                self.enqueued += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+        return accepted, []
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wake the writer and wait until everything queued so far is written."""
+        with self._cond:
+            if self._thread is None or self._pid != os.getpid():
+                return not self._queue
+            self._force = True
+            self._cond.notify_all()
+            deadline = time.monotonic() + timeout
+            while self._queue or self._inflight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Flush pending rows and stop the writer thread (called on shutdown)."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+            thread = self._thread if self._pid == os.getpid() else None
+        if thread is not None:
+            thread.join(timeout)
+        elif self._queue:
+            self._write_batch(list(self._queue))
+            self._queue.clear()
+
+    # ---- consumer side ------------------------------------------------------
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._queue) < self.batch_size and not (self._closing or self._force):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if not self._queue:
+                    self._force = False
+                    if self._closing:
+                        return
+                    continue
+                n = min(len(self._queue), self.batch_size)
+                batch = [self._queue.popleft() for _ in range(n)]
+                self._inflight = n
+                # Room was freed: release blocked producers
+                self._cond.notify_all()
+            try:
+                self._write_batch(batch)
+            finally:
+                with self._cond:
+                    self._inflight = 0
+                    self._cond.notify_all()
+
+    def _write_batch(self, batch: list[tuple]) -> None:
+        for attempt in range(self.max_retries + 1):
+            t0 = time.perf_counter()
+            try:
+                with engine.begin() as conn:
+                    write_audit_rows(conn, batch)
+            except Exception as exc:
+                self.flush_errors += 1
+                if attempt >= self.max_retries:
+                    self.dropped += len(batch)
+                    print(f"[audit] dropped {len(batch)} rows after {attempt + 1} attempts: {exc}")
+                    return
+                time.sleep(min(2.0, 0.1 * 2 ** attempt))
+                continue
+            elapsed = (time.perf_counter() - t0) * 1000.0
+            self.flushes += 1
+            self.written += len(batch)
+            self.last_flush_rows = len(batch)
+            self.last_flush_ms = elapsed
+            self.total_flush_ms += elapsed
+            return
+
+    def stats(self) -> dict:
+        return {
+            "policy": self.policy,
+            "queue_depth": len(self._queue),
+            "max_queue": self.max_queue,
+            "batch_size": self.batch_size,
+            "flush_interval_ms": int(self.flush_interval * 1000),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "last_flush_rows": self.last_flush_rows,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+        }
+
+
+audit_writer = AuditWriter(
+    settings.AUDIT_BATCH_SIZE,
+    settings.AUDIT_FLUSH_INTERVAL_MS,
+    settings.AUDIT_QUEUE_MAX,
+    settings.AUDIT_QUEUE_POLICY,
+    settings.AUDIT_BLOCK_TIMEOUT_MS,
+)
@@ -1,19 +1,23 @@
 import os, datetime
 import jwt
-from passlib.context import CryptContext
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from .password_pool import password_pool
 
-pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
 JWT_SECRET = os.getenv("JWT_SECRET", "dev_secret")
 JWT_EXPIRE = int(os.getenv("JWT_EXPIRE_MINUTES", "1440"))
 security = HTTPBearer()
 
+# bcrypt runs in password_pool's processes; both raise PasswordPoolBusy when it is saturated
 def hash_password(password: str) -> str:
-    return pwd_ctx.hash(password)
+    return password_pool.hash(password)
 
 def verify_password(password: str, hash_: str) -> bool:
-    return pwd_ctx.verify(password, hash_)
+    return password_pool.verify_and_update(password, hash_)[0]
+
+def verify_and_update_password(password: str, hash_: str) -> tuple[bool, str | None]:
+    """Like verify_password, plus a replacement hash when hash_ uses an outdated bcrypt cost."""
+    return password_pool.verify_and_update(password, hash_)
 
 def create_token(sub: str) -> str:
     exp = datetime.datetime.utcnow() + datetime.timedelta(minutes=JWT_EXPIRE)
@@ -58,19 +58,85 @@ class Settings(BaseSettings):
     FACE_MODEL_PATH: str = "models/arcface_r100_v1"
     FACE_THRESHOLD: float = 0.6
     LIVENESS_MODEL_PATH: str = "models/liveness_model"
+    ARCFACE_MODEL_PATH: str = "app/models/arcface_r100.onnx"
+    ARCFACE_PRECISION: str = "fp32"  # fp32 | int8 (int8 model built by scripts/quantize_arcface.py)
+    ARCFACE_INT8_MODEL_PATH: str = "app/models/arcface_r100.int8.onnx"
+    IDENTIFY_MAX_FACES: int = 20  # faces embedded per frame by /face/identify_all
+    VERIFY_BATCH_SIZE: int = 32  # images per ONNX run in /face/verify_batch
+    VERIFY_BATCH_MAX_IMAGES: int = 256
+
+    # ===========================================
+    # Face Quality Gate & Enrollment Dedup (before inference / before storing)
+    # ===========================================
+    FACE_QUALITY_ENROLL: bool = True  # gate enroll_passport / enroll_live frames
+    FACE_QUALITY_VERIFY: bool = True  # gate verify_arc probes
+    FACE_QUALITY_MIN_SHARPNESS: float = 40.0  # Laplacian variance of the 112x112 crop
+    FACE_QUALITY_MIN_BRIGHTNESS: float = 40.0  # mean grey level of the crop, 0-255
+    FACE_QUALITY_MAX_BRIGHTNESS: float = 220.0
+    FACE_QUALITY_MIN_FACE_PX: int = 80  # shorter side of the face box
+    FACE_QUALITY_MAX_CENTER_OFFSET: float = 0.5  # 0 = centred, 1 = in a corner
+    ENROLL_DEDUP_ENABLED: bool = True  # skip near-duplicate frames at enroll_live
+    ENROLL_DEDUP_SIMILARITY: float = 0.92  # raw cosine at or above which a frame counts as a duplicate
+    ENROLL_MAX_TEMPLATES_PER_USER: int = 10  # per model version; 0 = no cap
+
+    # ===========================================
+    # Org-wide Search (/face/verify_arc scope=org)
+    # ===========================================
+    ORG_SEARCH_THREADS: int = 8  # concurrent branch searches per worker
+    ORG_SEARCH_BUDGET_MS: int = 500  # branches slower than this are left out (partial result)
+    ORG_SEARCH_MAX_INFLIGHT: int = 64  # shard searches queued or running per worker; larger orgs go in waves, none free -> 503
+    ORG_SEARCH_TOP_K: int = 5
+
+    # ===========================================
+    # Video Identification (/face/identify_video)
+    # ===========================================
+    VIDEO_MAX_SECONDS: float = 15.0  # frames beyond this are not decoded
+    VIDEO_FRAME_STRIDE: int = 2  # run detection on every Nth frame
+    VIDEO_TRACK_IOU: float = 0.3
+    VIDEO_TRACK_MAX_MISSED: int = 5  # processed frames before a track is closed
+    VIDEO_REEMBED_QUALITY_GAIN: float = 1.3  # re-embed when face quality beats the last crop by this factor
+    VIDEO_MIN_TRACK_HITS: int = 2  # drop one-frame detections
+
+    # ===========================================
+    # ONNX Runtime Session Profile
+    # ===========================================
+    ONNX_GRAPH_OPTIMIZATION: str = "all"  # disable | basic | extended | all
+    ONNX_EXECUTION_MODE: str = "sequential"  # sequential | parallel
+    ONNX_INTRA_OP_THREADS: int = 0  # 0 = available CPUs // WEB_CONCURRENCY
+    ONNX_INTER_OP_THREADS: int = 1  # only used in parallel mode
+    ONNX_ALLOW_SPINNING: bool = False  # spinning burns CPU other workers could use
+    ONNX_CPU_MEM_ARENA: bool = True
+    ONNX_MEM_PATTERN: bool = True
+    ONNX_CACHE_OPTIMIZED_MODEL: bool = True  # persist the optimized graph across restarts
+    ONNX_OPTIMIZED_MODEL_DIR: str = ""  # default: next to the model
+    ONNX_IO_BINDING: bool = True  # reuse preallocated input/output buffers
     
     # ===========================================
     # Performance Configuration
     # ===========================================
     WEB_CONCURRENCY: int = 4
-    RATE_LIMIT_REQUESTS: int = 100
+    WARMUP_ON_STARTUP: bool = True  # load models in the background; /ready waits for it
+    RATE_LIMIT_REQUESTS: int = 100  # per device per window on face compute routes
     RATE_LIMIT_WINDOW: int = 60
+    RATE_LIMIT_BRANCH_REQUESTS: int = 1000  # 0 disables this level
+    RATE_LIMIT_ORG_REQUESTS: int = 5000
+
+    # ===========================================
+    # Admission Control (face compute)
+    # ===========================================
+    ADMISSION_ENABLED: bool = True
+    FACE_COMPUTE_SLOTS: int = 2  # concurrent face/liveness requests per worker
+    ADMISSION_QUEUE_MAX: int = 64  # waiting requests before 503
+    ADMISSION_QUEUE_TIMEOUT_MS: int = 2000
+    ADMISSION_TENANT_WEIGHTS: str = ""  # "branch_code:weight,..." (default weight 1)
     
     # ===========================================
     # File Upload Configuration
     # ===========================================
-    MAX_FILE_SIZE: int = 10485760  # 10MB
-    ALLOWED_EXTENSIONS: str = "jpg,jpeg,png"
+    MAX_FILE_SIZE: int = 10485760  # 10MB per image, enforced while reading
+    ALLOWED_EXTENSIONS: str = "jpg,jpeg,png"  # checked against the file's signature bytes
+    MAX_VIDEO_SIZE: int = 52428800  # 50MB per /face/identify_video clip
+    MAX_REQUEST_SIZE: int = 104857600  # 100MB whole request body
     
     # ===========================================
     # Logging Configuration
@@ -92,7 +158,108 @@ class Settings(BaseSettings):
     # ===========================================
     SENTRY_DSN: str = ""
     HEALTH_CHECK_INTERVAL: int = 30
-    
+
+    # ===========================================
+    # Diagnostics Configuration
+    # ===========================================
+    FLIGHT_RECORDER_ENABLED: bool = True
+    SLOW_REQUEST_BUFFER_SIZE: int = 50  # N slowest requests kept
+    SLOW_REQUEST_WINDOW_SECONDS: int = 3600  # entries older than this are evicted
+    SLOW_REQUEST_THRESHOLD_MS: int = 1000  # stack sampling starts past this
+    SLOW_REQUEST_SAMPLE_INTERVAL_MS: int = 10
+    SLOW_REQUEST_MAX_STACKS: int = 20  # distinct stacks kept per request
+
+    # ===========================================
+    # Audit Writer Configuration
+    # ===========================================
+    AUDIT_BATCH_SIZE: int = 500  # rows per COPY / multi-row INSERT
+    AUDIT_FLUSH_INTERVAL_MS: int = 1000
+    AUDIT_QUEUE_MAX: int = 20000  # bounded memory per worker
+    AUDIT_QUEUE_POLICY: str = "block"  # block | drop_newest | drop_oldest
+    AUDIT_BLOCK_TIMEOUT_MS: int = 250  # max producer wait under "block"
+    AUDIT_RETENTION_MONTHS: int = 12  # monthly partitions older than this are dropped
+    AUDIT_PARTITION_PREMAKE_MONTHS: int = 2
+    AUDIT_ROLLUP_RETENTION_DAYS: int = 730
+
+    # ===========================================
+    # Gallery Index (memory-mapped, shared by the workers on a host)
+    # ===========================================
+    GALLERY_INDEX_ENABLED: bool = True
+    GALLERY_INDEX_DIR: str = "var/gallery_index"
+    GALLERY_INDEX_POLL_S: float = 5.0  # writer heartbeat / catch-up interval besides NOTIFY
+    GALLERY_INDEX_MAX_STALENESS_S: float = 60.0  # readers use Postgres if the writer is silent longer
+    GALLERY_INDEX_VERIFY_S: float = 300.0  # writer compares segments with Postgres this often (0 = never)
+    GALLERY_CHANGELOG_RETENTION_HOURS: int = 24
+    GALLERY_SNAPSHOT_PATH: str = ""  # snapshot (scope all) the writer may start from instead of a full rebuild
+
+    # ===========================================
+    # Embedding Versions (model swaps / re-embedding)
+    # ===========================================
+    EMBEDDING_VERSION_POLL_S: float = 10.0  # how often workers check for a cutover
+    REEMBED_WORKERS: int = 0  # scripts/reembed.py processes; 0 = available CPUs
+    REEMBED_BATCH_SIZE: int = 64  # images per process task and per checkpoint commit
+
+    # ===========================================
+    # Duplicate Identity Scan (scripts/duplicate_scan.py)
+    # ===========================================
+    DUPLICATE_SCAN_SIMILARITY: float = 0.6  # raw cosine at or above which two accounts are reported
+    DUPLICATE_SCAN_BLOCK: int = 1024  # rows per matmul tile side (1024 x 1024 float32 = 4 MB)
+    DUPLICATE_SCAN_THREADS: int = 0  # 0 = available CPUs
+    DUPLICATE_SCAN_MAX_PAIRS: int = 100000  # a run aborts past this many pairs (threshold too low)
+
+    # ===========================================
+    # Account Sharing Detection (in-process, per worker)
+    # ===========================================
+    SHARING_DETECTOR_ENABLED: bool = True
+    SHARING_TRAVEL_WINDOW_S: float = 600.0  # same user verified at two branches within this
+    SHARING_DEVICE_WINDOW_S: float = 300.0
+    SHARING_DEVICE_MAX_IDENTITIES: int = 5  # distinct users one device may verify per window
+    SHARING_ALERT_COOLDOWN_S: float = 600.0  # one alert per user / device per cooldown
+    SHARING_ALERTS_MAX: int = 1000  # alerts kept for /admin/sharing_alerts
+    SHARING_MAX_TRACKED: int = 100000  # users and devices held in memory
+
+    # ===========================================
+    # Image Storage (content-addressed, archive renditions)
+    # ===========================================
+    IMAGE_TRANSCODE_ENABLED: bool = True  # background transcoder thread per worker
+    IMAGE_TRANSCODE_POLL_S: float = 30.0
+    IMAGE_TRANSCODE_BATCH: int = 16  # rows claimed per step and transaction
+    IMAGE_ARCHIVE_FORMAT: str = "jpeg"  # jpeg | webp
+    IMAGE_ARCHIVE_MAX_PX: int = 640  # long side of the rendition
+    IMAGE_ARCHIVE_QUALITY: int = 85
+    IMAGE_ARCHIVE_FACE_MARGIN: float = 2.5  # crop side as a multiple of the face box
+    IMAGE_DROP_ORIGINAL: bool = False  # drop uploads once embedded with the active version
+
+    # ===========================================
+    # Enrollment Jobs (/face/enroll_jobs, Postgres-backed queue)
+    # ===========================================
+    ENROLL_JOBS_ENABLED: bool = True  # run the worker pool in this process
+    ENROLL_JOB_WORKERS: int = 1  # threads per API worker
+    ENROLL_JOB_POLL_S: float = 2.0
+    ENROLL_JOB_STALE_S: float = 120.0  # a running job without heartbeat for this long is taken over
+    ENROLL_JOB_MAX_ATTEMPTS: int = 3
+    ENROLL_JOB_MAX_FRAMES: int = 200
+    ENROLL_JOB_PROGRESS_S: float = 0.5  # frame progress is written at most this often
+    ENROLL_JOB_RETENTION_H: int = 72  # finished jobs are deleted after this
+
+    # ===========================================
+    # Edge Mode (kiosk: SQLite + in-memory index, app/edge_app.py)
+    # ===========================================
+    EDGE_DB_PATH: str = "faceid_edge.db"
+    EDGE_SERVER_URL: str = ""  # central API for scripts/edge_sync.py
+    EDGE_SERVER_API_KEY: str = ""  # the central INTERNAL_API_KEY
+    EDGE_BRANCH_CODE: str = ""  # branch to pull
+    EDGE_KIOSK_ID: str = ""  # default: host name
+    EDGE_AUDIT_PUSH_BATCH: int = 5000
+
+    # ===========================================
+    # Password Hashing Configuration
+    # ===========================================
+    BCRYPT_ROUNDS: int = 12  # hashes with a different cost are upgraded on next login
+    PASSWORD_POOL_WORKERS: int = 2  # processes per API worker; 0 hashes inline
+    PASSWORD_POOL_MAX_PENDING: int = 32  # queued + running hashes before 503
+    PASSWORD_POOL_TIMEOUT_MS: int = 5000
+
     # ===========================================
     # Development/Testing
     # ===========================================
@@ -0,0 +1,192 @@
+"""
+Offline scan for enrolled accounts that carry the same face (duplicate
+sign-ups, shared accounts).
+
+The scope's gallery (active model version) is exported to a temporary
+gallery snapshot and memory-mapped, so the scan holds only small blocks in
+memory whatever the gallery size. "New" rows are split into blocks of
+DUPLICATE_SCAN_BLOCK rows. Each block is multiplied against every
+DUPLICATE_SCAN_BLOCK-row column block of the gallery; a 1024x1024 float32
+tile is 4 MB, so tiles stay in cache. Only entries at or above the threshold
+leave the tile. Row blocks run concurrently on DUPLICATE_SCAN_THREADS
+threads; NumPy releases the GIL during the matmul.
+
+A pair (row, col) is kept only if the two embeddings belong to different
+users and col has the lower embedding id, so every pair is compared once.
+That rule is also what makes nightly runs incremental. duplicate_scan_state
+keeps the highest embedding id scanned per scope and model version, and only
+rows above it count as new. Each run therefore costs new x gallery, not
+gallery x gallery.
+
+Embedding ids are assigned before commit, so an embedding can commit below
+the watermark after a run. The state also keeps the xmin of the run's
+snapshot; embeddings logged in face_embedding_changes by a transaction at or
+above it are scanned again, against the whole gallery in both directions.
+That relies on the change log, so a scope not scanned within
+GALLERY_CHANGELOG_RETENTION_HOURS gets a full run instead.
+
+Hits are reduced to one row per user pair in duplicate_identity_pairs (best
+similarity, with the embeddings and branches that produced it).
+"""
+
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import text
+
+from .core.config import settings
+from .database import engine
+from .face_engine_arcface import _available_cpus
+from .gallery_snapshot import export_snapshot, parse_scope, read_snapshot
+
+
+def _scan_rows(snap, rows: np.ndarray, threshold: float, block: int, col_min_ids: np.ndarray,
+               ordered: bool = True) -> list[tuple]:
+    """Hits (sim, row, col) of one row block against the whole gallery; ordered: only cols with a lower id."""
+    q = np.asarray(snap.vecs[rows], dtype=np.float32)
+    q_ids, q_users = snap.emb_ids[rows], snap.user_ids[rows]
+    q_max = q_ids.max()
+    out = []
+    for j, j0 in enumerate(range(0, snap.count, block)):
+        if ordered and col_min_ids[j] >= q_max:
+            continue  # every column is newer than every row: that tile is compared the other way round
+        j1 = min(j0 + block, snap.count)
+        sims = q @ np.asarray(snap.vecs[j0:j1], dtype=np.float32).T
+        r, c = np.nonzero(sims >= threshold)
+        if not len(r):
+            continue
+        c_abs = c + j0
+        keep = q_users[r] != snap.user_ids[c_abs]
+        if ordered:
+            keep &= snap.emb_ids[c_abs] < q_ids[r]
+        out.extend(zip(sims[r[keep], c[keep]].tolist(), rows[r[keep]].tolist(), c_abs[keep].tolist()))
+    return out
+
+
+def find_pairs(snap, watermark: int = 0, threshold: Optional[float] = None, block: int = 0,
+               threads: int = 0, max_pairs: int = 0, late_ids=()) -> dict:
+    """Best hit per user pair among rows with embedding id > watermark, or in late_ids (embeddings at or
+    below it that committed after the last run): {(user_a, user_b): (sim, row_a, row_b)}."""
+    threshold = settings.DUPLICATE_SCAN_SIMILARITY if threshold is None else threshold
+    block = max(1, block or settings.DUPLICATE_SCAN_BLOCK)
+    threads = max(1, threads or settings.DUPLICATE_SCAN_THREADS or _available_cpus())
+    max_pairs = max_pairs or settings.DUPLICATE_SCAN_MAX_PAIRS
+    new = snap.emb_ids > watermark
+    new_rows = np.flatnonzero(new)
+    # Their pairs with older-id rows scanned before them were never seen: no id ordering for those
+    late_rows = np.flatnonzero(~new & np.isin(snap.emb_ids, np.asarray(late_ids, dtype=np.int64)))
+    # Rows are sorted by (branch, id), so within a branch about half of the tiles can be skipped
+    col_min_ids = np.array([snap.emb_ids[j:j + block].min() for j in range(0, snap.count, block)], dtype=np.int64)
+    pairs: dict[tuple[int, int], tuple[float, int, int]] = {}
+    with ThreadPoolExecutor(threads, thread_name_prefix="dup-scan") as pool:
+        blocks = [(new_rows[i:i + block], True) for i in range(0, len(new_rows), block)]
+        blocks += [(late_rows[i:i + block], False) for i in range(0, len(late_rows), block)]
+        for hits in pool.map(lambda blk: _scan_rows(snap, blk[0], threshold, block, col_min_ids, blk[1]), blocks):
+            for sim, r, c in hits:
+                a, b = int(snap.user_ids[r]), int(snap.user_ids[c])
+                key, ends = ((a, b), (r, c)) if a < b else ((b, a), (c, r))
+                if key not in pairs or sim > pairs[key][0]:
+                    pairs[key] = (sim, *ends)
+            if len(pairs) > max_pairs:
+                raise ValueError(f"more than {max_pairs} user pairs at similarity {threshold}; raise the threshold")
+    return pairs
+
+
+def scan(scope: str = "all", full: bool = False, threshold: Optional[float] = None) -> dict:
+    """Scan scope ('all', 'org:<id>', 'branch:<code>') and record the pairs; incremental unless full."""
+    parse_scope(scope)
+    t0 = time.perf_counter()
+    fd, path = tempfile.mkstemp(suffix=".fsnp")
+    os.close(fd)
+    try:
+        exported = export_snapshot(path, scope)
+        snap = read_snapshot(path, verify=False)
+        mv = snap.model_version
+        with engine.connect() as conn:
+            row = conn.execute(text("""
+                SELECT last_embedding_id, last_xmin,
+                       last_run_at > NOW() - make_interval(hours => :h) AS log_covers
+                FROM duplicate_scan_state WHERE scope = :s AND model_version = :mv
+            """), {"s": scope, "mv": mv, "h": settings.GALLERY_CHANGELOG_RETENTION_HOURS}).first()
+            incremental = not full and row is not None and row.last_xmin is not None and row.log_covers
+            watermark = row.last_embedding_id if incremental else 0
+            late = conn.execute(text("""
+                SELECT DISTINCT embedding_id FROM face_embedding_changes
+                WHERE op = 'I' AND embedding_id <= :w AND xid >= CAST(CAST(:x AS TEXT) AS xid8)
+            """), {"w": watermark, "x": row.last_xmin}).scalars().all() if incremental else []
+        pairs = find_pairs(snap, watermark, threshold, late_ids=late)
+        rows = [{"mv": mv, "a": a, "b": b, "sim": sim,
+                 "ea": int(snap.emb_ids[ra]), "eb": int(snap.emb_ids[rb]),
+                 "ba": int(snap.branch_ids[ra]), "bb": int(snap.branch_ids[rb])}
+                for (a, b), (sim, ra, rb) in pairs.items()]
+        top = int(snap.emb_ids.max()) if snap.count else watermark
+        branch_ids = [b["id"] for b in snap.branches()]
+        new_rows = int((snap.emb_ids > watermark).sum())
+        late_rows = int(np.isin(snap.emb_ids[snap.emb_ids <= watermark], np.asarray(late, dtype=np.int64)).sum())
+        del snap
+    finally:
+        os.remove(path)
+    with engine.begin() as conn:
+        if rows:
+            conn.execute(text("""
+                INSERT INTO duplicate_identity_pairs
+                  (model_version, user_a, user_b, similarity, embedding_a, embedding_b, branch_a, branch_b)
+                VALUES (:mv, :a, :b, :sim, :ea, :eb, :ba, :bb)
+                ON CONFLICT (model_version, user_a, user_b) DO UPDATE SET
+                  similarity = GREATEST(duplicate_identity_pairs.similarity, EXCLUDED.similarity),
+                  embedding_a = CASE WHEN EXCLUDED.similarity > duplicate_identity_pairs.similarity
+                                     THEN EXCLUDED.embedding_a ELSE duplicate_identity_pairs.embedding_a END,
+                  embedding_b = CASE WHEN EXCLUDED.similarity > duplicate_identity_pairs.similarity
+                                     THEN EXCLUDED.embedding_b ELSE duplicate_identity_pairs.embedding_b END,
+                  branch_a = CASE WHEN EXCLUDED.similarity > duplicate_identity_pairs.similarity
+                                  THEN EXCLUDED.branch_a ELSE duplicate_identity_pairs.branch_a END,
+                  branch_b = CASE WHEN EXCLUDED.similarity > duplicate_identity_pairs.similarity
+                                  THEN EXCLUDED.branch_b ELSE duplicate_identity_pairs.branch_b END,
+                  last_seen_at = NOW()
+            """), rows)
+        stale = 0
+        if full:
+            # A full run saw every pair of the scope: whatever this transaction did not touch is gone
+            stale = conn.execute(text("""
+                DELETE FROM duplicate_identity_pairs
+                WHERE model_version = :mv AND branch_a = ANY(:b) AND branch_b = ANY(:b)
+                  AND last_seen_at < NOW()
+            """), {"mv": mv, "b": branch_ids}).rowcount or 0
+        conn.execute(text("""
+            INSERT INTO duplicate_scan_state(scope, model_version, last_embedding_id, last_xmin, last_run_at)
+            VALUES (:s, :mv, :top, :x, NOW())
+            ON CONFLICT (scope, model_version) DO UPDATE SET
+              last_embedding_id = GREATEST(duplicate_scan_state.last_embedding_id, EXCLUDED.last_embedding_id),
+              last_xmin = EXCLUDED.last_xmin,
+              last_run_at = NOW()
+        """), {"s": scope, "mv": mv, "top": top, "x": exported["xmin"]})
+    return {"scope": scope, "model_version": mv, "full": watermark == 0, "from_embedding_id": watermark,
+            "gallery": exported["count"], "new_embeddings": new_rows, "late_embeddings": late_rows,
+            "pairs": len(rows), "removed": stale,
+            "seconds": round(time.perf_counter() - t0, 2)}
+
+
+def list_pairs(scope: str = "all", min_similarity: float = 0.0, limit: int = 100) -> list[dict]:
+    """Recorded pairs of the active model version within scope, most similar first."""
+    from .embedding_versions import active_version
+
+    kind, value = parse_scope(scope)
+    where = {"all": "TRUE", "org": "b.org_id = :v", "branch": "b.code = :v"}[kind]
+    with engine.connect() as conn:
+        mv, _ = active_version(conn)
+        rows = conn.execute(text(f"""
+            SELECT p.user_a, ua.email AS email_a, p.branch_a, p.user_b, ub.email AS email_b, p.branch_b,
+                   p.similarity, p.embedding_a, p.embedding_b, p.first_seen_at, p.last_seen_at
+            FROM duplicate_identity_pairs p
+            JOIN users ua ON ua.id = p.user_a
+            JOIN users ub ON ub.id = p.user_b
+            WHERE p.model_version = :mv AND p.similarity >= :min
+              AND EXISTS (SELECT 1 FROM branches b WHERE b.id IN (p.branch_a, p.branch_b) AND {where})
+            ORDER BY p.similarity DESC
+            LIMIT :n
+        """), {"mv": mv, "min": min_similarity, "v": value, "n": limit}).mappings().all()
+    return [dict(r) for r in rows]
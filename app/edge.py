@@ -0,0 +1,293 @@
+"""
+Edge mode: a branch kiosk that verifies locally, without Postgres.
+
+The kiosk keeps its branch in one SQLite file (EDGE_DB_PATH): the synced
+users and gallery templates, and an audit buffer. Search runs against an
+in-memory index, which is a unit-norm float32 matrix of the gallery; a
+1:N lookup is one matrix-vector product. app/edge_app.py serves
+/face/verify_arc and /face/verify_user on top of it with the central API's
+responses.
+
+scripts/edge_sync.py connects the kiosk to the central server:
+
+  * pull downloads the branch's gallery snapshot (GET /admin/gallery/snapshot,
+    see gallery_snapshot.py) and replaces the local gallery in one transaction;
+  * push sends buffered audit rows to POST /admin/edge/audit. The server keeps
+    the last row id it accepted per kiosk, so a push that is retried after a
+    lost response is not recorded twice.
+
+Serving processes notice a sync through SQLite's data_version and reload the
+index on their next request. Photos stay on the central server: a kiosk only
+needs templates to verify.
+
+EdgeStore(":memory:") needs no file and no server, so the same code is also
+a Postgres-free backend for tests (EdgeStore.add_embeddings seeds it).
+"""
+
+import datetime
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+from typing import Optional
+
+import numpy as np
+
+from .core.config import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS edge_state (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, email TEXT);
+CREATE TABLE IF NOT EXISTS embeddings (
+  id INTEGER PRIMARY KEY,
+  user_id INTEGER NOT NULL,
+  model_version TEXT NOT NULL,
+  vec BLOB NOT NULL  -- float32, unit norm
+);
+CREATE INDEX IF NOT EXISTS idx_embeddings_user ON embeddings(user_id);
+CREATE TABLE IF NOT EXISTS audit (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_id INTEGER,
+  device_code TEXT,
+  challenge TEXT,
+  ok INTEGER NOT NULL,
+  confidence REAL NOT NULL,
+  created_at TEXT NOT NULL
+);
+"""
+
+
+def _unit(vecs: np.ndarray) -> np.ndarray:
+    vecs = np.asarray(vecs, dtype=np.float32)
+    return vecs / (np.linalg.norm(vecs, axis=-1, keepdims=True) + 1e-9)
+
+
+class EdgeStore:
+    """The kiosk's SQLite file. One connection, shared by threads under a lock."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        # Names this file to the server, which keeps a push watermark per kiosk: a rebuilt file starts afresh
+        self._conn.execute("INSERT OR IGNORE INTO edge_state(key, value) VALUES ('store_id', lower(hex(randomblob(8))))")
+
+    def state(self) -> dict:
+        with self._lock:
+            return dict(self._conn.execute("SELECT key, value FROM edge_state").fetchall())
+
+    def generation(self) -> tuple[int, int]:
+        """Changes whenever the gallery may have: SQLite's data_version covers commits by other
+        connections (a sync in another process), the counter this object's own writes."""
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0], self._writes
+
+    def replace_gallery(self, emb_ids, user_ids, vecs, users: dict, model_version: str,
+                        branch: dict, cursor: int = 0) -> int:
+        """Swap in a branch gallery (e.g. from a snapshot) in one transaction; returns the row count."""
+        vecs = _unit(vecs)
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        with self._lock:
+            c = self._conn
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                c.execute("DELETE FROM embeddings")
+                c.execute("DELETE FROM users")
+                c.executemany("INSERT INTO embeddings(id, user_id, model_version, vec) VALUES (?, ?, ?, ?)",
+                              ((int(e), int(u), model_version, v.tobytes())
+                               for e, u, v in zip(emb_ids, user_ids, vecs)))
+                c.executemany("INSERT INTO users(id, email) VALUES (?, ?)",
+                              ((int(u), users.get(str(int(u)))) for u in np.unique(np.asarray(user_ids))))
+                c.executemany("INSERT OR REPLACE INTO edge_state(key, value) VALUES (?, ?)", [
+                    ("model_version", model_version), ("branch_id", str(branch["id"])),
+                    ("branch_code", branch["code"]), ("org_id", branch.get("org_id") or ""),
+                    ("snapshot_cursor", str(cursor)), ("pulled_at", now)])
+                c.execute("COMMIT")
+                self._writes += 1
+            except BaseException:
+                c.execute("ROLLBACK")
+                raise
+        return len(vecs)
+
+    def add_embeddings(self, user_id: int, vecs, model_version: str, email: Optional[str] = None) -> None:
+        """Append templates for a user (test fixtures, benchmarks)."""
+        with self._lock:
+            c = self._conn
+            c.execute("BEGIN")
+            c.execute("INSERT OR IGNORE INTO users(id, email) VALUES (?, ?)", (user_id, email))
+            c.executemany("INSERT INTO embeddings(user_id, model_version, vec) VALUES (?, ?, ?)",
+                          ((user_id, model_version, v.tobytes()) for v in _unit(np.atleast_2d(vecs))))
+            c.execute("INSERT OR IGNORE INTO edge_state(key, value) VALUES ('model_version', ?)", (model_version,))
+            c.execute("COMMIT")
+            self._writes += 1
+
+    def load_gallery(self, model_version: str, dim: int = 512) -> tuple[np.ndarray, np.ndarray]:
+        """(user_ids, unit-norm gallery matrix) of one model version."""
+        with self._lock:
+            rows = self._conn.execute("SELECT user_id, vec FROM embeddings WHERE model_version = ? ORDER BY id",
+                                      (model_version,)).fetchall()
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, dim), dtype=np.float32)
+        user_ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        gallery = np.frombuffer(b"".join(r[1] for r in rows), dtype=np.float32).reshape(len(rows), -1)
+        return user_ids, gallery
+
+    def record_audit(self, user_id, device_code, challenge: str, ok: bool, confidence: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO audit(user_id, device_code, challenge, ok, confidence, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, device_code, challenge, int(bool(ok)), float(confidence),
+                 datetime.datetime.now(datetime.timezone.utc).isoformat()))
+
+    def pending_audit(self, limit: int) -> list[dict]:
+        with self._lock:
+            cur = self._conn.execute("SELECT * FROM audit ORDER BY id LIMIT ?", (limit,))
+            names = [d[0] for d in cur.description]
+            return [dict(zip(names, r)) for r in cur.fetchall()]
+
+    def drop_audit(self, up_to_id: int) -> None:
+        """Forget audit rows the server has accepted."""
+        with self._lock:
+            self._conn.execute("DELETE FROM audit WHERE id <= ?", (up_to_id,))
+
+    def counts(self) -> dict:
+        with self._lock:
+            c = self._conn
+            return {"users": c.execute("SELECT count(*) FROM users").fetchone()[0],
+                    "embeddings": c.execute("SELECT count(*) FROM embeddings").fetchone()[0],
+                    "audit_pending": c.execute("SELECT count(*) FROM audit").fetchone()[0]}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class EdgeIndex:
+    """Resident gallery of an EdgeStore, reloaded when the store changes."""
+
+    def __init__(self, store: EdgeStore):
+        self.store = store
+        self.model_version: Optional[str] = None
+        # (user_ids, gallery, user_id -> row indexes), swapped as one reference so searches never see a mix
+        self._data = (np.zeros(0, dtype=np.int64), np.zeros((0, 512), dtype=np.float32), {})
+        self._version = None
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def __len__(self) -> int:
+        return len(self._data[0])
+
+    def refresh(self) -> None:
+        """Reload if the store changed since the last load (one PRAGMA per call)."""
+        version = self.store.generation()
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            model_version = self.store.state().get("model_version")
+            user_ids, gallery = self.store.load_gallery(model_version) if model_version else self._data[:2]
+            order = np.argsort(user_ids, kind="stable")
+            bounds = np.flatnonzero(np.diff(user_ids[order])) + 1
+            rows = {int(user_ids[g[0]]): g for g in np.split(order, bounds) if len(g)}
+            self._data = (user_ids, gallery, rows)
+            self.model_version = model_version
+            self._version = version
+            self.reloads += 1
+
+    def search(self, emb: np.ndarray) -> tuple[Optional[int], float]:
+        """Top-1 (user_id, raw cosine) over the gallery."""
+        user_ids, gallery, _ = self._data
+        if len(user_ids) == 0:
+            return None, 0.0
+        sims = gallery @ _unit(emb)
+        j = int(np.argmax(sims))
+        return int(user_ids[j]), float(sims[j])
+
+    def verify(self, emb: np.ndarray, user_id: int) -> tuple[float, int]:
+        """(best raw cosine, number of templates) of emb against one user's templates."""
+        _, gallery, rows = self._data
+        r = rows.get(int(user_id))
+        if r is None:
+            return 0.0, 0
+        return float(np.max(gallery[r] @ _unit(emb))), len(r)
+
+
+def kiosk_id(store: EdgeStore) -> str:
+    return f"{settings.EDGE_KIOSK_ID or socket.gethostname()}:{store.state()['store_id']}"
+
+
+def pull(store: EdgeStore, server: str, api_key: str, branch_code: str, timeout: float = 120.0) -> dict:
+    """Replace the local gallery with the branch's current gallery on the server."""
+    import httpx
+
+    from .gallery_snapshot import read_snapshot
+
+    fd, path = tempfile.mkstemp(suffix=".fsnp")
+    os.close(fd)
+    try:
+        with httpx.stream("GET", f"{server.rstrip('/')}/admin/gallery/snapshot",
+                          params={"scope": f"branch:{branch_code}"}, headers={"X-API-Key": api_key},
+                          timeout=timeout) as resp:
+            if resp.status_code != 200:
+                resp.read()
+                raise RuntimeError(f"snapshot download failed: {resp.status_code} {resp.text}")
+            with open(path, "wb") as f:
+                for chunk in resp.iter_bytes(1 << 20):
+                    f.write(chunk)
+        snap = read_snapshot(path, verify=True)
+        branch = next((b for b in snap.branches() if b["code"] == branch_code), None)
+        if branch is None:
+            raise RuntimeError(f"branch {branch_code} not in the snapshot")
+        n = store.replace_gallery(snap.emb_ids, snap.user_ids, np.asarray(snap.vecs, dtype=np.float32),
+                                  snap.meta.get("users", {}), snap.model_version, branch, snap.cursor)
+        result = {"branch": branch_code, "model_version": snap.model_version, "embeddings": n,
+                  "users": len(np.unique(snap.user_ids)), "cursor": snap.cursor}
+        del snap
+    finally:
+        os.remove(path)
+    return result
+
+
+def push(store: EdgeStore, server: str, api_key: str, batch: int = 0, timeout: float = 30.0) -> dict:
+    """Send buffered audit rows to the server, oldest first, and drop what it accepted."""
+    import httpx
+
+    batch = batch or settings.EDGE_AUDIT_PUSH_BATCH
+    branch_code = store.state().get("branch_code")
+    if not branch_code:
+        raise RuntimeError("nothing pulled yet: the kiosk does not know its branch")
+    sent = 0
+    with httpx.Client(timeout=timeout, headers={"X-API-Key": api_key}) as client:
+        while rows := store.pending_audit(batch):
+            resp = client.post(f"{server.rstrip('/')}/admin/edge/audit",
+                               json={"kiosk_id": kiosk_id(store), "branch_code": branch_code, "rows": rows})
+            if resp.status_code != 200:
+                raise RuntimeError(f"audit push failed: {resp.status_code} {resp.text}")
+            # Rows up to last_id are recorded centrally, including any a lost response hid from us
+            store.drop_audit(resp.json()["last_id"])
+            sent += len(rows)
+            if len(rows) < batch:
+                break
+    return {"rows_sent": sent, **store.counts()}
+
+
+_index: Optional[EdgeIndex] = None
+_index_lock = threading.Lock()
+
+
+def index() -> EdgeIndex:
+    """The serving process's index over EDGE_DB_PATH, opened on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = EdgeIndex(EdgeStore(settings.EDGE_DB_PATH))
+    _index.refresh()
+    return _index
@@ -0,0 +1,151 @@
+"""
+Kiosk API for edge mode (see app/edge.py): uvicorn app.edge_app:app
+
+Serves /face/verify_arc (branch scope) and /face/verify_user with the same
+requests and responses as the central API, against the synced branch in
+EDGE_DB_PATH. No Postgres is needed. Audit rows are buffered in SQLite
+until scripts/edge_sync.py pushes them.
+"""
+
+import threading
+
+from fastapi import Depends, FastAPI, File, Form, Header, HTTPException, UploadFile
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+from . import edge, sharing_detector
+from .core.config import settings
+from .face_engine_arcface import engine_arc
+from .nn import _boost_confidence_score
+from .quality_gate import quality_gate
+from .uploads import UploadLimitMiddleware, read_image
+
+app = FastAPI(title=f"{settings.PROJECT_NAME} (edge)", version=settings.APP_VERSION)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=settings.cors_origins_list,
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+app.add_middleware(UploadLimitMiddleware, max_bytes=settings.MAX_REQUEST_SIZE)
+
+_readiness = {"gallery": False, "face_engine": False}
+
+
+def edge_tenant(
+    x_org_id: str | None = Header(default=None),
+    x_branch_code: str | None = Header(default=None),
+    x_device_code: str | None = Header(default=None),
+) -> dict:
+    """tenant_context() for the one branch this kiosk holds."""
+    if not x_org_id or not x_branch_code:
+        raise HTTPException(400, "Missing X-Org-Id or X-Branch-Code")
+    state = edge.index().store.state()
+    if x_branch_code != state.get("branch_code"):
+        raise HTTPException(404, "Branch not found")
+    return {"org_id": x_org_id, "branch_id": int(state["branch_id"]), "device_code": x_device_code}
+
+
+def _embed(by: bytes):
+    """Quality gate (if on) and local embedding; (embedding, model_version)."""
+    bgr = box = None
+    if settings.FACE_QUALITY_VERIFY:
+        bgr, box, quality = quality_gate.check(engine_arc, by)
+        if box is None:
+            raise HTTPException(404, "No face detected")
+        if not quality["passed"]:
+            raise HTTPException(422, "Face quality too low: " + ", ".join(quality["reasons"]))
+    if box is None:
+        emb, model_version = engine_arc.versioned(engine_arc.embed, by)
+    else:
+        embs, model_version = engine_arc.versioned(engine_arc.embed_crops, bgr, [box])
+        emb = embs[0]
+    if emb is None:
+        raise HTTPException(404, "No face detected")
+    idx = edge.index()
+    if idx.model_version != model_version:
+        raise HTTPException(503, f"Gallery holds {idx.model_version} embeddings, the engine produces {model_version}")
+    return emb, idx
+
+
+@app.get("/")
+def root():
+    return {"status": "ok", "mode": "edge"}
+
+
+@app.get("/ready")
+def ready():
+    """200 once a gallery was pulled and the model is warm; 503 before that"""
+    _readiness["gallery"] = bool(edge.index().model_version)
+    body = {"ready": all(_readiness.values()), "components": _readiness}
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+
+@app.get("/edge/status")
+def status():
+    idx = edge.index()
+    return {"state": idx.store.state(), "counts": idx.store.counts(), "index_rows": len(idx),
+            "index_reloads": idx.reloads, "engine_model_version": engine_arc.model_version}
+
+
+@app.post("/face/verify_arc")
+async def verify_arc(file: UploadFile = File(...), scope: str = Form("branch"), tenant=Depends(edge_tenant)):
+    """Identify the face against the kiosk's branch gallery"""
+    if scope != "branch":
+        raise HTTPException(400, "Edge mode serves scope=branch only")
+    by = await read_image(file)
+
+    def _run():
+        emb, idx = _embed(by)
+        uid, sim = idx.search(emb)
+        if uid is None:
+            raise HTTPException(404, "No enrolled users in branch")
+        sim = _boost_confidence_score(sim)
+        idx.store.record_audit(uid, tenant["device_code"], "verify_arc", True, sim)
+        return uid, sim
+
+    uid, sim = await run_in_threadpool(_run)
+    sharing_detector.observe(uid, tenant["branch_id"], tenant["device_code"], sim >= settings.FACE_THRESHOLD)
+    return {"matched_user_id": uid, "confidence": sim, "branch_id": tenant["branch_id"]}
+
+
+@app.post("/face/verify_user")
+async def verify_user(file: UploadFile = File(...), user_id: int = Form(...), tenant=Depends(edge_tenant)):
+    """1:1 check of a probe against the claimed user's templates"""
+    by = await read_image(file)
+
+    def _run():
+        emb, idx = _embed(by)
+        sim, templates = idx.verify(emb, user_id)
+        if templates == 0:
+            raise HTTPException(404, "User has no enrolled face in branch")
+        sim = _boost_confidence_score(sim)
+        verified = sim >= settings.FACE_THRESHOLD
+        idx.store.record_audit(user_id, tenant["device_code"], "verify_user", verified, sim)
+        return sim, templates, verified
+
+    sim, templates, verified = await run_in_threadpool(_run)
+    sharing_detector.observe(user_id, tenant["branch_id"], tenant["device_code"], verified)
+    return {"user_id": user_id, "verified": verified, "confidence": sim, "templates": templates,
+            "branch_id": tenant["branch_id"]}
+
+
+def _warmup():
+    try:
+        engine_arc.warmup()
+        _readiness["face_engine"] = True
+    except Exception as exc:  # pragma: no cover
+        print(f"[edge] warmup failed: {exc}")
+
+
+@app.on_event("startup")
+def startup():
+    idx = edge.index()
+    print(f"[edge] {settings.EDGE_DB_PATH}: {len(idx)} templates, model {idx.model_version}, "
+          f"branch {idx.store.state().get('branch_code')}")
+    if settings.WARMUP_ON_STARTUP:
+        threading.Thread(target=_warmup, name="warmup", daemon=True).start()
+    else:
+        _readiness["face_engine"] = True
@@ -0,0 +1,94 @@
+"""
+Embedding model versions.
+
+face_embeddings.model_version records the model that produced each vector,
+and every search filters on the version the local engine is running, so
+vectors of two different models are never compared. embedding_versions has
+one row per version; the row with status 'active' is what the API serves.
+
+scripts/reembed.py builds a new version next to the active one and flips the
+statuses in one transaction. Each worker polls the active row every
+EMBEDDING_VERSION_POLL_S; on a change it loads the new model beside the
+running session and swaps it in (ArcFaceCPU.swap_model), so enrollment and
+search move over without a restart. Rows of the retired version stay until
+they are purged, so a worker that has not switched yet keeps matching.
+"""
+
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import text
+
+from .core.config import settings
+from .face_engine_arcface import engine_arc, resolve_model_path
+
+LEGACY_VERSION = "legacy"  # rows written before versioning; the version seeded as active
+
+
+def active_version(conn) -> tuple[str, Optional[str]]:
+    """(version, model_path) of the active row; a None model_path means the configured model."""
+    row = conn.execute(text("SELECT version, model_path FROM embedding_versions WHERE status = 'active'")).first()
+    return (row[0], row[1]) if row else (LEGACY_VERSION, None)
+
+
+class VersionWatcher:
+    """Keeps this worker's engine on the active embedding version."""
+
+    def __init__(self, poll_s: float):
+        self.poll = max(1.0, poll_s)
+        self.switches = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self.checked_at = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def sync(self) -> bool:
+        """Switch the engine if the active version changed; True if it did."""
+        from .database import engine as db_engine
+
+        with db_engine.connect() as conn:
+            version, model_path = active_version(conn)
+        self.checked_at = time.time()
+        if version == engine_arc.model_version:
+            return False
+        engine_arc.swap_model(model_path or resolve_model_path(), version)
+        self.switches += 1
+        print(f"[face] now serving embedding model version {version}")
+        return True
+
+    def _sync_logged(self) -> None:
+        try:
+            self.sync()
+        except Exception as exc:  # keep serving the current version; retried on the next poll
+            self.errors += 1
+            self.last_error = str(exc)
+            print(f"[face] embedding version check failed: {exc}")
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._sync_logged()  # before warmup, so the first load is already the active model
+        self._thread = threading.Thread(target=self._run, name="embedding-version-watcher", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.poll):
+            self._sync_logged()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {
+            "model_version": engine_arc.model_version,
+            "model_path": engine_arc.model_path,
+            "switches": self.switches,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "checked_at": self.checked_at,
+        }
+
+
+watcher = VersionWatcher(settings.EMBEDDING_VERSION_POLL_S)
@@ -0,0 +1,100 @@
+"""
+Enrollment helpers shared by the enrollment routes.
+
+select_templates() decides which frames of a live-enrollment burst become
+gallery templates. Bursts are mostly near-identical frames, and every stored
+template costs a face_images row and a slot in each later branch search.
+Frames are therefore taken best quality first, and a frame is dropped when
+its embedding is within ENROLL_DEDUP_SIMILARITY (cosine) of one of the user's
+existing templates or of a frame already kept from the same request. Only
+ENROLL_MAX_TEMPLATES_PER_USER templates are kept per user and model version.
+
+store_frames() writes the kept frames of a request: every face_images row in
+one multi-row INSERT ... RETURNING, then every embedding in one more, without
+committing. The route commits once, so an enrollment costs one commit (one WAL
+fsync) however many frames it has, and a failure part-way leaves nothing behind.
+Frame bytes go to image_blobs by content hash (image_store.put_many), so a
+frame uploaded before is not stored again.
+"""
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from . import models
+from .core.config import settings
+from .image_store import put_many
+from .nn import add_embeddings, load_user_templates
+
+
+def select_templates(candidates: list[dict], existing_ids: np.ndarray, existing: np.ndarray,
+                     threshold: float, cap: int) -> tuple[list[dict], list[dict]]:
+    """Split candidates ({"index", "embedding", "score", ...}) into (kept, skipped).
+
+    existing is the user's unit-norm template matrix with its embedding ids;
+    kept comes back in request order, each skipped entry says why.
+    """
+    room = max(0, cap - len(existing)) if cap > 0 else len(candidates)
+    kept: list[dict] = []
+    kept_vecs: list[np.ndarray] = []
+    skipped: list[dict] = []
+    # Stable sort: equal scores (e.g. quality gate off) keep arrival order
+    for c in sorted(candidates, key=lambda c: -c["score"]):
+        e = np.asarray(c["embedding"], dtype=np.float32)
+        e = e / (np.linalg.norm(e) + 1e-9)
+        if len(existing) and existing.shape[1] == e.size:
+            sims = existing @ e
+            j = int(np.argmax(sims))
+            if sims[j] >= threshold:
+                skipped.append({"index": c["index"], "reason": "duplicate",
+                                "duplicate_of_embedding": int(existing_ids[j]), "similarity": round(float(sims[j]), 4)})
+                continue
+        if kept_vecs:
+            sims = np.stack(kept_vecs) @ e
+            j = int(np.argmax(sims))
+            if sims[j] >= threshold:
+                skipped.append({"index": c["index"], "reason": "duplicate",
+                                "duplicate_of_frame": kept[j]["index"], "similarity": round(float(sims[j]), 4)})
+                continue
+        if len(kept) >= room:
+            skipped.append({"index": c["index"], "reason": "template_cap"})
+            continue
+        kept.append(c)
+        kept_vecs.append(e)
+    kept.sort(key=lambda c: c["index"])
+    skipped.sort(key=lambda s: s["index"])
+    return kept, skipped
+
+
+def dedup_candidates(db: Session, user_id: int, candidates: list[dict]) -> tuple[list[dict], list[dict]]:
+    """select_templates() against the user's stored templates, per model version, when ENROLL_DEDUP_ENABLED."""
+    if not settings.ENROLL_DEDUP_ENABLED:
+        return candidates, []
+    kept, duplicates = [], []
+    for version in sorted({c["model_version"] for c in candidates}):
+        group = [c for c in candidates if c["model_version"] == version]
+        ids, templates = load_user_templates(db, user_id, version, len(group[0]["embedding"]))
+        k, d = select_templates(group, ids, templates, settings.ENROLL_DEDUP_SIMILARITY,
+                                settings.ENROLL_MAX_TEMPLATES_PER_USER)
+        kept += k
+        duplicates += d
+    kept.sort(key=lambda c: c["index"])
+    return kept, duplicates
+
+
+def store_frames(db: Session, user_id: int, branch_id: int, frames: list[tuple]) -> list[int]:
+    """Add (filename, image_bytes, embedding, model_version) frames to the session's transaction; returns image ids."""
+    digests = put_many(db, [by for _, by, _, _ in frames])
+    return store_blob_frames(db, user_id, branch_id,
+                             [(name, h, emb, mv) for (name, _, emb, mv), h in zip(frames, digests)])
+
+
+def store_blob_frames(db: Session, user_id: int, branch_id: int, frames: list[tuple]) -> list[int]:
+    """store_frames() for frames already in image_blobs: (filename, sha256, embedding, model_version)."""
+    images = [models.FaceImage(user_id=user_id, filename=name, content_sha256=h) for name, h, _, _ in frames]
+    db.add_all(images)
+    db.flush()  # one INSERT ... VALUES (...), (...) RETURNING id for the whole batch
+    image_ids = [img.id for img in images]
+    for img in images:
+        db.expunge(img)  # the rows are written; drop the session's references to the bytes
+    add_embeddings(db, user_id, branch_id, [(emb, mv, iid) for (_, _, emb, mv), iid in zip(frames, image_ids)])
+    return image_ids
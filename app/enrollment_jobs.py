@@ -0,0 +1,351 @@
+"""
+Asynchronous enrollment jobs.
+
+POST /face/enroll_jobs stores the uploaded frames (in image_blobs, by
+content hash) with a queued enrollment_jobs row and answers 202 with the job
+id. A small worker pool in every API worker does the decode -> quality ->
+embed -> dedup -> write cycle that /face/enroll_live does inline, and
+GET /face/enroll_jobs/{id} reports progress frame by frame.
+
+Jobs live in Postgres, so they survive restarts. A worker claims a queued
+job with FOR UPDATE SKIP LOCKED and a fresh lease token, and heartbeats it
+while it runs. Work on a job whose heartbeat is older than
+ENROLL_JOB_STALE_S (its worker died) is claimed again, up to
+ENROLL_JOB_MAX_ATTEMPTS times.
+
+A job writes its face images and embeddings in one transaction, together
+with its "done" status, and only while it still holds the lease. A job is
+therefore stored exactly once, however often it is retried.
+
+Submissions are idempotent too. The client's Idempotency-Key header, or
+else a hash of the user, branch and frame contents, identifies the job, so
+a retried POST returns the existing job instead of queuing the work again.
+Finished jobs are deleted after ENROLL_JOB_RETENTION_H; their frames'
+blobs are then collected by the image transcoder unless an image uses them.
+"""
+
+import hashlib
+import json
+import threading
+import time
+import uuid
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .core.config import settings
+from .database import SessionLocal, engine
+from .enrollment import dedup_candidates, store_blob_frames
+from .image_store import put_many
+
+BLOB_FETCH_BATCH = 16  # frames whose bytes are read in one query; bounds what a job holds in memory
+
+
+class LeaseLost(Exception):
+    """Another worker took the job over (this one was presumed dead)."""
+
+
+def _job_key(requested_by: int, user_id: int, branch_id: int, digests: list[bytes],
+             idempotency_key: Optional[str]) -> str:
+    if idempotency_key:
+        return f"{requested_by}:{idempotency_key}"[:128]
+    h = hashlib.sha256(f"{user_id}:{branch_id}:".encode())
+    for d in digests:
+        h.update(d)
+    return "content:" + h.hexdigest()
+
+
+def submit(db: Session, user_id: int, branch_id: int, requested_by: int, frames: list[tuple],
+           idempotency_key: Optional[str] = None) -> tuple[int, bool]:
+    """Queue (filename, image_bytes) frames for user_id; (job id, False if an existing job was returned)."""
+    digests = put_many(db, [by for _, by in frames])
+    key = _job_key(requested_by, user_id, branch_id, digests, idempotency_key)
+    job_id = db.execute(text("""
+        INSERT INTO enrollment_jobs (idempotency_key, user_id, branch_id, requested_by, total_frames)
+        VALUES (:k, :u, :b, :r, :n)
+        ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING id
+    """), {"k": key, "u": user_id, "b": branch_id, "r": requested_by, "n": len(frames)}).scalar()
+    if job_id is None:
+        db.rollback()
+        job_id, status = db.execute(text("SELECT id, status FROM enrollment_jobs WHERE idempotency_key = :k"),
+                                    {"k": key}).one()
+        if status == "failed":
+            # Resubmitting a failed job runs it again, from scratch
+            db.execute(text("""
+                UPDATE enrollment_jobs SET status = 'queued', attempts = 0, processed_frames = 0, error = NULL,
+                       lease_token = NULL, finished_at = NULL
+                WHERE id = :id AND status = 'failed'
+            """), {"id": job_id})
+            db.execute(text("UPDATE enrollment_job_frames SET status = 'pending', detail = NULL WHERE job_id = :id"),
+                       {"id": job_id})
+            db.commit()
+            pool.wake()
+        return job_id, False
+    db.execute(text("""
+        INSERT INTO enrollment_job_frames (job_id, idx, filename, content_sha256)
+        SELECT :job, * FROM unnest(CAST(:i AS INT[]), CAST(:f AS VARCHAR[]), CAST(:h AS BYTEA[]))
+    """), {"job": job_id, "i": list(range(len(frames))),
+           "f": [name or f"job_{job_id}_{i}.jpg" for i, (name, _) in enumerate(frames)], "h": digests})
+    db.commit()
+    pool.wake()
+    return job_id, True
+
+
+def get(db: Session, job_id: int) -> Optional[dict]:
+    job = db.execute(text("""
+        SELECT id, user_id, branch_id, status, total_frames, processed_frames, attempts, result, error,
+               created_at, started_at, finished_at
+        FROM enrollment_jobs WHERE id = :id
+    """), {"id": job_id}).mappings().first()
+    if job is None:
+        return None
+    frames = db.execute(text("""
+        SELECT idx AS index, filename, status, image_id, detail FROM enrollment_job_frames
+        WHERE job_id = :id ORDER BY idx
+    """), {"id": job_id}).mappings().all()
+    out = dict(job)
+    out["progress"] = {"processed": job["processed_frames"], "total": job["total_frames"]}
+    out["frames"] = [{**{k: v for k, v in f.items() if k != "detail"}, **(f["detail"] or {})} for f in frames]
+    return out
+
+
+def _embed(by, bgr, box):
+    """(embedding, model_version) on the local engine; a job has no request to wait on a remote engine for."""
+    from .face_engine_arcface import engine_arc
+
+    if box is None:
+        return engine_arc.versioned(engine_arc.embed, by)
+    embs, model_version = engine_arc.versioned(engine_arc.embed_crops, bgr, [box])
+    return embs[0], model_version
+
+
+class EnrollmentJobPool:
+    """Worker threads that claim and run queued enrollment jobs."""
+
+    def __init__(self, workers: int, poll_s: float, stale_s: float, max_attempts: int):
+        self.workers = max(1, workers)
+        self.poll = max(0.1, poll_s)
+        self.stale = max(1.0, stale_s)
+        self.max_attempts = max(1, max_attempts)
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.leases_lost = 0
+        self.last_error: Optional[str] = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._last_purge = 0.0
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def claim(self) -> Optional[tuple[int, str]]:
+        """(job id, lease token) of the oldest runnable job, or None."""
+        while True:
+            token = uuid.uuid4().hex
+            with engine.begin() as conn:
+                row = conn.execute(text("""
+                    UPDATE enrollment_jobs SET status = 'running', lease_token = :t, attempts = attempts + 1,
+                           heartbeat_at = NOW(), started_at = COALESCE(started_at, NOW())
+                    WHERE id = (
+                      SELECT id FROM enrollment_jobs
+                      WHERE status = 'queued'
+                         OR (status = 'running' AND heartbeat_at < NOW() - make_interval(secs => :stale))
+                      ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED)
+                    RETURNING id, attempts, error
+                """), {"t": token, "stale": self.stale}).first()
+            if row is None:
+                return None
+            if row.attempts <= self.max_attempts:
+                return row.id, token
+            # That claim was not a real attempt
+            self._finish_failed(row.id, token, row.error or "worker died while running the job", uncount=True)
+
+    def _progress(self, job_id: int, token: str, updates: list[dict], processed: int) -> None:
+        with engine.begin() as conn:
+            if not conn.execute(text("""
+                UPDATE enrollment_jobs SET processed_frames = :p, heartbeat_at = NOW()
+                WHERE id = :id AND lease_token = :t AND status = 'running'
+            """), {"p": processed, "id": job_id, "t": token}).rowcount:
+                raise LeaseLost()
+            if updates:
+                conn.execute(text("""
+                    UPDATE enrollment_job_frames SET status = :status, detail = CAST(:detail AS JSONB)
+                    WHERE job_id = :job AND idx = :idx
+                """), [{**u, "job": job_id} for u in updates])
+
+    def _finish_failed(self, job_id: int, token: str, error: str, uncount: bool = False) -> None:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                UPDATE enrollment_jobs SET status = 'failed', error = :e, finished_at = NOW(), lease_token = NULL,
+                       attempts = attempts - :u
+                WHERE id = :id AND lease_token = :t
+            """), {"e": error, "u": int(uncount), "id": job_id, "t": token})
+        self.failed += 1
+        print(f"[enroll-jobs] job {job_id} failed: {error}")
+
+    def process(self, job_id: int, token: str) -> None:
+        """Run one claimed job to completion (or failure)."""
+        from .face_engine_arcface import engine_arc
+        from .quality_gate import quality_gate
+
+        with engine.connect() as conn:
+            job = conn.execute(text("SELECT user_id, branch_id FROM enrollment_jobs WHERE id = :id"),
+                               {"id": job_id}).one()
+            frames = conn.execute(text("""
+                SELECT idx, filename, content_sha256 FROM enrollment_job_frames WHERE job_id = :id ORDER BY idx
+            """), {"id": job_id}).fetchall()
+
+        rejected, candidates, pending = [], [], []
+        flushed = time.monotonic()
+        blobs: dict[bytes, bytes] = {}
+        for n, f in enumerate(frames, 1):
+            if (n - 1) % BLOB_FETCH_BATCH == 0:
+                # The next batch's bytes in one query: the original, or the rendition if an
+                # identical upload was enrolled and its original dropped
+                digests = list({g.content_sha256 for g in frames[n - 1:n - 1 + BLOB_FETCH_BATCH]})
+                with engine.connect() as conn:
+                    blobs = dict(conn.execute(text("""
+                        SELECT sha256, COALESCE(original, archive) FROM image_blobs WHERE sha256 = ANY(:h)
+                    """), {"h": digests}).fetchall())
+            by = blobs.get(f.content_sha256)
+            bgr = box = None
+            quality = {}
+            if settings.FACE_QUALITY_ENROLL:
+                bgr, box, quality = quality_gate.check(engine_arc, by)
+            if quality and not quality["passed"]:
+                detail = {"filename": f.filename, **quality}
+                rejected.append({"index": f.idx, **detail})
+                pending.append({"idx": f.idx, "status": "rejected", "detail": json.dumps(quality)})
+            else:
+                emb, model_version = _embed(by, bgr, box)
+                if emb is None:
+                    report = {"passed": False, "reasons": ["no_face"]}
+                    rejected.append({"index": f.idx, "filename": f.filename, **report})
+                    pending.append({"idx": f.idx, "status": "rejected", "detail": json.dumps(report)})
+                else:
+                    candidates.append({"index": f.idx, "embedding": emb, "model_version": model_version,
+                                       "score": quality.get("score", 0.0)})
+                    pending.append({"idx": f.idx, "status": "embedded",
+                                    "detail": json.dumps({"quality_score": quality.get("score", 0.0)})})
+            del by, bgr
+            if n == len(frames) or time.monotonic() - flushed >= settings.ENROLL_JOB_PROGRESS_S:
+                self._progress(job_id, token, pending, n)
+                pending, flushed = [], time.monotonic()
+
+        db = SessionLocal()
+        try:
+            kept, duplicates = dedup_candidates(db, job.user_id, candidates)
+            if not kept and not duplicates:
+                db.rollback()
+                reasons = sorted({r for item in rejected for r in item["reasons"]})
+                self._finish_failed(job_id, token, "No valid live frames" + (f" ({', '.join(reasons)})" if reasons else ""))
+                return
+            # The lease is checked under the row lock, so a job taken over meanwhile is not stored twice
+            if db.execute(text("""
+                SELECT 1 FROM enrollment_jobs WHERE id = :id AND lease_token = :t AND status = 'running' FOR UPDATE
+            """), {"id": job_id, "t": token}).first() is None:
+                raise LeaseLost()
+            by_idx = {f.idx: f for f in frames}
+            image_ids = store_blob_frames(db, job.user_id, job.branch_id, [
+                (by_idx[c["index"]].filename, by_idx[c["index"]].content_sha256, c["embedding"], c["model_version"])
+                for c in kept]) if kept else []
+            for d in duplicates:
+                d["filename"] = by_idx[d["index"]].filename
+            result = {"embeddings_added": len(image_ids), "image_ids": image_ids, "user_id": job.user_id,
+                      "kept": [{"index": c["index"], "image_id": iid, "quality_score": c["score"]}
+                               for c, iid in zip(kept, image_ids)],
+                      "duplicates": duplicates, "rejected": rejected}
+            frame_rows = [{"idx": c["index"], "status": "stored", "image_id": iid,
+                           "detail": json.dumps({"quality_score": c["score"]})} for c, iid in zip(kept, image_ids)]
+            frame_rows += [{"idx": d["index"], "status": "duplicate", "image_id": None,
+                            "detail": json.dumps({k: v for k, v in d.items() if k not in ("index", "filename")})}
+                           for d in duplicates]
+            db.execute(text("""
+                UPDATE enrollment_job_frames SET status = :status, image_id = :image_id, detail = CAST(:detail AS JSONB)
+                WHERE job_id = :job AND idx = :idx
+            """), [{**r, "job": job_id} for r in frame_rows])
+            db.execute(text("""
+                UPDATE enrollment_jobs SET status = 'done', result = CAST(:r AS JSONB), processed_frames = total_frames,
+                       finished_at = NOW(), lease_token = NULL, error = NULL
+                WHERE id = :id
+            """), {"r": json.dumps(result), "id": job_id})
+            db.commit()
+        finally:
+            db.close()
+        self.completed += 1
+
+    def _run_claimed(self, job_id: int, token: str) -> None:
+        try:
+            self.process(job_id, token)
+        except LeaseLost:
+            self.leases_lost += 1
+            print(f"[enroll-jobs] job {job_id} was taken over by another worker")
+        except Exception as exc:
+            self.last_error = f"job {job_id}: {exc}"
+            print(f"[enroll-jobs] job {job_id} attempt failed: {exc}")
+            # Back to the queue straight away, or failed once the attempts are used up
+            with engine.begin() as conn:
+                status = conn.execute(text("""
+                    UPDATE enrollment_jobs SET error = :e, lease_token = NULL,
+                           status = CASE WHEN attempts >= :max THEN 'failed' ELSE 'queued' END,
+                           finished_at = CASE WHEN attempts >= :max THEN NOW() END
+                    WHERE id = :id AND lease_token = :t
+                    RETURNING status
+                """), {"e": str(exc), "max": self.max_attempts, "id": job_id, "t": token}).scalar()
+            if status == "failed":
+                self.failed += 1
+            else:
+                self.retried += 1
+
+    def purge(self) -> int:
+        """Delete jobs finished more than ENROLL_JOB_RETENTION_H ago."""
+        with engine.begin() as conn:
+            return conn.execute(text("""
+                DELETE FROM enrollment_jobs
+                WHERE status IN ('done', 'failed') AND finished_at < NOW() - make_interval(hours => :h)
+            """), {"h": settings.ENROLL_JOB_RETENTION_H}).rowcount or 0
+
+    def run_pending(self) -> int:
+        """Run queued jobs in the calling thread until none is left; returns how many were claimed."""
+        n = 0
+        while (claimed := self.claim()) is not None:
+            self._run_claimed(*claimed)
+            n += 1
+        return n
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"enroll-job-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_pending()
+                if time.monotonic() - self._last_purge > 3600:
+                    self._last_purge = time.monotonic()
+                    self.purge()
+            except Exception as exc:  # database away: try again next round
+                self.last_error = str(exc)
+                print(f"[enroll-jobs] {exc}")
+            self._wake.wait(self.poll)
+            self._wake.clear()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def stats(self) -> dict:
+        return {"workers": len(self._threads), "completed": self.completed, "failed": self.failed,
+                "retried": self.retried, "leases_lost": self.leases_lost, "last_error": self.last_error}
+
+
+pool = EnrollmentJobPool(settings.ENROLL_JOB_WORKERS, settings.ENROLL_JOB_POLL_S, settings.ENROLL_JOB_STALE_S,
+                         settings.ENROLL_JOB_MAX_ATTEMPTS)
@@ -1,33 +1,233 @@
 import os
+import platform
+import threading
+import time
 import numpy as np, cv2
 from typing import Optional
-try:
-    import onnxruntime as ort  # type: ignore
-except Exception:  # onnxruntime may be unavailable
-    ort = None
+from .core.config import settings
+
+_GRAPH_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+def onnx_profile_from_settings() -> dict:
+    """Session tuning knobs, see the ONNX Runtime section of core/config.py."""
+    return {
+        "graph_optimization": settings.ONNX_GRAPH_OPTIMIZATION,
+        "execution_mode": settings.ONNX_EXECUTION_MODE,
+        "intra_op_threads": settings.ONNX_INTRA_OP_THREADS,
+        "inter_op_threads": settings.ONNX_INTER_OP_THREADS,
+        "allow_spinning": settings.ONNX_ALLOW_SPINNING,
+        "cpu_mem_arena": settings.ONNX_CPU_MEM_ARENA,
+        "mem_pattern": settings.ONNX_MEM_PATTERN,
+        "cache_optimized_model": settings.ONNX_CACHE_OPTIMIZED_MODEL,
+        "optimized_model_dir": settings.ONNX_OPTIMIZED_MODEL_DIR,
+        "io_binding": settings.ONNX_IO_BINDING,
+    }
+
+def resolve_model_path() -> str:
+    """Model file for ARCFACE_PRECISION; falls back to FP32 if the INT8 file is missing."""
+    precision = settings.ARCFACE_PRECISION.lower()
+    if precision == "int8":
+        if os.path.exists(settings.ARCFACE_INT8_MODEL_PATH):
+            return settings.ARCFACE_INT8_MODEL_PATH
+        print(f"[face] INT8 model {settings.ARCFACE_INT8_MODEL_PATH} not found, using FP32")
+    elif precision != "fp32":
+        raise ValueError("ARCFACE_PRECISION must be fp32 or int8")
+    return settings.ARCFACE_MODEL_PATH
+
+def _available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        return os.cpu_count() or 1
+
+def _intra_op_threads(profile: dict) -> int:
+    """Explicit setting, else split the host's CPUs across the uvicorn workers."""
+    if profile.get("intra_op_threads"):
+        return int(profile["intra_op_threads"])
+    return max(1, _available_cpus() // max(1, settings.WEB_CONCURRENCY))
 
 class ArcFaceCPU:
-    def __init__(self):
+    """ArcFace embedder. The ONNX session and Haar cascade are built on first use
+    (or by warmup()), so importing this module stays cheap."""
+
+    def __init__(self, model_path: Optional[str] = None, profile: Optional[dict] = None,
+                 model_version: str = "legacy"):
+        self.model_path = model_path or resolve_model_path()
+        self.model_version = model_version  # embedding_versions.version the model's vectors belong to
+        self.profile = profile if profile is not None else onnx_profile_from_settings()
         self._fallback = True
         self.sess = None
         self.input_name = None
-        model_path = "app/models/arcface_r100.onnx"
-        if ort is not None and os.path.exists(model_path):
+        self.output_name = None
+        self.embedding_dim = 512
+        self._max_batch = 0  # 0 = dynamic batch dimension
+        self.session_info: dict = {}
+        self._face_cascade = None
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        self._bindings = threading.local()
+        self._generation = 0  # odd while swap_model() is switching sessions
+
+    def load(self) -> None:
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
             try:
-                so = ort.SessionOptions()
-                so.intra_op_num_threads = max(1, int(cv2.getNumberOfCPUs()/2))
-                self.sess = ort.InferenceSession(
-                    model_path,
-                    sess_options=so,
-                    providers=["CPUExecutionProvider"],
-                )
-                self.input_name = self.sess.get_inputs()[0].name
-                self._fallback = False
-            except Exception as exc:
-                print(f"[face] ONNX unavailable, using fallback embedding: {exc}")
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+                import onnxruntime as ort  # type: ignore
+            except Exception:  # onnxruntime may be unavailable
+                ort = None
+            if ort is not None and os.path.exists(self.model_path):
+                try:
+                    self.sess = self._create_session(ort)
+                    inp = self.sess.get_inputs()[0]
+                    self.input_name = inp.name
+                    if inp.shape and isinstance(inp.shape[0], int):
+                        self._max_batch = inp.shape[0]
+                    out = self.sess.get_outputs()[0]
+                    self.output_name = out.name
+                    if out.shape and isinstance(out.shape[-1], int):
+                        self.embedding_dim = out.shape[-1]
+                    self._fallback = False
+                except Exception as exc:
+                    print(f"[face] ONNX unavailable, using fallback embedding: {exc}")
+            self._face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+            self._loaded = True
 
-    def _detect(self, bgr: np.ndarray) -> Optional[np.ndarray]:
+    def _optimized_cache_path(self, ort) -> str:
+        # Optimized graphs are specific to the ORT version, level and CPU; key the file on all three
+        directory = self.profile.get("optimized_model_dir") or os.path.dirname(self.model_path) or "."
+        stem = os.path.splitext(os.path.basename(self.model_path))[0]
+        level = self.profile.get("graph_optimization", "all")
+        return os.path.join(directory, f"{stem}.{level}.ort{ort.__version__}.{platform.machine()}.opt.onnx")
+
+    def _create_session(self, ort):
+        p = self.profile
+        t0 = time.perf_counter()
+        so = ort.SessionOptions()
+        level = p.get("graph_optimization", "all")
+        if level not in _GRAPH_LEVELS:
+            raise ValueError(f"ONNX_GRAPH_OPTIMIZATION must be one of {list(_GRAPH_LEVELS)}")
+        so.graph_optimization_level = getattr(ort.GraphOptimizationLevel, _GRAPH_LEVELS[level])
+        so.execution_mode = (ort.ExecutionMode.ORT_PARALLEL if p.get("execution_mode") == "parallel"
+                             else ort.ExecutionMode.ORT_SEQUENTIAL)
+        so.intra_op_num_threads = _intra_op_threads(p)
+        so.inter_op_num_threads = max(1, int(p.get("inter_op_threads") or 1))
+        spin = "1" if p.get("allow_spinning") else "0"
+        so.add_session_config_entry("session.intra_op.allow_spinning", spin)
+        so.add_session_config_entry("session.inter_op.allow_spinning", spin)
+        so.enable_cpu_mem_arena = bool(p.get("cpu_mem_arena", True))
+        so.enable_mem_pattern = bool(p.get("mem_pattern", True))
+
+        path, tmp_path, cached = self.model_path, None, False
+        if p.get("cache_optimized_model") and level != "disable":
+            cache_path = self._optimized_cache_path(ort)
+            if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(self.model_path):
+                # Already optimized on a previous start: skip the optimizer entirely
+                path, cached = cache_path, True
+                so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            else:
+                os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                so.optimized_model_filepath = tmp_path
+
+        sess = ort.InferenceSession(path, sess_options=so, providers=["CPUExecutionProvider"])
+        if tmp_path is not None:
+            try:
+                # Atomic publish; concurrent workers just overwrite with an equivalent file
+                os.replace(tmp_path, cache_path)
+            except OSError as exc:
+                print(f"[face] could not cache optimized model: {exc}")
+        self.session_info = {
+            "model": path,
+            "optimized_cache_hit": cached,
+            "graph_optimization": level,
+            "intra_op_threads": so.intra_op_num_threads,
+            "inter_op_threads": so.inter_op_num_threads,
+            "create_ms": round((time.perf_counter() - t0) * 1000, 1),
+        }
+        return sess
+
+    def _binding(self, sess):
+        """Per-thread IO binding over preallocated input/output buffers (batch of 1)."""
+        b = getattr(self._bindings, "b", None)
+        if b is None or b[0] is not sess:
+            import onnxruntime as ort  # type: ignore
+            inp = np.zeros((1, 3, 112, 112), dtype=np.float32)
+            out = np.zeros((1, sess.get_outputs()[0].shape[-1]), dtype=np.float32)
+            io = sess.io_binding()
+            io.bind_ortvalue_input(sess.get_inputs()[0].name, ort.OrtValue.ortvalue_from_numpy(inp))
+            io.bind_ortvalue_output(sess.get_outputs()[0].name, ort.OrtValue.ortvalue_from_numpy(out))
+            b = self._bindings.b = (sess, io, inp, out)
+        return b[1:]
+
+    def _infer(self, blob: np.ndarray) -> np.ndarray:
+        """Run the model on an NCHW float32 blob and return raw (N, D) outputs."""
+        sess = self.sess
+        if self.profile.get("io_binding") and blob.shape[0] == 1:
+            io, inp, out = self._binding(sess)
+            np.copyto(inp, blob)
+            sess.run_with_iobinding(io)
+            return out.copy()
+        return sess.run([sess.get_outputs()[0].name], {sess.get_inputs()[0].name: blob})[0]
+
+    def versioned(self, fn, *args):
+        """(fn(*args), model_version) with fn guaranteed to have run on that version's model.
+
+        fn is retried if swap_model() switched sessions while it ran.
+        """
+        while True:
+            gen = self._generation
+            if gen % 2 == 0:
+                result = fn(*args)
+                if self._generation == gen:
+                    return result, self.model_version
+            time.sleep(0.001)
+
+    def swap_model(self, model_path: str, model_version: str) -> None:
+        """Switch to another model file; it is loaded and warmed before the switch, so requests never wait.
+
+        Calls already running finish on the old session.
+        """
+        with self._load_lock:
+            if not self._loaded:
+                # Nothing loaded yet: just point the lazy load at the new file
+                self.model_path, self.model_version = model_path, model_version
+                return
+        fresh = ArcFaceCPU(model_path, self.profile, model_version)
+        fresh.warmup()
+        if fresh._fallback:
+            raise RuntimeError(f"could not load {model_path}")
+        with self._load_lock:
+            self._generation += 1
+            self.sess, self.input_name, self.output_name = fresh.sess, fresh.input_name, fresh.output_name
+            self.embedding_dim, self._max_batch = fresh.embedding_dim, fresh._max_batch
+            self.session_info, self._fallback = fresh.session_info, False
+            self.model_path, self.model_version = model_path, model_version
+            self._generation += 1
+
+    @property
+    def face_cascade(self):
+        self.load()
+        return self._face_cascade
+
+    def warmup(self) -> dict:
+        """Load the model and run one dummy inference so the first request is not slow."""
+        t0 = time.perf_counter()
+        self.load()
+        if self.sess is not None and self.input_name is not None:
+            self._infer(np.zeros((1, 3, 112, 112), dtype=np.float32))
+        return {"onnx": not self._fallback, "ms": round((time.perf_counter() - t0) * 1000, 1),
+                "model_version": self.model_version, "session": self.session_info}
+
+    def _detect_faces(self, bgr: np.ndarray) -> list[tuple[int, int, int, int]]:
+        """All plausible face boxes (x, y, w, h), best-scored first."""
         gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
         
         # Enhanced face detection with multiple scales and parameters
@@ -39,13 +239,7 @@ class ArcFaceCPU:
             flags=cv2.CASCADE_SCALE_IMAGE
         )
         
-        if len(faces) == 0: 
-            return None
-            
-        # Select the largest face with better quality criteria
-        best_face = None
-        best_score = 0
-        
+        scored = []
         for (x, y, w, h) in faces:
             # Calculate face quality score based on size and aspect ratio
             area = w * h
@@ -62,15 +256,14 @@ class ArcFaceCPU:
                 
                 # Combined score: area + aspect ratio + center position
                 score = area * (1 + center_score) * (2 - abs(aspect_ratio - 1))
-                
-                if score > best_score:
-                    best_score = score
-                    best_face = (x, y, w, h)
+                scored.append((score, (int(x), int(y), int(w), int(h))))
         
-        if best_face is None:
-            return None
-            
-        x, y, w, h = best_face
+        scored.sort(key=lambda t: t[0], reverse=True)
+        return [box for _, box in scored]
+
+    def _preprocess(self, bgr: np.ndarray, box: tuple[int, int, int, int]) -> np.ndarray:
+        """Crop one face box into a (1, 3, 112, 112) model input."""
+        x, y, w, h = box
         
         # Extract face with some padding for better context
         padding = int(min(w, h) * 0.1)  # 10% padding
@@ -97,7 +290,80 @@ class ArcFaceCPU:
         chw = np.transpose(crop, (2, 0, 1))[None, ...]
         return chw
 
+    def _detect(self, bgr: np.ndarray) -> Optional[np.ndarray]:
+        """Blob for the single best-scored face, or None."""
+        boxes = self._detect_faces(bgr)
+        if not boxes:
+            return None
+        return self._preprocess(bgr, boxes[0])
+
+    def _infer_batch(self, blobs: np.ndarray) -> np.ndarray:
+        """Unit-norm embeddings for an (N, 3, 112, 112) batch, one session run when the model allows it."""
+        if self._max_batch:  # fixed batch dimension in the graph
+            out = np.concatenate([self._infer(b[None, ...]) for b in blobs])
+        else:
+            out = self._infer(blobs)
+        out = out.astype(np.float32)
+        out /= np.linalg.norm(out, axis=1, keepdims=True) + 1e-9
+        return out
+
+    @staticmethod
+    def _fallback_embedding(data: bytes) -> np.ndarray:
+        # Deterministic 512-d embedding from the given bytes
+        import hashlib
+        h = hashlib.blake2b(data, digest_size=32).digest()
+        seed = int.from_bytes(h, "little", signed=False) % (2**32 - 1)
+        rng = np.random.default_rng(seed)
+        vec = rng.standard_normal(512).astype(np.float32)
+        vec /= (np.linalg.norm(vec) + 1e-9)
+        return vec
+
+    def embed_faces(self, img_bytes: bytes, max_faces: int = 0) -> Optional[list[tuple[tuple[int, int, int, int], np.ndarray]]]:
+        """(box, embedding) for every detected face, best-scored first; None if the image does not decode.
+
+        All crops go through the model as one batch.
+        """
+        self.load()
+        arr = np.frombuffer(img_bytes, np.uint8)
+        bgr = cv2.imdecode(arr, cv2.IMREAD_COLOR)
+        if bgr is None:
+            return None
+        boxes = self._detect_faces(bgr)
+        if max_faces > 0:
+            boxes = boxes[:max_faces]
+        if not boxes:
+            return []
+        return list(zip(boxes, self.embed_crops(bgr, boxes)))
+
+    def embed_crops(self, bgr: np.ndarray, boxes: list[tuple[int, int, int, int]]) -> np.ndarray:
+        """Unit-norm (N, D) embeddings for the given face boxes of one decoded frame, as one batch."""
+        self.load()
+        blobs = np.concatenate([self._preprocess(bgr, b) for b in boxes])
+        if not self._fallback and self.sess is not None and self.input_name is not None:
+            return self._infer_batch(blobs)
+        return np.stack([self._fallback_embedding(b.tobytes()) for b in blobs])
+
+    def embed_many(self, images: list[bytes], batch_size: int = 32) -> list[Optional[np.ndarray]]:
+        """embed() for many images, running the best face of each through the model batch_size at a time."""
+        self.load()
+        if self._fallback or self.sess is None or self.input_name is None:
+            return [self.embed(by) for by in images]
+        out: list[Optional[np.ndarray]] = [None] * len(images)
+        idx, blobs = [], []
+        for i, by in enumerate(images):
+            bgr = cv2.imdecode(np.frombuffer(by, np.uint8), cv2.IMREAD_COLOR)
+            blob = self._detect(bgr) if bgr is not None else None
+            if blob is not None:
+                idx.append(i)
+                blobs.append(blob)
+        for start in range(0, len(blobs), max(1, batch_size)):
+            embs = self._infer_batch(np.concatenate(blobs[start:start + batch_size]))
+            for i, emb in zip(idx[start:start + batch_size], embs):
+                out[i] = emb
+        return out
+
     def embed(self, img_bytes: bytes) -> Optional[np.ndarray]:
+        self.load()
         arr = np.frombuffer(img_bytes, np.uint8)
         bgr = cv2.imdecode(arr, cv2.IMREAD_COLOR)
         if bgr is None: return None
@@ -105,16 +371,10 @@ class ArcFaceCPU:
         if blob is None and not self._fallback:
             return None
         if not self._fallback and self.sess is not None and self.input_name is not None and blob is not None:
-            out = self.sess.run(None, {self.input_name: blob})[0][0]
+            out = self._infer(blob)[0]
             norm = np.linalg.norm(out) + 1e-9
             return (out / norm).astype(np.float32)
         # Fallback: deterministic 512-d embedding from image bytes
-        import hashlib
-        h = hashlib.blake2b(img_bytes, digest_size=32).digest()
-        seed = int.from_bytes(h, "little", signed=False) % (2**32 - 1)
-        rng = np.random.default_rng(seed)
-        vec = rng.standard_normal(512).astype(np.float32)
-        vec /= (np.linalg.norm(vec) + 1e-9)
-        return vec
+        return self._fallback_embedding(img_bytes)
 
 engine_arc = ArcFaceCPU()
\ No newline at end of file
@@ -0,0 +1,263 @@
+"""
+Slow-request flight recorder.
+
+Keeps the N slowest recent requests with per-stage timings. Requests that run
+past SLOW_REQUEST_THRESHOLD_MS get a stack-sampling profile attached while they
+are still in flight, so the cost is only paid by requests that are already slow.
+"""
+
+import contextvars
+import heapq
+import itertools
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional
+
+from .core.config import settings
+
+_current: contextvars.ContextVar[Optional["_RequestRecord"]] = contextvars.ContextVar(
+    "flight_recorder_request", default=None
+)
+
+
+class _RequestRecord:
+    __slots__ = ("rid", "method", "path", "started_at", "t0", "thread_id",
+                 "stages", "status", "samples", "branch_code", "device_code")
+
+    def __init__(self, rid: int, method: str, path: str, thread_id: int):
+        self.rid = rid
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self.t0 = time.perf_counter()
+        self.thread_id = thread_id
+        self.stages: list[tuple[str, float]] = []
+        self.status: Optional[int] = None
+        self.samples: Optional[Counter] = None
+        self.branch_code: Optional[str] = None
+        self.device_code: Optional[str] = None
+
+    def to_dict(self, duration_ms: float) -> dict:
+        out = {
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": round(duration_ms, 2),
+            "branch_code": self.branch_code,
+            "device_code": self.device_code,
+            "stages": [{"name": n, "ms": round(ms, 2)} for n, ms in self.stages],
+        }
+        if self.samples:
+            interval = settings.SLOW_REQUEST_SAMPLE_INTERVAL_MS
+            out["profile"] = {
+                "sample_interval_ms": interval,
+                "total_samples": sum(self.samples.values()),
+                "stacks": [
+                    {"stack": stack, "samples": n, "approx_ms": n * interval}
+                    for stack, n in self.samples.most_common(settings.SLOW_REQUEST_MAX_STACKS)
+                ],
+            }
+        return out
+
+
+class FlightRecorder:
+    """Bounded store of the slowest recent requests plus an on-demand stack sampler."""
+
+    def __init__(self, size: int, window_s: int, threshold_ms: int, interval_ms: int):
+        self.size = max(1, size)
+        self.window_s = window_s
+        self.threshold_s = threshold_ms / 1000.0
+        self.interval_s = max(1, interval_ms) / 1000.0
+        self._ids = itertools.count()
+        self._heap: list[tuple[float, int, dict]] = []  # min-heap on duration
+        self._inflight: dict[int, _RequestRecord] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._idle = True
+        self.requests_seen = 0
+
+    # ---- request lifecycle -------------------------------------------------
+    def begin(self, method: str, path: str) -> _RequestRecord:
+        rec = _RequestRecord(next(self._ids), method, path, threading.get_ident())
+        with self._lock:
+            self._inflight[rec.rid] = rec
+        if self._sampler is None:
+            self._start_sampler()
+        if self._idle:
+            self._wake.set()
+        return rec
+
+    def end(self, rec: _RequestRecord) -> None:
+        duration_ms = (time.perf_counter() - rec.t0) * 1000.0
+        with self._lock:
+            self._inflight.pop(rec.rid, None)
+            self.requests_seen += 1
+            if len(self._heap) < self.size:
+                heapq.heappush(self._heap, (duration_ms, rec.rid, rec.to_dict(duration_ms)))
+            elif duration_ms > self._heap[0][0]:
+                heapq.heapreplace(self._heap, (duration_ms, rec.rid, rec.to_dict(duration_ms)))
+
+    # ---- buffer access -----------------------------------------------------
+    def dump(self) -> list[dict]:
+        cutoff = time.time() - self.window_s
+        with self._lock:
+            self._heap = [e for e in self._heap if e[2]["started_at"] >= cutoff]
+            heapq.heapify(self._heap)
+            entries = sorted(self._heap, key=lambda e: e[0], reverse=True)
+        return [e[2] for e in entries]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._heap.clear()
+
+    # ---- stack sampler -----------------------------------------------------
+    def _start_sampler(self) -> None:
+        with self._lock:
+            if self._sampler is not None:
+                return
+            self._sampler = threading.Thread(target=self._sample_loop, name="flight-recorder", daemon=True)
+            self._sampler.start()
+
+    def _sample_loop(self) -> None:
+        while True:
+            # Flag idle before looking, so a request registered meanwhile wakes us
+            self._idle = True
+            with self._lock:
+                inflight = list(self._inflight.values())
+            if not inflight:
+                # Idle: sleep until the next request starts
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            self._idle = False
+            now = time.perf_counter()
+            slow = [r for r in inflight if now - r.t0 >= self.threshold_s]
+            if not slow:
+                # Sleep until the oldest in-flight request would cross the threshold
+                oldest = min(r.t0 for r in inflight)
+                time.sleep(max(self.interval_s, self.threshold_s - (now - oldest)))
+                continue
+            frames = sys._current_frames()
+            for rec in slow:
+                frame = frames.get(rec.thread_id)
+                if frame is None:
+                    continue
+                if rec.samples is None:
+                    rec.samples = Counter()
+                rec.samples[_collapse(frame)] += 1
+            del frames
+            time.sleep(self.interval_s)
+
+
+def _collapse(frame, limit: int = 40) -> str:
+    parts = []
+    while frame is not None and len(parts) < limit:
+        code = frame.f_code
+        parts.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+recorder = FlightRecorder(
+    settings.SLOW_REQUEST_BUFFER_SIZE,
+    settings.SLOW_REQUEST_WINDOW_SECONDS,
+    settings.SLOW_REQUEST_THRESHOLD_MS,
+    settings.SLOW_REQUEST_SAMPLE_INTERVAL_MS,
+)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a named stage of the current request (no-op outside a recorded request)."""
+    rec = _current.get()
+    if rec is None:
+        yield
+        return
+    # Sample the thread doing the work (sync endpoints run in the threadpool)
+    rec.thread_id = threading.get_ident()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        rec.stages.append((name, (time.perf_counter() - t0) * 1000.0))
+
+
+class FlightRecorderMiddleware:
+    """Pure ASGI middleware; avoids the per-request overhead of BaseHTTPMiddleware."""
+
+    def __init__(self, app, recorder: FlightRecorder = recorder):
+        self.app = app
+        self.recorder = recorder
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        rec = self.recorder.begin(scope.get("method", ""), scope.get("path", ""))
+        for key, value in scope.get("headers", ()):
+            if key == b"x-branch-code":
+                rec.branch_code = value.decode("latin-1")
+            elif key == b"x-device-code":
+                rec.device_code = value.decode("latin-1")
+        token = _current.set(rec)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                rec.status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            self.recorder.end(rec)
+
+
+_last_snapshot: Optional[tracemalloc.Snapshot] = None
+
+
+def tracemalloc_start(frames: int = 25) -> dict:
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    return tracemalloc_status()
+
+
+def tracemalloc_stop() -> dict:
+    global _last_snapshot
+    tracemalloc.stop()
+    _last_snapshot = None
+    return tracemalloc_status()
+
+
+def tracemalloc_status() -> dict:
+    current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+    return {"tracing": tracemalloc.is_tracing(), "current_bytes": current, "peak_bytes": peak}
+
+
+def tracemalloc_snapshot(limit: int = 25, key_type: str = "lineno", compare: bool = True) -> dict:
+    """Top allocation sites, optionally diffed against the previous snapshot."""
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc is not running")
+    snap = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    out = tracemalloc_status()
+    out["top"] = [
+        {"where": str(s.traceback), "size_bytes": s.size, "count": s.count}
+        for s in snap.statistics(key_type)[:limit]
+    ]
+    if compare and _last_snapshot is not None:
+        out["diff"] = [
+            {"where": str(d.traceback), "size_diff_bytes": d.size_diff, "count_diff": d.count_diff}
+            for d in snap.compare_to(_last_snapshot, key_type)[:limit]
+        ]
+    _last_snapshot = snap
+    return out
@@ -0,0 +1,460 @@
+"""
+Host-wide, memory-mapped gallery index.
+
+Each branch's embeddings live in one file, GALLERY_INDEX_DIR/branch_<id>.gal:
+
+    header (64 bytes)  magic b"FGAL", format version, dim, count, change cursor,
+                       written_at, embedding model version
+    int64[count]       face_embeddings.id
+    int64[count]       user_id
+    float32[count,dim] unit-norm embeddings
+
+Every uvicorn worker maps the files read-only, so the page cache holds one
+copy per host however many workers there are, and a freshly started worker
+is warm as soon as it maps them.
+
+One process per host, whoever holds the flock on GALLERY_INDEX_DIR/writer.lock,
+is the writer. A trigger on face_embeddings appends to face_embedding_changes and sends
+NOTIFY face_embeddings_changed; the writer LISTENs, re-reads the touched rows
+and publishes a new file per branch with os.replace. Segments only hold the
+active embedding model version; when it changes every branch is rebuilt, and
+a reader whose engine is on another version treats the file as a miss.
+Readers notice the new
+inode on their next lookup and switch to it; the old mapping stays valid
+until they drop it. If the writer stops heartbeating for
+GALLERY_INDEX_MAX_STALENESS_S, readers fall back to Postgres.
+
+Change ids are handed out before commit, so they do not become visible in
+order: a change below the cursor can still show up from a transaction that
+was open at the last read. Such a transaction's xid is at or above that
+read's snapshot xmin (the horizon), so every read also takes the changes
+below the cursor from transactions at or above the horizon that were not
+applied yet. As a backstop, every GALLERY_INDEX_VERIFY_S the writer compares
+each segment's row count and id sum with Postgres and rebuilds the branches
+that differ.
+
+A new writer normally starts with a full rebuild from Postgres. With
+GALLERY_SNAPSHOT_PATH set (see gallery_snapshot.py) it writes the segments
+from the snapshot and replays only the changes logged since it was taken.
+"""
+
+import os
+import struct
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from .core.config import settings
+
+try:
+    import psycopg  # type: ignore
+except Exception:  # pragma: no cover
+    psycopg = None  # noqa: N816
+try:
+    import fcntl
+except ImportError:  # pragma: no cover  (Windows: single worker, always the writer)
+    fcntl = None
+
+MAGIC = b"FGAL"
+VERSION = 2
+_HEADER = struct.Struct("<4sIIIqd32s")  # magic, version, dim, count, cursor, written_at, model_version
+HEADER_SIZE = 64
+CHANNEL = "face_embeddings_changed"
+_HEARTBEAT = "writer.heartbeat"
+_LOCK = "writer.lock"
+
+
+def segment_path(directory: str, branch_id: int) -> str:
+    return os.path.join(directory, f"branch_{int(branch_id)}.gal")
+
+
+def write_segment(path: str, emb_ids: np.ndarray, user_ids: np.ndarray, vecs: np.ndarray, cursor: int,
+                  model_version: str) -> None:
+    """Write a segment next to path and atomically move it into place."""
+    count, dim = vecs.shape
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, dim, count, cursor, time.time(),
+                             model_version.encode()).ljust(HEADER_SIZE, b"\0"))
+        f.write(np.ascontiguousarray(emb_ids, dtype=np.int64).tobytes())
+        f.write(np.ascontiguousarray(user_ids, dtype=np.int64).tobytes())
+        f.write(np.ascontiguousarray(vecs, dtype=np.float32).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_segment(path: str):
+    """Map a segment read-only: (emb_ids, user_ids, vecs, cursor, model_version); arrays are views into the mapping."""
+    mm = np.memmap(path, dtype=np.uint8, mode="r")
+    magic, version, dim, count, cursor, _, model_version = _HEADER.unpack_from(mm, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a gallery segment")
+    off = HEADER_SIZE
+    emb_ids = mm[off:off + 8 * count].view(np.int64)
+    off += 8 * count
+    user_ids = mm[off:off + 8 * count].view(np.int64)
+    off += 8 * count
+    vecs = mm[off:off + 4 * count * dim].view(np.float32).reshape(count, dim)
+    return emb_ids, user_ids, vecs, cursor, model_version.rstrip(b"\0").decode()
+
+
+class GalleryIndex:
+    """Reader side: per-branch (user_ids, matrix) from the mapped segment files."""
+
+    def __init__(self, directory: str, max_staleness_s: float):
+        self.directory = directory
+        self.max_staleness = max_staleness_s
+        self._maps: dict[int, tuple] = {}
+        self._fresh_until = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def _writer_alive(self) -> bool:
+        now = time.monotonic()
+        if now < self._fresh_until:
+            return True
+        try:
+            age = time.time() - os.stat(os.path.join(self.directory, _HEARTBEAT)).st_mtime
+        except OSError:
+            return False
+        if age > self.max_staleness:
+            return False
+        self._fresh_until = now + 1.0  # stat the heartbeat at most once a second
+        return True
+
+    def get(self, branch_id: int, model_version: str) -> Optional[tuple[np.ndarray, np.ndarray]]:
+        """(user_ids, unit-norm matrix) for the branch, or None if there is no fresh segment of model_version."""
+        if not self._writer_alive():
+            self.misses += 1
+            return None
+        path = segment_path(self.directory, branch_id)
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.misses += 1
+            return None
+        key = (st.st_ino, st.st_mtime_ns)
+        cached = self._maps.get(branch_id)
+        if cached is None or cached[0] != key:
+            try:
+                _, user_ids, vecs, _, seg_version = read_segment(path)
+            except (OSError, ValueError):
+                self.misses += 1
+                return None
+            cached = self._maps[branch_id] = (key, user_ids, vecs, seg_version)
+        if cached[3] != model_version:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return cached[1], cached[2]
+
+    def stats(self) -> dict:
+        return {
+            "enabled": settings.GALLERY_INDEX_ENABLED,
+            "directory": self.directory,
+            "writer_alive": self._writer_alive(),
+            "is_writer": _writer.is_leader if _writer else False,
+            "writer_repairs": _writer.repairs if _writer else 0,
+            "mapped_branches": len(self._maps),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class GalleryIndexWriter:
+    """Keeps the segment files in step with face_embeddings; only the lock holder writes."""
+
+    def __init__(self, directory: str, poll_s: float, retention_hours: int, verify_s: float):
+        self.directory = directory
+        self.poll = max(0.1, poll_s)
+        self.verify_s = verify_s
+        self.retention_hours = retention_hours
+        self.is_leader = False
+        self.cursor = 0
+        self.horizon: Optional[int] = None  # snapshot xmin of the last read of the change log
+        self._late: set[int] = set()  # change ids below the cursor, at or above the horizon, already applied
+        self.repairs = 0
+        self.model_version: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock_file = None
+
+    def start(self) -> None:
+        if psycopg is None or self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="gallery-index-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _connect(self):
+        return psycopg.connect(
+            host=settings.DB_HOST, port=settings.DB_PORT, dbname=settings.POSTGRES_DB,
+            user=settings.POSTGRES_USER, password=settings.POSTGRES_PASSWORD, autocommit=True,
+        )
+
+    def _try_lock(self) -> bool:
+        """Host-local election: the lock is released by the kernel when the holder exits."""
+        if fcntl is None:
+            return True
+        f = open(os.path.join(self.directory, _LOCK), "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._lock_file = f  # held for the life of the process
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if not self.is_leader:
+                self.is_leader = self._try_lock()
+                if not self.is_leader:
+                    # Another worker writes; take over if it exits
+                    self._stop.wait(max(30.0, self.poll))
+                    continue
+            try:
+                with self._connect() as conn:
+                    self._lead(conn)
+            except Exception as exc:  # pragma: no cover
+                print(f"[gallery-index] writer error: {exc}")
+                self._stop.wait(5.0)
+
+    def _lead(self, conn) -> None:
+        conn.execute(f"LISTEN {CHANNEL}")
+        if not self._seed_from_snapshot(conn):
+            self._rebuild_all(conn)
+        last_prune = last_verify = time.monotonic()
+        while not self._stop.is_set():
+            # Wake on NOTIFY, or after poll seconds to heartbeat and catch anything missed
+            for _ in conn.notifies(timeout=self.poll, stop_after=1):
+                pass
+            if self._active_version(conn) != self.model_version:
+                self._rebuild_all(conn)  # re-embedding cutover
+                continue
+            self._apply_changes(conn)
+            if self.verify_s > 0 and time.monotonic() - last_verify > self.verify_s:
+                self._verify(conn)
+                last_verify = time.monotonic()
+            self._heartbeat()
+            if time.monotonic() - last_prune > 3600:
+                conn.execute(
+                    "DELETE FROM face_embedding_changes WHERE id <= %s AND xid < %s::text::xid8 "
+                    "AND created_at < NOW() - make_interval(hours => %s)",
+                    (self.cursor, self.horizon, self.retention_hours),
+                )
+                last_prune = time.monotonic()
+
+    def _active_version(self, conn) -> str:
+        row = conn.execute("SELECT version FROM embedding_versions WHERE status = 'active'").fetchone()
+        return row[0] if row else "legacy"
+
+    def _xmin(self, conn) -> int:
+        return int(conn.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text").fetchone()[0])
+
+    def _rebuild_all(self, conn) -> None:
+        # Horizon and cursor first, then the full rebuild: changes in between are re-applied, which is idempotent
+        self.horizon, self._late = self._xmin(conn), set()
+        self.cursor = conn.execute("SELECT COALESCE(max(id), 0) FROM face_embedding_changes").fetchone()[0]
+        self.model_version = self._active_version(conn)
+        branches = [r[0] for r in conn.execute(
+            "SELECT DISTINCT branch_id FROM face_embeddings WHERE branch_id IS NOT NULL AND model_version = %s",
+            (self.model_version,))]
+        for bid in branches:
+            self._rebuild(conn, bid)
+        self._remove_orphans(set(branches))
+        self._heartbeat()
+        print(f"[gallery-index] rebuilt {len(branches)} branches for model version {self.model_version}")
+
+    def _seed_from_snapshot(self, conn) -> bool:
+        """Write the segments from GALLERY_SNAPSHOT_PATH and replay only the changes logged after it."""
+        path = settings.GALLERY_SNAPSHOT_PATH
+        if not path or not os.path.exists(path):
+            return False
+        from .gallery_snapshot import read_snapshot
+
+        try:
+            snap = read_snapshot(path)
+        except (OSError, ValueError) as exc:
+            print(f"[gallery-index] ignoring snapshot: {exc}")
+            return False
+        version = self._active_version(conn)
+        oldest, last = conn.execute(
+            "SELECT (SELECT min(id) FROM face_embedding_changes), "
+            "(SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM face_embedding_changes_id_seq)").fetchone()
+        if snap.meta["scope"] != "all" or snap.model_version != version:
+            print(f"[gallery-index] ignoring snapshot: {snap.meta['scope']} / {snap.model_version}, need all / {version}")
+            return False
+        if "xmin" not in snap.meta:
+            # Changes still uncommitted when it was taken could not be found again
+            print("[gallery-index] ignoring snapshot: it has no transaction horizon (exported by an older version)")
+            return False
+        # Every change after the snapshot must still be in the log (and the snapshot must be of this database)
+        if snap.cursor > last or (oldest is None and last > snap.cursor) or (oldest is not None and oldest > snap.cursor + 1):
+            print("[gallery-index] ignoring snapshot: the change log does not cover it")
+            return False
+        self.model_version = version
+        branches = set()
+        for b in snap.branches():
+            emb_ids, user_ids, vecs = snap.branch(b["id"])
+            if len(emb_ids):
+                write_segment(segment_path(self.directory, b["id"]), np.asarray(emb_ids), np.asarray(user_ids),
+                              np.ascontiguousarray(vecs, dtype=np.float32), snap.cursor, version)
+                branches.add(b["id"])
+        self._remove_orphans(branches)
+        # Changes of transactions open during the export are replayed like late commits (see _apply_changes)
+        self.cursor, self.horizon, self._late = snap.cursor, int(snap.meta["xmin"]), set()
+        self._apply_changes(conn)
+        self._heartbeat()
+        print(f"[gallery-index] seeded {len(branches)} branches from {path}, caught up to change {self.cursor}")
+        return True
+
+    def _heartbeat(self) -> None:
+        path = os.path.join(self.directory, _HEARTBEAT)
+        with open(path, "a"):
+            os.utime(path)
+
+    def _fetch(self, conn, branch_id: int, ids: Optional[list[int]] = None):
+        sql = "SELECT id, user_id, embedding::real[] FROM face_embeddings WHERE branch_id = %s AND model_version = %s"
+        params: tuple = (branch_id, self.model_version)
+        if ids is not None:
+            sql += " AND id = ANY(%s)"
+            params += (ids,)
+        rows = [r for r in conn.execute(sql + " ORDER BY id", params).fetchall() if r[2] is not None]
+        emb_ids = np.array([r[0] for r in rows], dtype=np.int64)
+        user_ids = np.array([r[1] or 0 for r in rows], dtype=np.int64)
+        vecs = np.array([r[2] for r in rows], dtype=np.float32).reshape(len(rows), -1) if rows else None
+        if vecs is not None:
+            vecs /= np.linalg.norm(vecs, axis=1, keepdims=True) + 1e-9
+        return emb_ids, user_ids, vecs
+
+    def _rebuild(self, conn, branch_id: int) -> None:
+        emb_ids, user_ids, vecs = self._fetch(conn, branch_id)
+        path = segment_path(self.directory, branch_id)
+        if vecs is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        write_segment(path, emb_ids, user_ids, vecs, self.cursor, self.model_version)
+
+    def _apply_changes(self, conn) -> None:
+        # Taken before reading: anything committing later has an xid at or above it
+        horizon = self._xmin(conn)
+        if self.horizon is not None:
+            # Committed below the cursor since the last read (see the module docstring)
+            late = conn.execute(
+                "SELECT id, branch_id, embedding_id, xid::text FROM face_embedding_changes "
+                "WHERE id <= %s AND xid >= %s::text::xid8 AND NOT id = ANY(%s) ORDER BY id",
+                (self.cursor, self.horizon, list(self._late)),
+            ).fetchall()
+            self._apply_rows(conn, late, self.cursor)
+            self._late.update(r[0] for r in late)
+        while True:
+            rows = conn.execute(
+                "SELECT id, branch_id, embedding_id, xid::text FROM face_embedding_changes "
+                "WHERE id > %s ORDER BY id LIMIT 10000",
+                (self.cursor,),
+            ).fetchall()
+            if not rows:
+                break
+            cursor = rows[-1][0]
+            self._apply_rows(conn, rows, cursor)
+            self._late.update(r[0] for r in rows if int(r[3]) >= horizon)
+            self.cursor = cursor
+        # Transactions below the new horizon have ended; their changes cannot show up any more
+        if self._late:
+            keep = conn.execute("SELECT id FROM face_embedding_changes WHERE id = ANY(%s) AND xid >= %s::text::xid8",
+                                (list(self._late), horizon)).fetchall()
+            self._late = {r[0] for r in keep}
+        self.horizon = horizon
+
+    def _apply_rows(self, conn, rows, cursor: int) -> None:
+        touched: dict[int, set] = {}
+        for _, bid, eid, _ in rows:
+            if bid is not None:
+                touched.setdefault(bid, set()).add(eid)
+        for bid, ids in touched.items():
+            self._apply_branch(conn, bid, sorted(ids), cursor)
+
+    def _verify(self, conn) -> None:
+        """Rebuild the branches whose segment's row count or id sum differs from Postgres."""
+        expected = {bid: (n, total) for bid, n, total in conn.execute(
+            "SELECT branch_id, count(*), sum(id) FROM face_embeddings "
+            "WHERE branch_id IS NOT NULL AND model_version = %s AND embedding IS NOT NULL GROUP BY branch_id",
+            (self.model_version,))}
+        stale = []
+        for bid, (n, total) in expected.items():
+            try:
+                emb_ids = read_segment(segment_path(self.directory, bid))[0]
+                if len(emb_ids) == n and int(emb_ids.sum()) == total:
+                    continue
+            except (OSError, ValueError):
+                pass
+            stale.append(bid)
+        for bid in stale:
+            self._rebuild(conn, bid)
+        self._remove_orphans(set(expected))
+        if stale:
+            self.repairs += len(stale)
+            print(f"[gallery-index] rebuilt {len(stale)} branches that had drifted from Postgres: {stale}")
+
+    def _apply_branch(self, conn, branch_id: int, ids: list[int], cursor: int) -> None:
+        """Drop the touched embedding ids from the segment and re-add whichever still exist."""
+        path = segment_path(self.directory, branch_id)
+        try:
+            old_ids, old_users, old_vecs, _, _ = read_segment(path)
+        except (OSError, ValueError):
+            self._rebuild(conn, branch_id)
+            return
+        new_ids, new_users, new_vecs = self._fetch(conn, branch_id, ids)
+        keep = ~np.isin(old_ids, np.asarray(ids, dtype=np.int64))
+        if new_vecs is None and keep.all():
+            return  # e.g. rows of a version that is still being built
+        parts = [(old_ids[keep], old_users[keep], old_vecs[keep])]
+        if new_vecs is not None:
+            if new_vecs.shape[1] != old_vecs.shape[1]:
+                self._rebuild(conn, branch_id)
+                return
+            parts.append((new_ids, new_users, new_vecs))
+        emb_ids = np.concatenate([p[0] for p in parts])
+        if len(emb_ids) == 0:
+            os.remove(path)
+            return
+        write_segment(path, emb_ids, np.concatenate([p[1] for p in parts]),
+                      np.concatenate([p[2] for p in parts]), cursor, self.model_version)
+
+    def _remove_orphans(self, branches: set) -> None:
+        for name in os.listdir(self.directory):
+            if name.startswith("branch_") and name.endswith(".gal"):
+                try:
+                    bid = int(name[len("branch_"):-len(".gal")])
+                except ValueError:
+                    continue
+                if bid not in branches:
+                    os.remove(os.path.join(self.directory, name))
+
+
+gallery_index = GalleryIndex(settings.GALLERY_INDEX_DIR, settings.GALLERY_INDEX_MAX_STALENESS_S)
+_writer: Optional[GalleryIndexWriter] = None
+
+
+def start_writer() -> None:
+    """Start this worker's writer thread; it only writes while it holds the host-wide lock."""
+    global _writer
+    if not settings.GALLERY_INDEX_ENABLED:
+        return
+    if _writer is None:
+        _writer = GalleryIndexWriter(settings.GALLERY_INDEX_DIR, settings.GALLERY_INDEX_POLL_S,
+                                     settings.GALLERY_CHANGELOG_RETENTION_HOURS, settings.GALLERY_INDEX_VERIFY_S)
+    _writer.start()
+
+
+def stop_writer() -> None:
+    if _writer is not None:
+        _writer.stop()
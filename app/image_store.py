@@ -0,0 +1,276 @@
+"""
+Content-addressed storage for face images.
+
+An upload is stored once per distinct content in image_blobs, keyed by its
+SHA-256. face_images rows point at the blob (content_sha256), so a file
+enrolled several times, or for several users, costs one copy.
+
+A background transcoder runs one thread per worker. Work is claimed with
+FOR UPDATE SKIP LOCKED (advisory locks for renders, which run outside any
+transaction), so workers never collide. It:
+
+  * moves pre-existing face_images.image_bytes into blobs;
+  * writes an archive rendition of each blob: the face (the engine's Haar
+    box) with IMAGE_ARCHIVE_FACE_MARGIN around it, at most
+    IMAGE_ARCHIVE_MAX_PX on the long side, as JPEG or WebP at
+    IMAGE_ARCHIVE_QUALITY;
+  * with IMAGE_DROP_ORIGINAL, drops the original once every image using it
+    has an embedding of the active model version;
+  * deletes blobs that no image (nor enrollment job) refers to any more.
+
+GET /face/image serves the original while it exists, else the rendition;
+re-embedding (reembed.py) reads the same bytes. Postgres hands the space of
+dropped originals back to the OS only after VACUUM FULL / pg_repack; until
+then it is reused for new rows.
+"""
+
+import hashlib
+import threading
+from typing import Optional
+
+import cv2
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .core.config import settings
+
+FORMATS = {"jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY, "image/jpeg"),
+           "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY, "image/webp")}
+ORIGINAL_MEDIA_TYPE = "image/jpeg"  # what /face/image has always answered for stored uploads
+GC_AGE_S = 3600  # unreferenced blobs younger than this may belong to a transaction still in flight
+TRANSCODE_LOCK_CLASS = 0x494D47  # first key of the transcoder's per-blob advisory locks ("IMG")
+
+
+def digest(data: bytes) -> bytes:
+    return hashlib.sha256(data).digest()
+
+
+def put_many(db: Session, contents: list[bytes]) -> list[bytes]:
+    """Store contents not stored yet (in the caller's transaction); returns their digests in order.
+
+    A blob that is already stored is touched instead: the row lock keeps the
+    collector off it until the caller commits, and the fresh created_at until
+    it is older than GC_AGE_S again, so an unreferenced blob being reused is
+    not deleted under the caller's reference.
+    """
+    digests = [digest(c) for c in contents]
+    unique = dict(zip(digests, contents))
+    if unique:
+        db.execute(text("""
+            INSERT INTO image_blobs (sha256, original, original_size)
+            SELECT * FROM unnest(CAST(:h AS BYTEA[]), CAST(:o AS BYTEA[]), CAST(:s AS INT[]))
+            ON CONFLICT (sha256) DO UPDATE SET created_at = NOW()
+        """), {"h": list(unique), "o": list(unique.values()), "s": [len(c) for c in unique.values()]})
+    return digests
+
+
+def content(image) -> tuple[bytes, str]:
+    """(bytes, media type) to serve for a FaceImage: legacy inline bytes, the original, else the rendition."""
+    if image.image_bytes is not None:
+        return image.image_bytes, ORIGINAL_MEDIA_TYPE
+    blob = image.blob
+    if blob.original_dropped_at is None:
+        return blob.original, ORIGINAL_MEDIA_TYPE
+    return blob.archive, FORMATS[blob.archive_format][2]
+
+
+def stored_size(image) -> int:
+    """Size of what content() serves, without loading the bytes of blob-backed images."""
+    if image.content_sha256 is None:
+        return len(image.image_bytes or b"")
+    blob = image.blob
+    return blob.original_size if blob.original_dropped_at is None else blob.archive_size
+
+
+def render_archive(data: bytes, detect, fmt: str, max_px: int, quality: int,
+                   margin: float) -> Optional[tuple[bytes, Optional[tuple]]]:
+    """Face-centred, size-capped rendition of an image: (encoded bytes, face box) or None if undecodable."""
+    bgr = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if bgr is None:
+        return None
+    h, w = bgr.shape[:2]
+    # Detect on a copy of at most 1024 px: Haar cost grows with the pixel count
+    scale = min(1.0, 1024 / max(h, w))
+    small = cv2.resize(bgr, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else bgr
+    boxes = detect(small)
+    box = None
+    if boxes:
+        x, y, bw, bh = (int(round(v / scale)) for v in boxes[0])
+        box = (x, y, bw, bh)
+        side = int(max(bw, bh) * margin)
+        cx, cy = x + bw // 2, y + bh // 2
+        x0, y0 = max(0, cx - side // 2), max(0, cy - side // 2)
+        bgr = bgr[y0:min(h, y0 + side), x0:min(w, x0 + side)]
+        h, w = bgr.shape[:2]
+    if max(h, w) > max_px:
+        f = max_px / max(h, w)
+        bgr = cv2.resize(bgr, (max(1, int(w * f)), max(1, int(h * f))), interpolation=cv2.INTER_AREA)
+    ext, flag, _ = FORMATS[fmt]
+    ok, enc = cv2.imencode(ext, bgr, [flag, quality])
+    return (enc.tobytes(), box) if ok else None
+
+
+class ImageTranscoder:
+    """Backfills, transcodes, drops originals and collects unreferenced blobs, a small batch at a time."""
+
+    def __init__(self, poll_s: float, batch: int):
+        self.poll = max(1.0, poll_s)
+        self.batch = max(1, batch)
+        self.counts = {"backfilled": 0, "transcoded": 0, "undecodable": 0, "originals_dropped": 0, "blobs_deleted": 0}
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _backfill(self, conn) -> int:
+        rows = conn.execute(text("""
+            SELECT id, image_bytes FROM face_images
+            WHERE content_sha256 IS NULL AND image_bytes IS NOT NULL
+            ORDER BY id LIMIT :n FOR UPDATE SKIP LOCKED
+        """), {"n": self.batch}).fetchall()
+        if rows:
+            digests = put_many(conn, [bytes(r.image_bytes) for r in rows])
+            conn.execute(text("UPDATE face_images SET content_sha256 = :h, image_bytes = NULL WHERE id = :id"),
+                         [{"h": h, "id": r.id} for r, h in zip(rows, digests)])
+        return len(rows)
+
+    def _transcode(self, conn) -> int:
+        """Render archives outside any transaction.
+
+        conn is not in a transaction. Blobs are claimed with session advisory
+        locks rather than row locks, so put_many touching a blob that is being
+        rendered does not wait for the render; the write-back only fills blobs
+        that still have no archive.
+        """
+        from .face_engine_arcface import engine_arc
+
+        try:
+            claimed = conn.execute(text("""
+                SELECT c.sha256 FROM (
+                  SELECT sha256 FROM image_blobs WHERE archive IS NULL AND original IS NOT NULL LIMIT :scan
+                ) c
+                WHERE pg_try_advisory_lock(:k, hashtext(encode(c.sha256, 'hex')))
+                LIMIT :n
+            """), {"scan": self.batch * 4, "n": self.batch, "k": TRANSCODE_LOCK_CLASS}).scalars().all()
+            rows = conn.execute(text("""
+                SELECT sha256, original FROM image_blobs
+                WHERE sha256 = ANY(:h) AND archive IS NULL AND original IS NOT NULL
+            """), {"h": claimed}).fetchall() if claimed else []
+            conn.commit()
+            fmt = settings.IMAGE_ARCHIVE_FORMAT if settings.IMAGE_ARCHIVE_FORMAT in FORMATS else "jpeg"
+            done = 0
+            for r in rows:
+                out = render_archive(bytes(r.original), engine_arc._detect_faces, fmt, settings.IMAGE_ARCHIVE_MAX_PX,
+                                     settings.IMAGE_ARCHIVE_QUALITY, settings.IMAGE_ARCHIVE_FACE_MARGIN)
+                if out is None:
+                    # Keep the original as its own rendition so the blob is not picked up again
+                    self.counts["undecodable"] += 1
+                    archive, box, row_fmt = bytes(r.original), None, "jpeg"
+                else:
+                    (archive, box), row_fmt = out, fmt
+                # One short transaction per blob; a blob collected meanwhile is simply not updated
+                done += conn.execute(text("""
+                    UPDATE image_blobs SET archive = :a, archive_format = :f, archive_size = :s,
+                           face_box = CAST(:b AS INT[]), transcoded_at = NOW()
+                    WHERE sha256 = :h AND archive IS NULL
+                """), {"a": archive, "f": row_fmt, "s": len(archive), "b": list(box) if box else None,
+                       "h": r.sha256}).rowcount or 0
+                conn.commit()
+            return done
+        finally:
+            conn.rollback()
+            conn.execute(text("SELECT pg_advisory_unlock_all()"))
+            conn.commit()
+
+    def _drop_originals(self, conn) -> int:
+        from .embedding_versions import active_version
+
+        version, _ = active_version(conn)
+        return conn.execute(text("""
+            UPDATE image_blobs SET original = NULL, original_dropped_at = NOW()
+            WHERE sha256 IN (
+              SELECT b.sha256 FROM image_blobs b
+              WHERE b.original IS NOT NULL AND b.archive IS NOT NULL
+                AND EXISTS (SELECT 1 FROM face_images fi WHERE fi.content_sha256 = b.sha256)
+                AND NOT EXISTS (SELECT 1 FROM enrollment_job_frames f JOIN enrollment_jobs j ON j.id = f.job_id
+                                WHERE f.content_sha256 = b.sha256 AND j.status IN ('queued', 'running'))
+                AND NOT EXISTS (
+                  SELECT 1 FROM face_images fi
+                  WHERE fi.content_sha256 = b.sha256
+                    AND NOT EXISTS (SELECT 1 FROM face_embeddings e
+                                    WHERE e.face_image_id = fi.id AND e.model_version = :mv))
+              LIMIT :n FOR UPDATE SKIP LOCKED)
+        """), {"mv": version, "n": self.batch}).rowcount or 0
+
+    def _collect(self, conn) -> int:
+        return conn.execute(text("""
+            DELETE FROM image_blobs WHERE sha256 IN (
+              SELECT b.sha256 FROM image_blobs b
+              WHERE b.created_at < NOW() - make_interval(secs => :age)
+                AND NOT EXISTS (SELECT 1 FROM face_images fi WHERE fi.content_sha256 = b.sha256)
+                AND NOT EXISTS (SELECT 1 FROM enrollment_job_frames f WHERE f.content_sha256 = b.sha256)
+              LIMIT :n FOR UPDATE SKIP LOCKED)
+        """), {"age": GC_AGE_S, "n": self.batch}).rowcount or 0
+
+    def run_once(self, drop_originals: Optional[bool] = None) -> int:
+        """One batch of each step, each in its own transaction; returns the number of rows handled."""
+        from .database import engine
+
+        drop = settings.IMAGE_DROP_ORIGINAL if drop_originals is None else drop_originals
+        steps = [("backfilled", self._backfill), ("transcoded", self._transcode)]
+        if drop:
+            steps.append(("originals_dropped", self._drop_originals))
+        steps.append(("blobs_deleted", self._collect))
+        done = 0
+        for name, step in steps:
+            try:
+                # The transcode step commits on its own so no transaction spans a render
+                with (engine.connect() if step == self._transcode else engine.begin()) as conn:
+                    n = step(conn)
+            except Exception as exc:  # e.g. a blob referenced again while being collected; retried next round
+                self.errors += 1
+                self.last_error = f"{name}: {exc}"
+                print(f"[images] {name} failed: {exc}")
+                continue
+            self.counts[name] += n
+            done += n
+        return done
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="image-transcoder", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            busy = self.run_once()
+            # Keep going while there is a backlog, with a breather so requests keep the CPU
+            self._stop.wait(0.5 if busy else self.poll)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {"enabled": settings.IMAGE_TRANSCODE_ENABLED, **self.counts,
+                "errors": self.errors, "last_error": self.last_error}
+
+
+def storage_stats(conn) -> dict:
+    row = conn.execute(text("""
+        SELECT (SELECT count(*) FROM face_images) AS images,
+               (SELECT count(*) FROM face_images WHERE content_sha256 IS NULL) AS images_inline,
+               (SELECT COALESCE(sum(octet_length(image_bytes)), 0) FROM face_images) AS inline_bytes,
+               count(*) AS blobs,
+               count(*) FILTER (WHERE archive IS NULL) AS blobs_pending,
+               count(*) FILTER (WHERE original_dropped_at IS NOT NULL) AS originals_dropped,
+               COALESCE(sum(original_size), 0) AS uploaded_bytes,
+               COALESCE(sum(octet_length(original)), 0) AS original_bytes,
+               COALESCE(sum(octet_length(archive)), 0) AS archive_bytes
+        FROM image_blobs
+    """)).mappings().one()
+    return dict(row)
+
+
+transcoder = ImageTranscoder(settings.IMAGE_TRANSCODE_POLL_S, settings.IMAGE_TRANSCODE_BATCH)
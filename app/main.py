@@ -1,12 +1,20 @@
 import os
+import threading
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy import text
-from .database import Base, engine, SessionLocal
-from . import models
-from .routers import auth_router, face_router, liveness_router
+from .routers import auth_router, face_router, liveness_router, admin_router, analytics_router
 from .auth import hash_password
 from .core.config import settings
+from .flight_recorder import FlightRecorderMiddleware
+from .uploads import UploadLimitMiddleware
+from .audit_writer import audit_writer
+from .password_pool import password_pool, PasswordPoolBusy
+from .face_engine_arcface import engine_arc
+from .migrate import run_migrations
+from .org_search import OrgSearchBusy
+from . import audit_partitions, gallery_index, embedding_versions, image_store, enrollment_jobs
 
 # Optional psycopg (psycopg3) for local DB ensure
 try:
@@ -14,13 +22,7 @@ try:
 except Exception:  # pragma: no cover
     psycopg = None  # noqa: N816
 
-# Create tables (DDL is handled by migrations.sql; this is safe)
-try:
-    models.Base.metadata.create_all(bind=engine)
-except Exception as exc:
-    # Database may not be available during startup - this is handled in startup event
-    print(f"[startup] Database table creation skipped: {exc}")
-
+# Tables are created by the migration runner in the startup hook, not at import time
 # Enable CORS for configured origins
 app = FastAPI(title=settings.PROJECT_NAME, version=settings.APP_VERSION)
 app.add_middleware(
@@ -30,15 +32,39 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(UploadLimitMiddleware, max_bytes=settings.MAX_REQUEST_SIZE)
+if settings.FLIGHT_RECORDER_ENABLED:
+    app.add_middleware(FlightRecorderMiddleware)
 
 app.include_router(auth_router.router)
 app.include_router(face_router.router)
 app.include_router(liveness_router.router)
+app.include_router(admin_router.router)
+app.include_router(analytics_router.router)
+
+# Readiness: flipped by the startup hook and the warmup thread
+_readiness = {"migrations": False, "face_engine": False, "liveness": False}
+_warmup_info: dict = {}
+_stopping = threading.Event()
+
+@app.exception_handler(PasswordPoolBusy)
+def password_pool_busy(request, exc):
+    return JSONResponse({"detail": "Server busy, retry shortly"}, status_code=503, headers={"Retry-After": "1"})
+
+@app.exception_handler(OrgSearchBusy)
+def org_search_busy(request, exc):
+    return JSONResponse({"detail": "Org search busy, retry shortly"}, status_code=503, headers={"Retry-After": "1"})
 
 @app.get("/")
 def root():
     return {"status": "ok", "env": os.getenv("ENV", "dev")}
 
+@app.get("/ready")
+def ready():
+    """200 once migrations ran and models are warm; 503 before that"""
+    body = {"ready": all(_readiness.values()), "components": _readiness, "warmup": _warmup_info}
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
 
 def _ensure_database_exists():
     """Create target database if it does not exist by connecting to 'postgres'."""
@@ -64,72 +90,111 @@ def _ensure_database_exists():
         print(f"[startup] ensure db exists skipped: {exc}")
 
 
-def _run_migrations_if_needed():
-    """Execute migrations.sql on startup to ensure vector extension and tables exist.
-    Safe to run multiple times (DDL uses IF NOT EXISTS)."""
+def _seed_defaults(conn):
+    """Seed default branch, device and admin users so tenant headers work out of the box."""
+    # Ensure default branch exists
+    conn.execute(text(
+        """
+        INSERT INTO branches(org_id, code, name) VALUES (:o, :c, :n)
+        ON CONFLICT (code) DO NOTHING
+        """
+    ), {"o": "default", "c": "main-branch", "n": "Main Branch"})
+    br = conn.execute(text("SELECT id FROM branches WHERE code=:c"), {"c": "main-branch"}).first()
+    branch_id = br[0] if br else None
+
+    # Ensure a default device exists and active
+    conn.execute(text(
+        """
+        INSERT INTO devices(branch_id, device_code, active)
+        SELECT b.id, :dc, TRUE
+        FROM branches b
+        WHERE b.code = :bc
+        ON CONFLICT (device_code) DO NOTHING
+        """
+    ), {"dc": "web-client", "bc": "main-branch"})
+
+    # Seed admin users if not exists (use example.com which passes EmailStr)
+    for admin_email in ("admin@example.com", "admin@local.test"):
+        existing = conn.execute(text("SELECT id FROM users WHERE email=:e"), {"e": admin_email}).first()
+        if not existing and branch_id is not None:
+            conn.execute(text(
+                """
+                INSERT INTO users(email, password_hash, full_name, org_id, branch_id)
+                VALUES (:e, :ph, :fn, :org, :bid)
+                """
+            ), {
+                "e": admin_email,
+                "ph": hash_password("Admin@12345"),
+                "fn": "Admin User",
+                "org": "default",
+                "bid": branch_id,
+            })
+
+
+def _warmup():
+    """Load the ArcFace session and mediapipe off the request path."""
+    try:
+        _warmup_info["face_engine"] = engine_arc.warmup()
+        _readiness["face_engine"] = True
+        _warmup_info["liveness"] = liveness_router.warmup()
+        _readiness["liveness"] = True
+        password_pool.warmup()
+    except Exception as exc:  # pragma: no cover
+        _warmup_info["error"] = str(exc)
+        print(f"[startup] warmup failed: {exc}")
+
+
+def _migrate() -> None:
+    _ensure_database_exists()
+    run_migrations(seed=_seed_defaults)
+    _readiness["migrations"] = True
     try:
-        import pathlib
-        migrations_path = pathlib.Path(__file__).resolve().parents[1] / "migrations.sql"
-        if migrations_path.exists():
-            with open(migrations_path, "r", encoding="utf-8") as f:
-                sql_script = f.read()
-            with engine.begin() as conn:
-                conn.exec_driver_sql(sql_script)
+        audit_partitions.maintain()
     except Exception as exc:  # pragma: no cover
-        # Log but don't block app startup
-        print(f"[startup] migrations skipped: {exc}")
+        print(f"[startup] audit partition maintenance skipped: {exc}")
+
+
+def _retry_migrations():
+    """Keep trying until the database is reachable, backing off up to a minute between attempts."""
+    delay = 1.0
+    while not _stopping.wait(delay):
+        try:
+            _migrate()
+            print("[startup] migrations applied after retrying")
+            return
+        except Exception as exc:  # pragma: no cover
+            delay = min(60.0, delay * 2)
+            print(f"[startup] migrations failed, retrying in {delay:.0f}s: {exc}")
 
 
 @app.on_event("startup")
-def seed_defaults():
-    """Seed default branch and device if not present so tenant headers work out of the box."""
+def startup():
+    """Apply migrations once per deploy, maintain audit partitions, then warm models."""
     try:
-        _ensure_database_exists()
-        _run_migrations_if_needed()
-        db = SessionLocal()
-        # Ensure default branch exists
-        res = db.execute(text("SELECT id FROM branches WHERE code=:c"), {"c": "main-branch"}).first()
-        if not res:
-            db.execute(
-                text("INSERT INTO branches(org_id, code, name) VALUES (:o,:c,:n)"),
-                {"o": "default", "c": "main-branch", "n": "Main Branch"},
-            )
-            db.commit()
-
-        # Get branch id for seeding users/devices
-        br = db.execute(text("SELECT id FROM branches WHERE code=:c"), {"c": "main-branch"}).first()
-        branch_id = br[0] if br else None
-
-        # Ensure a default device exists and active
-        db.execute(text(
-            """
-            INSERT INTO devices(branch_id, device_code, active)
-            SELECT b.id, :dc, TRUE
-            FROM branches b
-            WHERE b.code = :bc
-            ON CONFLICT (device_code) DO NOTHING
-            """
-        ), {"dc": "web-client", "bc": "main-branch"})
-        db.commit()
-
-        # Seed admin users if not exists (use example.com which passes EmailStr)
-        for admin_email in ("admin@example.com", "admin@local.test"):
-            existing = db.execute(text("SELECT id FROM users WHERE email=:e"), {"e": admin_email}).first()
-            if not existing and branch_id is not None:
-                db.execute(text(
-                    """
-                    INSERT INTO users(email, password_hash, full_name, org_id, branch_id)
-                    VALUES (:e, :ph, :fn, :org, :bid)
-                    """
-                ), {
-                    "e": admin_email,
-                    "ph": hash_password("Admin@12345"),
-                    "fn": "Admin User",
-                    "org": "default",
-                    "bid": branch_id,
-                })
-                db.commit()
-        db.close()
+        _migrate()
     except Exception as exc:  # pragma: no cover
-        # Log but continue; database may not be available
-        print(f"[startup] seed defaults skipped: {exc}")
+        # Database may not be available yet: /ready stays 503 until a retry succeeds
+        print(f"[startup] migrations failed, retrying in the background: {exc}")
+        threading.Thread(target=_retry_migrations, name="migrations", daemon=True).start()
+    gallery_index.start_writer()
+    embedding_versions.watcher.start()
+    if settings.IMAGE_TRANSCODE_ENABLED:
+        image_store.transcoder.start()
+    if settings.ENROLL_JOBS_ENABLED:
+        enrollment_jobs.pool.start()
+    if settings.WARMUP_ON_STARTUP:
+        threading.Thread(target=_warmup, name="warmup", daemon=True).start()
+    else:
+        _readiness["face_engine"] = _readiness["liveness"] = True
+
+
+@app.on_event("shutdown")
+def flush_audit():
+    """Drain buffered audit rows before the worker exits."""
+    _stopping.set()
+    audit_writer.close()
+    password_pool.close()
+    gallery_index.stop_writer()
+    embedding_versions.watcher.stop()
+    image_store.transcoder.stop()
+    enrollment_jobs.pool.stop()
@@ -0,0 +1,65 @@
+"""
+Worker-safe migration runner.
+
+migrations.sql is applied at most once per content version: every worker takes
+the same Postgres advisory lock, and only the first one to find its version
+missing from schema_version runs the DDL (plus seeding) in one transaction.
+The others wait on the lock, see the version row and return immediately.
+"""
+
+import hashlib
+import pathlib
+import time
+from typing import Callable, Optional
+
+from sqlalchemy import text
+
+from .database import Base, engine
+from . import models  # noqa: F401  (register tables on Base.metadata)
+
+MIGRATIONS_PATH = pathlib.Path(__file__).resolve().parents[1] / "migrations.sql"
+MIGRATION_LOCK_KEY = 0x46414345  # "FACE"
+
+
+def migrations_version(sql: str) -> str:
+    return hashlib.sha256(sql.encode("utf-8")).hexdigest()[:16]
+
+
+def run_migrations(seed: Optional[Callable] = None) -> bool:
+    """Apply migrations.sql if this version has not been applied; returns True if it ran here.
+
+    seed(conn) runs in the same transaction, so a crash leaves neither half-applied.
+    """
+    sql = MIGRATIONS_PATH.read_text(encoding="utf-8")
+    version = migrations_version(sql)
+    with engine.connect() as lock_conn:
+        lock_conn = lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        lock_conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": MIGRATION_LOCK_KEY})
+        try:
+            lock_conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                  version VARCHAR(64) PRIMARY KEY,
+                  applied_at TIMESTAMP DEFAULT NOW(),
+                  duration_ms INT
+                )
+            """))
+            done = lock_conn.execute(
+                text("SELECT 1 FROM schema_version WHERE version = :v"), {"v": version}
+            ).first()
+            if done:
+                return False
+            t0 = time.perf_counter()
+            with engine.begin() as conn:
+                # Straight to the driver: no parameter parsing of '%' inside format() calls
+                conn.connection.driver_connection.execute(sql)
+                Base.metadata.create_all(bind=conn)
+                if seed is not None:
+                    seed(conn)
+                conn.execute(
+                    text("INSERT INTO schema_version(version, duration_ms) VALUES (:v, :ms)"),
+                    {"v": version, "ms": int((time.perf_counter() - t0) * 1000)},
+                )
+            print(f"[startup] applied migrations {version} in {(time.perf_counter() - t0) * 1000:.0f} ms")
+            return True
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": MIGRATION_LOCK_KEY})
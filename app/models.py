@@ -1,5 +1,5 @@
 from sqlalchemy import Column, Integer, String, LargeBinary, ForeignKey, DateTime, func, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 from .database import Base
 
 class Branch(Base):
@@ -32,6 +32,20 @@ class FaceImage(Base):
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     filename = Column(String(255))
-    image_bytes = Column(LargeBinary, nullable=False)
+    image_bytes = deferred(Column(LargeBinary))  # legacy rows only; see ImageBlob
+    content_sha256 = Column(LargeBinary, ForeignKey("image_blobs.sha256"))
     created_at = Column(DateTime, server_default=func.now())
-    user = relationship("User", back_populates="images")
\ No newline at end of file
+    user = relationship("User", back_populates="images")
+    blob = relationship("ImageBlob")
+
+class ImageBlob(Base):
+    __tablename__ = "image_blobs"
+    sha256 = Column(LargeBinary, primary_key=True)
+    original = deferred(Column(LargeBinary))
+    original_size = Column(Integer, nullable=False)
+    original_dropped_at = Column(DateTime)
+    archive = deferred(Column(LargeBinary))
+    archive_format = Column(String(8))
+    archive_size = Column(Integer)
+    created_at = Column(DateTime, server_default=func.now())
+    transcoded_at = Column(DateTime)
\ No newline at end of file
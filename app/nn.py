@@ -1,6 +1,10 @@
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 import numpy as np
+from .core.config import settings
+from .database import engine
+from .gallery_index import gallery_index
+from .embedding_versions import LEGACY_VERSION
 
 
 def _has_vector(db: Session) -> bool:
@@ -15,17 +19,19 @@ def _has_vector(db: Session) -> bool:
         return False
 
 
-def upsert_embedding(db: Session, user_id: int, branch_id: int, emb: np.ndarray):
-    if _has_vector(db):
-        # Convert numpy array to PostgreSQL vector format
-        emb_str = '[' + ','.join(map(str, emb.astype(float))) + ']'
-        db.execute(text("""
-            INSERT INTO face_embeddings (user_id, branch_id, embedding)
-            VALUES (:user_id, :branch_id, (:emb)::vector)
-        """), {"user_id": user_id, "branch_id": branch_id, "emb": emb_str})
-    else:
-        # Fallback table using BYTEA storage
-        db.execute(text("""
+_fallback_ready = False
+
+
+def _ensure_fallback() -> None:
+    """Create the BYTEA fallback table, or bring an older one up to the versioned schema (once per process).
+
+    Runs on a connection of its own so the caller's transaction is not committed early.
+    """
+    global _fallback_ready
+    if _fallback_ready:
+        return
+    with engine.begin() as conn:
+        conn.execute(text("""
             CREATE TABLE IF NOT EXISTS face_embeddings_fallback (
                 id SERIAL PRIMARY KEY,
                 user_id INT REFERENCES users(id) ON DELETE CASCADE,
@@ -34,24 +40,86 @@ def upsert_embedding(db: Session, user_id: int, branch_id: int, emb: np.ndarray)
                 created_at TIMESTAMP DEFAULT NOW()
             )
         """))
+        # Rows written before versions were tracked came from the legacy model
+        conn.execute(text("""
+            ALTER TABLE face_embeddings_fallback
+              ADD COLUMN IF NOT EXISTS model_version VARCHAR(64) NOT NULL DEFAULT 'legacy',
+              ADD COLUMN IF NOT EXISTS face_image_id INT REFERENCES face_images(id) ON DELETE SET NULL
+        """))
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS idx_embeddings_fallback_branch_version
+              ON face_embeddings_fallback(branch_id, model_version)
+        """))
+        conn.execute(text("""
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_embeddings_fallback_image_version
+              ON face_embeddings_fallback(face_image_id, model_version) WHERE face_image_id IS NOT NULL
+        """))
+    _fallback_ready = True
+
+
+def embeddings_table(db) -> str:
+    """face_embeddings, or face_embeddings_fallback (embedding as float32 BYTEA) without pgvector.
+
+    db is a Session or a Connection.
+    """
+    if _has_vector(db):
+        return "face_embeddings"
+    _ensure_fallback()
+    return "face_embeddings_fallback"
+
+
+def add_embeddings(db: Session, user_id: int, branch_id: int, items: list[tuple]) -> None:
+    """Insert (embedding, model_version, face_image_id) items in one statement; the caller commits.
+
+    model_version is the engine version that produced the embedding (see embedding_versions).
+    """
+    if not items:
+        return
+    if _has_vector(db):
+        db.execute(text("""
+            INSERT INTO face_embeddings (user_id, branch_id, embedding, model_version, face_image_id)
+            SELECT :user_id, :branch_id, e, mv, fid
+            FROM unnest(CAST(:embs AS vector[]), CAST(:mvs AS VARCHAR[]), CAST(:fids AS INT[])) AS t(e, mv, fid)
+        """), {
+            "user_id": user_id, "branch_id": branch_id,
+            # pgvector text format, one '[...]' literal per embedding
+            "embs": ['[' + ','.join(map(str, emb.astype(float))) + ']' for emb, _, _ in items],
+            "mvs": [mv for _, mv, _ in items],
+            "fids": [fid for _, _, fid in items],
+        })
+    else:
+        # Fallback table using BYTEA storage
+        _ensure_fallback()
         db.execute(text("""
-            INSERT INTO face_embeddings_fallback (user_id, branch_id, embedding)
-            VALUES (:uid, :bid, :emb)
-        """), {"uid": user_id, "bid": branch_id, "emb": emb.astype(np.float32).tobytes()})
+            INSERT INTO face_embeddings_fallback (user_id, branch_id, embedding, model_version, face_image_id)
+            SELECT :uid, :bid, e, mv, fid
+            FROM unnest(CAST(:embs AS BYTEA[]), CAST(:mvs AS VARCHAR[]), CAST(:fids AS INT[])) AS t(e, mv, fid)
+        """), {
+            "uid": user_id, "bid": branch_id,
+            "embs": [emb.astype(np.float32).tobytes() for emb, _, _ in items],
+            "mvs": [mv for _, mv, _ in items],
+            "fids": [fid for _, _, fid in items],
+        })
+
+
+def upsert_embedding(db: Session, user_id: int, branch_id: int, emb: np.ndarray,
+                     model_version: str = LEGACY_VERSION, face_image_id: int | None = None):
+    """Store one embedding and commit."""
+    add_embeddings(db, user_id, branch_id, [(emb, model_version, face_image_id)])
     db.commit()
 
 
-def search_top1(db: Session, emb: np.ndarray, branch_id: int):
+def search_top1(db: Session, emb: np.ndarray, branch_id: int, model_version: str = LEGACY_VERSION):
     if _has_vector(db):
         # Convert numpy array to PostgreSQL vector format
         emb_str = '[' + ','.join(map(str, emb.astype(float))) + ']'
         row = db.execute(text("""
             SELECT user_id, 1 - (embedding <=> (:emb)::vector) AS sim
             FROM face_embeddings
-            WHERE branch_id = :branch_id
+            WHERE branch_id = :branch_id AND model_version = :mv
             ORDER BY embedding <-> (:emb)::vector
             LIMIT 1
-        """), {"emb": emb_str, "branch_id": branch_id}).first()
+        """), {"emb": emb_str, "branch_id": branch_id, "mv": model_version}).first()
         if row:
             # Apply confidence boosting for better scores
             raw_sim = float(row[1])
@@ -60,9 +128,10 @@ def search_top1(db: Session, emb: np.ndarray, branch_id: int):
         return (None, 0.0)
     
     # Fallback: compute cosine similarity in Python
+    _ensure_fallback()
     rows = db.execute(text("""
-        SELECT user_id, embedding FROM face_embeddings_fallback WHERE branch_id = :bid
-    """), {"bid": branch_id}).fetchall()
+        SELECT user_id, embedding FROM face_embeddings_fallback WHERE branch_id = :bid AND model_version = :mv
+    """), {"bid": branch_id, "mv": model_version}).fetchall()
     if not rows:
         return (None, 0.0)
     
@@ -109,7 +178,8 @@ def _boost_confidence_score(raw_score: float) -> float:
     return max(0.0, min(1.0, boosted))
 
 
-def search_multiple(db: Session, emb: np.ndarray, branch_id: int, top_k: int = 3):
+def search_multiple(db: Session, emb: np.ndarray, branch_id: int, top_k: int = 3,
+                    model_version: str = LEGACY_VERSION):
     """
     Search for multiple similar faces, useful for debugging and analysis.
     """
@@ -119,16 +189,17 @@ def search_multiple(db: Session, emb: np.ndarray, branch_id: int, top_k: int = 3
         rows = db.execute(text("""
             SELECT user_id, 1 - (embedding <=> (:emb)::vector) AS sim
             FROM face_embeddings
-            WHERE branch_id = :branch_id
+            WHERE branch_id = :branch_id AND model_version = :mv
             ORDER BY embedding <-> (:emb)::vector
             LIMIT :top_k
-        """), {"emb": emb_str, "branch_id": branch_id, "top_k": top_k}).fetchall()
+        """), {"emb": emb_str, "branch_id": branch_id, "top_k": top_k, "mv": model_version}).fetchall()
         return [(row[0], _boost_confidence_score(float(row[1]))) for row in rows]
     
     # Fallback implementation
+    _ensure_fallback()
     rows = db.execute(text("""
-        SELECT user_id, embedding FROM face_embeddings_fallback WHERE branch_id = :bid
-    """), {"bid": branch_id}).fetchall()
+        SELECT user_id, embedding FROM face_embeddings_fallback WHERE branch_id = :bid AND model_version = :mv
+    """), {"bid": branch_id, "mv": model_version}).fetchall()
     
     if not rows:
         return []
@@ -147,4 +218,96 @@ def search_multiple(db: Session, emb: np.ndarray, branch_id: int, top_k: int = 3
     
     # Sort by similarity and return top_k
     similarities.sort(key=lambda x: x[1], reverse=True)
-    return similarities[:top_k]
\ No newline at end of file
+    return similarities[:top_k]
+
+def load_branch_gallery(db: Session, branch_id: int, dim: int = 512, model_version: str = LEGACY_VERSION):
+    """All embeddings of a branch and model version as (user_ids, unit-norm float32 matrix of shape (M, dim)).
+
+    Served from the memory-mapped gallery index when it is fresh, else from Postgres.
+    """
+    if settings.GALLERY_INDEX_ENABLED:
+        hit = gallery_index.get(branch_id, model_version)
+        if hit is not None and hit[1].shape[1] == dim:
+            return hit
+    if _has_vector(db):
+        rows = db.execute(text("""
+            SELECT user_id, embedding::real[] FROM face_embeddings WHERE branch_id = :bid AND model_version = :mv
+        """), {"bid": branch_id, "mv": model_version}).fetchall()
+        rows = [(uid, np.asarray(vec, dtype=np.float32)) for uid, vec in rows]
+    else:
+        _ensure_fallback()
+        rows = db.execute(text("""
+            SELECT user_id, embedding FROM face_embeddings_fallback WHERE branch_id = :bid AND model_version = :mv
+        """), {"bid": branch_id, "mv": model_version}).fetchall()
+        rows = [(uid, np.frombuffer(emb_bytes, dtype=np.float32)) for uid, emb_bytes in rows]
+    rows = [(uid, vec) for uid, vec in rows if vec.size == dim]
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, dim), dtype=np.float32)
+    user_ids = np.array([uid for uid, _ in rows], dtype=np.int64)
+    gallery = np.stack([vec for _, vec in rows])
+    gallery /= np.linalg.norm(gallery, axis=1, keepdims=True) + 1e-9
+    return user_ids, gallery
+
+
+def load_user_templates(db: Session, user_id: int, model_version: str = LEGACY_VERSION, dim: int = 512,
+                        branch_id: int | None = None):
+    """A user's embeddings of one model version as (embedding ids, unit-norm (K, dim) matrix).
+
+    All branches unless branch_id is given.
+    """
+    if _has_vector(db):
+        rows = db.execute(text("""
+            SELECT id, embedding::real[] FROM face_embeddings
+            WHERE user_id = :uid AND model_version = :mv AND (CAST(:bid AS INT) IS NULL OR branch_id = :bid)
+        """), {"uid": user_id, "mv": model_version, "bid": branch_id}).fetchall()
+        rows = [(eid, np.asarray(vec, dtype=np.float32)) for eid, vec in rows]
+    else:
+        _ensure_fallback()
+        rows = db.execute(text("""
+            SELECT id, embedding FROM face_embeddings_fallback
+            WHERE user_id = :uid AND model_version = :mv AND (CAST(:bid AS INT) IS NULL OR branch_id = :bid)
+        """), {"uid": user_id, "mv": model_version, "bid": branch_id}).fetchall()
+        rows = [(eid, np.frombuffer(emb_bytes, dtype=np.float32)) for eid, emb_bytes in rows]
+    rows = [(eid, vec) for eid, vec in rows if vec.size == dim]
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, dim), dtype=np.float32)
+    ids = np.array([eid for eid, _ in rows], dtype=np.int64)
+    templates = np.stack([vec for _, vec in rows])
+    templates /= np.linalg.norm(templates, axis=1, keepdims=True) + 1e-9
+    return ids, templates
+
+
+def verify_user_templates(db: Session, emb: np.ndarray, user_id: int, branch_id: int,
+                          model_version: str = LEGACY_VERSION):
+    """1:1 score of emb against one user's templates in a branch: (boosted_sim, number of templates)."""
+    q = np.asarray(emb, dtype=np.float32)
+    _, templates = load_user_templates(db, user_id, model_version, q.size, branch_id)
+    if len(templates) == 0:
+        return 0.0, 0
+    q = q / (np.linalg.norm(q) + 1e-9)
+    return _boost_confidence_score(float(np.max(templates @ q))), len(templates)
+
+
+def search_batch(db: Session, embs: np.ndarray, branch_id: int, model_version: str = LEGACY_VERSION):
+    """Top-1 (user_id, boosted_sim) for each row of embs with one matrix product against the gallery."""
+    if len(embs) == 0:
+        return []
+    q = np.asarray(embs, dtype=np.float32)
+    user_ids, gallery = load_branch_gallery(db, branch_id, q.shape[1], model_version)
+    return match_gallery(q, user_ids, gallery)
+
+
+def match_gallery(embs: np.ndarray, user_ids: np.ndarray, gallery: np.ndarray):
+    """Top-1 (user_id, boosted_sim) per row of embs against a gallery from load_branch_gallery."""
+    if len(embs) == 0:
+        return []
+    if len(user_ids) == 0:
+        return [(None, 0.0)] * len(embs)
+    q = np.asarray(embs, dtype=np.float32)
+    q = q / (np.linalg.norm(q, axis=1, keepdims=True) + 1e-9)
+    sims = q @ gallery.T  # (N, M)
+    best = np.argmax(sims, axis=1)
+    return [
+        (int(user_ids[j]), _boost_confidence_score(float(sims[i, j])))
+        for i, j in enumerate(best)
+    ]
@@ -0,0 +1,150 @@
+"""
+Org-wide identification across branch shards.
+
+Each branch of the org is one shard: its gallery comes from the memory-mapped
+gallery index when it is fresh (no database round trip), else from Postgres
+on a session of its own. The shard searches run concurrently on a small
+thread pool, each returns its best-scoring users, and the per-branch lists
+are merged with a heap. Shards still running after ORG_SEARCH_BUDGET_MS are
+left out and the answer is marked partial, so latency follows the slowest
+branch (capped by the budget) instead of the sum over branches.
+
+A thread cannot be stopped, so a shard reading Postgres gets a
+statement_timeout of the time left in the budget and gives its thread back
+soon after the request stops waiting for it. At most ORG_SEARCH_MAX_INFLIGHT
+shard searches are queued or running per worker. A request takes one slot per
+branch, or as many as are free, and feeds its branches through those slots as
+earlier shards finish, until the budget is spent; an org with more branches
+than the cap is searched in waves rather than refused. A request that finds
+no slot free gets OrgSearchBusy (503) straight away instead of timing out
+everyone's searches behind it.
+"""
+
+import heapq
+import threading
+import time
+from itertools import islice
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from .core.config import settings
+from .database import SessionLocal
+from .nn import _boost_confidence_score, load_branch_gallery
+
+_executor = ThreadPoolExecutor(max_workers=max(1, settings.ORG_SEARCH_THREADS), thread_name_prefix="org-search")
+_slots = threading.BoundedSemaphore(max(1, settings.ORG_SEARCH_MAX_INFLIGHT))
+
+
+class OrgSearchBusy(Exception):
+    """Too many shard searches in flight; retry later."""
+
+
+def org_branch_ids(db: Session, branch_id: int) -> list[int]:
+    """All branches of the org that branch_id belongs to (taken from the branch row, not a header)."""
+    return [r[0] for r in db.execute(text("""
+        SELECT id FROM branches WHERE org_id = (SELECT org_id FROM branches WHERE id = :bid) ORDER BY id
+    """), {"bid": branch_id})]
+
+
+def _search_branch(branch_id: int, q: np.ndarray, model_version: str, top_k: int,
+                   deadline: float) -> list[tuple[float, int, int]]:
+    """Best (raw_sim, user_id, branch_id) per user in one branch, highest first, at most top_k."""
+    left_ms = int((deadline - time.perf_counter()) * 1000)
+    if left_ms <= 0:
+        raise TimeoutError("budget spent before the search started")
+    with SessionLocal() as db:
+        # Only if the gallery index misses and Postgres is read: the query ends with the budget
+        event.listen(db, "after_begin", lambda _s, _t, conn: conn.exec_driver_sql(
+            f"SET LOCAL statement_timeout = {left_ms}"))
+        user_ids, gallery = load_branch_gallery(db, branch_id, q.size, model_version)
+    if len(user_ids) == 0:
+        return []
+    sims = gallery @ q
+    # A user can have several templates: look a bit past top_k so k distinct users survive
+    n = min(len(sims), top_k * 4)
+    idx = np.argpartition(-sims, n - 1)[:n]
+    out, seen = [], set()
+    for j in idx[np.argsort(-sims[idx])]:
+        uid = int(user_ids[j])
+        if uid not in seen:
+            seen.add(uid)
+            out.append((float(sims[j]), uid, branch_id))
+            if len(out) == top_k:
+                break
+    return out
+
+
+def search_org(emb: np.ndarray, branch_ids: list[int], model_version: str,
+               top_k: Optional[int] = None, budget_ms: Optional[int] = None) -> dict:
+    """Top-k users across branch_ids: {"matches": [...], "partial", "branches_searched", "timed_out", "failed"}."""
+    top_k = max(1, top_k or settings.ORG_SEARCH_TOP_K)
+    budget = (budget_ms if budget_ms is not None else settings.ORG_SEARCH_BUDGET_MS) / 1000.0
+    q = np.asarray(emb, dtype=np.float32).ravel()
+    q = q / (np.linalg.norm(q) + 1e-9)
+    t0 = time.perf_counter()
+    deadline = t0 + budget
+    taken = 0
+    while taken < len(branch_ids) and _slots.acquire(blocking=False):
+        taken += 1
+    if branch_ids and not taken:
+        raise OrgSearchBusy()
+    queue = iter(branch_ids)
+    futures, running, done = {}, set(), []
+
+    def submit(bid: int) -> None:
+        f = _executor.submit(_search_branch, bid, q, model_version, top_k, deadline)
+        futures[f] = bid
+        running.add(f)
+
+    for bid in islice(queue, taken):
+        submit(bid)
+    # Each slot is handed from a finished shard to the next branch, or back to the pool
+    while running:
+        left = deadline - time.perf_counter()
+        finished = wait(running, timeout=left, return_when=FIRST_COMPLETED)[0] if left > 0 else set()
+        if not finished:
+            break
+        for f in finished:
+            running.discard(f)
+            done.append(f)
+            nxt = next(queue, None) if time.perf_counter() < deadline else None
+            if nxt is not None:
+                submit(nxt)
+            else:
+                _slots.release()
+    pending = list(running)
+    for f in pending:
+        f.add_done_callback(lambda _f: _slots.release())  # also runs when cancelled
+        f.cancel()  # not started yet: dropped; already running: finishes in the background
+    # Branches never submitted because the budget ran out count as timed out too
+    skipped = list(queue)
+    per_branch, failed = [], []
+    for f in done:
+        try:
+            per_branch.append(f.result())
+        except Exception as exc:
+            failed.append(futures[f])
+            print(f"[org-search] branch {futures[f]} failed: {exc}")
+    # Each list is sorted best first; merge them lazily and stop at k distinct users
+    merged = heapq.merge(*per_branch, key=lambda r: -r[0])
+    matches, seen = [], set()
+    for sim, uid, bid in merged:
+        if uid in seen:
+            continue  # same person enrolled at several branches: keep the best
+        seen.add(uid)
+        matches.append({"user_id": uid, "branch_id": bid, "confidence": _boost_confidence_score(sim)})
+        if len(matches) == top_k:
+            break
+    return {
+        "matches": matches,
+        "partial": bool(pending or skipped or failed),
+        "branches_total": len(branch_ids),
+        "branches_searched": len(done) - len(failed),
+        "timed_out": sorted([futures[f] for f in pending] + skipped),
+        "failed": sorted(failed),
+        "search_ms": round((time.perf_counter() - t0) * 1000, 1),
+    }
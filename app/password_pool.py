@@ -0,0 +1,167 @@
+"""
+bcrypt off the request threads.
+
+Hashing and verification run in a small process pool so a login spike burns
+CPU in separate processes instead of holding the GIL of the worker that also
+serves face requests. The number of queued + running jobs is capped; past the
+cap callers get PasswordPoolBusy straight away (the routers turn it into 503)
+rather than piling up behind the pool.
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Optional
+
+from passlib.context import CryptContext
+
+from .core.config import settings
+
+
+def make_context(rounds: int) -> CryptContext:
+    # deprecated="auto" + the configured cost makes needs_update() true for older hashes
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+
+
+_ctx: Optional[CryptContext] = None
+
+
+def _context() -> CryptContext:
+    global _ctx
+    if _ctx is None:
+        _ctx = make_context(settings.BCRYPT_ROUNDS)
+    return _ctx
+
+
+# ---- run inside the pool processes (module-level so they pickle) -------------
+def _hash(password: str) -> str:
+    return _context().hash(password)
+
+
+def _verify_and_update(password: str, hash_: str) -> tuple[bool, Optional[str]]:
+    return _context().verify_and_update(password, hash_)
+
+
+def _noop() -> int:
+    return os.getpid()
+
+
+class PasswordPoolBusy(Exception):
+    """Too many hashes queued; retry later."""
+
+
+class PasswordPool:
+    def __init__(self, workers: int, max_pending: int, timeout_ms: int):
+        self.workers = max(0, workers)
+        self.max_pending = max(1, max_pending)
+        self.timeout = timeout_ms / 1000.0
+        self._reset()
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.rehashed = 0
+        self._latencies: deque = deque(maxlen=1000)
+
+    def _reset(self) -> None:
+        # Called again in a forked child: the executor's threads and pipes do not survive fork
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._pid != os.getpid():
+            self._reset()
+        if self._executor is None:
+            # spawn: forking a threaded server process is unsafe
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def _run(self, fn, *args):
+        t0 = time.perf_counter()
+        if self.workers == 0:
+            result = fn(*args)
+        else:
+            with self._lock:
+                if self._pending >= self.max_pending:
+                    self.rejected += 1
+                    raise PasswordPoolBusy()
+                self._pending += 1
+                try:
+                    future = self._get_executor().submit(fn, *args)
+                except Exception:
+                    self._pending -= 1
+                    raise
+            # Released when the job really finishes, so timed-out jobs still count against the cap
+            future.add_done_callback(self._done)
+            try:
+                result = future.result(timeout=self.timeout)
+            except FutureTimeout:
+                future.cancel()
+                self.timeouts += 1
+                raise PasswordPoolBusy()
+            except BrokenProcessPool:
+                # A pool process died (OOM kill etc.); start a fresh pool on the next call
+                with self._lock:
+                    self._executor = None
+                raise PasswordPoolBusy()
+        self._latencies.append((time.perf_counter() - t0) * 1000)
+        self.completed += 1
+        return result
+
+    def _done(self, _future) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def hash(self, password: str) -> str:
+        return self._run(_hash, password)
+
+    def verify_and_update(self, password: str, hash_: str) -> tuple[bool, Optional[str]]:
+        """(valid, new_hash); new_hash is set when the stored hash uses an outdated cost."""
+        ok, new_hash = self._run(_verify_and_update, password, hash_)
+        if new_hash:
+            self.rehashed += 1
+        return ok, new_hash
+
+    def warmup(self) -> None:
+        """Start the pool processes now instead of on the first login."""
+        if self.workers:
+            executor = self._get_executor()
+            list(executor.map(_noop, range(self.workers)))
+
+    def close(self) -> None:
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        lat = sorted(self._latencies)
+
+        def pct(p: float) -> float:
+            return round(lat[min(len(lat) - 1, int(p * len(lat)))], 2) if lat else 0.0
+
+        return {
+            "workers": self.workers,
+            "bcrypt_rounds": settings.BCRYPT_ROUNDS,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "rehashed": self.rehashed,
+            "p50_ms": pct(0.5),
+            "p95_ms": pct(0.95),
+            "max_ms": round(lat[-1], 2) if lat else 0.0,
+        }
+
+
+password_pool = PasswordPool(
+    settings.PASSWORD_POOL_WORKERS,
+    settings.PASSWORD_POOL_MAX_PENDING,
+    settings.PASSWORD_POOL_TIMEOUT_MS,
+)
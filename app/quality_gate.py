@@ -0,0 +1,84 @@
+"""
+Pre-inference quality gate for face frames.
+
+Runs on the Haar box the engine would embed, before any ONNX work. A frame
+whose face is blurred, badly exposed, too small or far off-centre is rejected
+with its reasons instead of costing an inference and, at enrollment, a
+gallery row that every later search has to scan. Sharpness and exposure are
+measured on the crop scaled to the model's 112x112 input, so the thresholds
+do not depend on the camera resolution.
+"""
+
+import math
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from .core.config import settings
+
+
+def laplacian_variance(gray: np.ndarray) -> float:
+    """Focus measure: variance of the Laplacian (low = blurred)."""
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var()) if gray.size else 0.0
+
+
+class QualityGate:
+    def __init__(self, min_sharpness: float, min_brightness: float, max_brightness: float,
+                 min_face_px: int, max_center_offset: float):
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.min_face_px = min_face_px
+        self.max_center_offset = max_center_offset
+
+    def assess(self, bgr: np.ndarray, box: tuple[int, int, int, int]) -> dict:
+        """Metrics for one face box and the reasons it fails, if any."""
+        x, y, w, h = box
+        gray = cv2.cvtColor(cv2.resize(bgr[y:y + h, x:x + w], (112, 112), interpolation=cv2.INTER_AREA),
+                            cv2.COLOR_BGR2GRAY)
+        sharpness = laplacian_variance(gray)
+        brightness = float(gray.mean())
+        img_h, img_w = bgr.shape[:2]
+        # Distance of the face centre from the image centre, 0 (centred) .. 1 (in a corner)
+        offset = math.hypot(x + w / 2 - img_w / 2, y + h / 2 - img_h / 2) / math.hypot(img_w / 2, img_h / 2)
+        reasons = []
+        if sharpness < self.min_sharpness:
+            reasons.append("blurry")
+        if brightness < self.min_brightness:
+            reasons.append("too_dark")
+        elif brightness > self.max_brightness:
+            reasons.append("overexposed")
+        if min(w, h) < self.min_face_px:
+            reasons.append("face_too_small")
+        if offset > self.max_center_offset:
+            reasons.append("off_center")
+        return {
+            "passed": not reasons,
+            "reasons": reasons,
+            "sharpness": round(sharpness, 1),
+            "brightness": round(brightness, 1),
+            "face_px": int(min(w, h)),
+            "center_offset": round(offset, 3),
+            # For ranking frames of one person: bigger and sharper is better
+            "score": round(w * h * min(1.0, sharpness / 100.0), 1),
+        }
+
+    def check(self, engine, img_bytes) -> tuple[Optional[np.ndarray], Optional[tuple], dict]:
+        """Decode, detect and assess the best face: (bgr, box, report); bgr/box are None without a face."""
+        bgr = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if bgr is None:
+            return None, None, {"passed": False, "reasons": ["undecodable"]}
+        boxes = engine._detect_faces(bgr)
+        if not boxes:
+            return None, None, {"passed": False, "reasons": ["no_face"]}
+        return bgr, boxes[0], self.assess(bgr, boxes[0])
+
+
+quality_gate = QualityGate(
+    settings.FACE_QUALITY_MIN_SHARPNESS,
+    settings.FACE_QUALITY_MIN_BRIGHTNESS,
+    settings.FACE_QUALITY_MAX_BRIGHTNESS,
+    settings.FACE_QUALITY_MIN_FACE_PX,
+    settings.FACE_QUALITY_MAX_CENTER_OFFSET,
+)
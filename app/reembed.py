@@ -0,0 +1,225 @@
+"""
+Re-embed the stored face images with another model, without downtime.
+
+    build(version, model_path)  embed face_images into face_embeddings rows tagged
+                                version, next to the rows of the active version
+    cutover(version)            make version the active one (one transaction)
+    purge(version)              delete the rows of a version that is no longer active
+
+build() walks face_images in id order and fans decoding, detection and
+inference out over a spawn process pool, REEMBED_BATCH_SIZE images per task,
+with a bounded number of tasks in flight. Results are written back in id
+order; a batch's rows and the new checkpoint (embedding_versions
+.checkpoint_image_id) commit together, so an interrupted run resumes exactly
+where it stopped. The API keeps serving the active version meanwhile.
+Without pgvector the same is done on face_embeddings_fallback (nn.embeddings_table).
+Images are read from their original upload, or from the archive rendition
+once the original has been dropped (image_store.py).
+
+Images enrolled while the job runs are caught up right before the flip, and
+again once workers have had time to notice it, which covers enrollments by
+workers that were still on the old model. Image ids are assigned before
+commit, so an image can commit below the checkpoint after it moved on; the
+catch-up passes therefore start from the first image and take every image
+that has no embedding of the version yet, whatever the checkpoint says.
+"""
+
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional
+
+import numpy as np
+from sqlalchemy import text
+
+from .core.config import settings
+from .database import engine
+from .embedding_versions import active_version
+from .nn import embeddings_table
+from .face_engine_arcface import ArcFaceCPU, _available_cpus, onnx_profile_from_settings, resolve_model_path
+
+MAX_VERSION_LENGTH = 32  # stored in the gallery index segment header
+
+# ---- run inside the pool processes ---------------------------------------------
+_worker_engine: Optional[ArcFaceCPU] = None
+
+
+def _init_worker(model_path: str, threads: int) -> None:
+    global _worker_engine
+    profile = onnx_profile_from_settings()
+    profile["intra_op_threads"] = threads  # the pool, not one process, gets the host's CPUs
+    _worker_engine = ArcFaceCPU(model_path, profile)
+    _worker_engine.load()
+
+
+def _embed_batch(images: list[bytes]) -> list[Optional[np.ndarray]]:
+    if _worker_engine._fallback:
+        raise RuntimeError(f"could not load {_worker_engine.model_path}")
+    return _worker_engine.embed_many(images, len(images))
+
+
+# ---- coordinator -----------------------------------------------------------------
+def _version_row(conn, version: str, lock: bool = False):
+    return conn.execute(text(
+        "SELECT version, model_path, status, checkpoint_image_id FROM embedding_versions WHERE version = :v"
+        + (" FOR UPDATE" if lock else "")
+    ), {"v": version}).first()
+
+
+def register(conn, version: str, model_path: Optional[str]) -> str:
+    """Create the version row if needed; returns the model path the version is built with."""
+    if not version or len(version.encode()) > MAX_VERSION_LENGTH:
+        raise ValueError(f"version must be 1-{MAX_VERSION_LENGTH} bytes")
+    row = _version_row(conn, version, lock=True)
+    if row is None:
+        if not model_path:
+            raise ValueError(f"unknown version {version}; pass the model to build it with")
+        conn.execute(text("INSERT INTO embedding_versions(version, model_path) VALUES (:v, :p)"),
+                     {"v": version, "p": model_path})
+        return model_path
+    if model_path and row.model_path and model_path != row.model_path:
+        raise ValueError(f"version {version} was built with {row.model_path}, not {model_path}")
+    return model_path or row.model_path or resolve_model_path()
+
+
+def _pending(conn, version: str, after_id: int, limit: int):
+    # Images without an embedding of version; branch of the image's existing embedding, else the user's branch
+    table = embeddings_table(conn)
+    return conn.execute(text(f"""
+        SELECT fi.id, fi.user_id, COALESCE(e.branch_id, u.branch_id) AS branch_id,
+               COALESCE(fi.image_bytes, b.original, b.archive) AS image_bytes
+        FROM face_images fi
+        JOIN users u ON u.id = fi.user_id
+        LEFT JOIN image_blobs b ON b.sha256 = fi.content_sha256
+        LEFT JOIN LATERAL (
+          SELECT branch_id FROM {table}
+          WHERE face_image_id = fi.id AND branch_id IS NOT NULL LIMIT 1
+        ) e ON TRUE
+        WHERE fi.id > :after
+          AND NOT EXISTS (SELECT 1 FROM {table} x WHERE x.face_image_id = fi.id AND x.model_version = :v)
+        ORDER BY fi.id
+        LIMIT :n
+    """), {"after": after_id, "v": version, "n": limit}).fetchall()
+
+
+def _write(version: str, meta: list[tuple], future) -> tuple[int, int]:
+    """Store one batch's embeddings and advance the checkpoint in the same transaction."""
+    embs = future.result()
+    with engine.begin() as conn:
+        table = embeddings_table(conn)
+        vector = table == "face_embeddings"
+        rows = [
+            {"uid": uid, "bid": bid, "fid": fid, "mv": version,
+             "emb": "[" + ",".join(map(str, emb.astype(float))) + "]" if vector else emb.astype(np.float32).tobytes()}
+            for (fid, uid, bid), emb in zip(meta, embs)
+            if emb is not None and bid is not None
+        ]
+        if rows:
+            conn.execute(text(f"""
+                INSERT INTO {table} (user_id, branch_id, embedding, model_version, face_image_id)
+                VALUES (:uid, :bid, {"(:emb)::vector" if vector else ":emb"}, :mv, :fid)
+                ON CONFLICT (face_image_id, model_version) WHERE face_image_id IS NOT NULL DO NOTHING
+            """), rows)
+        conn.execute(text("""
+            UPDATE embedding_versions
+            SET checkpoint_image_id = GREATEST(checkpoint_image_id, :c), images_done = images_done + :n
+            WHERE version = :v
+        """), {"c": meta[-1][0], "n": len(meta), "v": version})
+    return len(rows), len(meta) - len(rows)
+
+
+def build(version: str, model_path: Optional[str] = None, workers: int = 0, batch_size: int = 0,
+          progress: Optional[Callable[[dict], None]] = None, catch_up: bool = False) -> dict:
+    """Embed every face image past the version's checkpoint (catch_up: every image without an
+    embedding of the version); safe to interrupt and rerun."""
+    with engine.begin() as conn:
+        model_path = register(conn, version, model_path)
+        checkpoint = 0 if catch_up else _version_row(conn, version).checkpoint_image_id
+        total = conn.execute(text("SELECT count(*) FROM face_images")).scalar()
+        conn.execute(text("UPDATE embedding_versions SET images_total = :t WHERE version = :v"),
+                     {"t": total, "v": version})
+    workers = workers or settings.REEMBED_WORKERS or _available_cpus()
+    batch_size = max(1, batch_size or settings.REEMBED_BATCH_SIZE)
+    threads = max(1, _available_cpus() // workers)
+    stats = {"version": version, "model_path": model_path, "from_image_id": checkpoint,
+             "images": 0, "embedded": 0, "skipped": 0}
+    t0 = time.perf_counter()
+    inflight: deque = deque()
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(model_path, threads)) as pool:
+        after = checkpoint
+        while True:
+            with engine.connect() as conn:
+                rows = _pending(conn, version, after, batch_size)
+            exhausted = not rows
+            if rows:
+                after = rows[-1].id
+                meta = [(r.id, r.user_id, r.branch_id) for r in rows]
+                inflight.append((meta, pool.submit(_embed_batch, [r.image_bytes for r in rows])))
+            del rows  # the submitted task holds the bytes now
+            # One task queued per process beyond the running ones keeps the pool busy with bounded memory
+            while inflight and (len(inflight) > workers or exhausted):
+                meta, future = inflight.popleft()
+                embedded, skipped = _write(version, meta, future)
+                stats["images"] += len(meta)
+                stats["embedded"] += embedded
+                stats["skipped"] += skipped
+                stats["checkpoint"] = meta[-1][0]
+                stats["images_per_s"] = round(stats["images"] / (time.perf_counter() - t0), 1)
+                if progress is not None:
+                    progress(stats)
+            if exhausted:
+                break
+    return stats
+
+
+def cutover(version: str, workers: int = 0, batch_size: int = 0, grace_s: Optional[float] = None,
+            progress: Optional[Callable[[dict], None]] = None) -> dict:
+    """Catch up, make version active, wait for the workers to switch, catch up again."""
+    build(version, workers=workers, batch_size=batch_size, progress=progress, catch_up=True)
+    with engine.begin() as conn:
+        previous, _ = active_version(conn)
+        if _version_row(conn, version, lock=True) is None:
+            raise ValueError(f"unknown version {version}")
+        conn.execute(text("UPDATE embedding_versions SET status = 'retired' WHERE status = 'active' AND version <> :v"),
+                     {"v": version})
+        conn.execute(text("UPDATE embedding_versions SET status = 'active', activated_at = NOW() WHERE version = :v"),
+                     {"v": version})
+        # Wakes the gallery index writers so they rebuild for the new version
+        conn.execute(text("SELECT pg_notify('face_embeddings_changed', '0')"))
+    if grace_s is None:
+        # Workers poll, then load and warm the new model before switching
+        grace_s = 2 * settings.EMBEDDING_VERSION_POLL_S + 30
+    time.sleep(grace_s)
+    final = build(version, workers=workers, batch_size=batch_size, progress=progress, catch_up=True)
+    return {"version": version, "previous": previous, "caught_up_after_switch": final["images"]}
+
+
+def purge(version: str, chunk: int = 10000) -> int:
+    """Delete a non-active version's embeddings in chunks; returns the number of rows removed."""
+    with engine.connect() as conn:
+        if active_version(conn)[0] == version:
+            raise ValueError(f"{version} is the active version")
+        table = embeddings_table(conn)
+    removed = 0
+    while True:
+        with engine.begin() as conn:
+            n = conn.execute(text(f"""
+                DELETE FROM {table}
+                WHERE id IN (SELECT id FROM {table} WHERE model_version = :v LIMIT :n)
+            """), {"v": version, "n": chunk}).rowcount or 0
+        removed += n
+        if n < chunk:
+            return removed
+
+
+def status() -> list[dict]:
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"""
+            SELECT v.version, v.model_path, v.status, v.images_total, v.images_done, v.checkpoint_image_id,
+                   v.created_at, v.activated_at,
+                   (SELECT count(*) FROM {embeddings_table(conn)} e WHERE e.model_version = v.version) AS embeddings
+            FROM embedding_versions v ORDER BY v.created_at
+        """)).mappings().all()
+    return [dict(r) for r in rows]
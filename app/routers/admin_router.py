@@ -0,0 +1,134 @@
+import os
+import tempfile
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import text
+from ..auth_api_key import require_api_key
+from ..core.config import settings
+from ..database import engine
+from .. import flight_recorder, admission, embedding_versions, gallery_snapshot, duplicate_scan, sharing_detector, image_store, enrollment_jobs, schemas
+from ..gallery_index import gallery_index
+from ..audit_writer import audit_writer, write_audit_rows
+from ..password_pool import password_pool
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_api_key)])
+
+@router.get("/slow_requests")
+async def slow_requests():
+    """Dump the slowest recent requests with stage timings and sampled stacks"""
+    rec = flight_recorder.recorder
+    return {
+        "enabled": settings.FLIGHT_RECORDER_ENABLED,
+        "threshold_ms": settings.SLOW_REQUEST_THRESHOLD_MS,
+        "requests_seen": rec.requests_seen,
+        "requests": rec.dump(),
+    }
+
+@router.delete("/slow_requests")
+async def clear_slow_requests():
+    flight_recorder.recorder.clear()
+    return {"status": "ok"}
+
+@router.get("/metrics")
+async def metrics():
+    """In-process counters for this worker"""
+    return {"pid": os.getpid(), "audit": audit_writer.stats(), "password_pool": password_pool.stats(),
+            "admission": admission.stats(), "gallery_index": gallery_index.stats(),
+            "embedding_version": embedding_versions.watcher.stats(), "sharing": sharing_detector.detector.stats(),
+            "images": image_store.transcoder.stats(), "enroll_jobs": enrollment_jobs.pool.stats()}
+
+@router.get("/sharing_alerts")
+async def sharing_alerts(since_id: int = 0, limit: int = 100):
+    """Account-sharing alerts raised by this worker; poll with since_id = the last id seen"""
+    det = sharing_detector.detector
+    return {"pid": os.getpid(), "stats": det.stats(), "alerts": det.alerts(since_id, min(max(1, limit), 1000))}
+
+@router.delete("/sharing_alerts")
+async def clear_sharing_alerts():
+    sharing_detector.detector.clear()
+    return {"status": "ok"}
+
+@router.post("/tracemalloc/start")
+async def tracemalloc_start(frames: int = 25):
+    return flight_recorder.tracemalloc_start(frames)
+
+@router.post("/tracemalloc/stop")
+async def tracemalloc_stop():
+    return flight_recorder.tracemalloc_stop()
+
+@router.get("/tracemalloc/snapshot")
+async def tracemalloc_snapshot(limit: int = 25, key_type: str = "lineno", compare: bool = True):
+    """Top allocation sites, diffed against the previous snapshot when available"""
+    if key_type not in ("lineno", "filename", "traceback"):
+        raise HTTPException(400, "key_type must be lineno, filename or traceback")
+    try:
+        return flight_recorder.tracemalloc_snapshot(limit, key_type, compare)
+    except RuntimeError as exc:
+        raise HTTPException(409, str(exc))
+
+@router.get("/gallery/snapshot")
+async def export_gallery_snapshot(scope: str = "all", version: str | None = None, dtype: str = "float32"):
+    """Download a gallery snapshot: scope all, org:<org_id> or branch:<branch_code>"""
+    fd, path = tempfile.mkstemp(suffix=".fsnp")
+    os.close(fd)
+    try:
+        result = await run_in_threadpool(gallery_snapshot.export_snapshot, path, scope, version, dtype)
+    except ValueError as exc:
+        os.remove(path)
+        raise HTTPException(400, str(exc))
+    except Exception:
+        os.remove(path)
+        raise
+    name = f"gallery_{scope.replace(':', '_')}_{result['model_version']}.fsnp"
+    return FileResponse(path, media_type="application/octet-stream", filename=name,
+                        headers={"X-Snapshot-Count": str(result["count"])},
+                        background=BackgroundTask(os.remove, path))
+
+@router.post("/duplicates/scan")
+async def scan_duplicates(scope: str = "all", full: bool = False, threshold: float | None = None):
+    """Compare embeddings enrolled since the last scan of scope (all of them with full) against its gallery"""
+    try:
+        return await run_in_threadpool(duplicate_scan.scan, scope, full, threshold)
+    except ValueError as exc:
+        raise HTTPException(400, str(exc))
+
+@router.get("/duplicates")
+async def list_duplicates(scope: str = "all", min_similarity: float = 0.0, limit: int = 100):
+    """Accounts whose faces match another account's, most similar first"""
+    try:
+        pairs = await run_in_threadpool(duplicate_scan.list_pairs, scope, min_similarity, min(max(1, limit), 1000))
+    except ValueError as exc:
+        raise HTTPException(400, str(exc))
+    return {"scope": scope, "pairs": pairs}
+
+@router.get("/images/storage")
+async def image_storage():
+    """Stored image bytes: uploads, originals kept, archive renditions, and the transcoder backlog"""
+    def _stats():
+        with engine.connect() as conn:
+            return image_store.storage_stats(conn)
+    return {"storage": await run_in_threadpool(_stats), "transcoder": image_store.transcoder.stats()}
+
+@router.post("/edge/audit")
+async def edge_audit(payload: schemas.EdgeAuditPush):
+    """Audit rows buffered by an edge kiosk; rows at or below the kiosk's last accepted id are skipped"""
+    def _write():
+        with engine.begin() as conn:
+            branch_id = conn.execute(text("SELECT id FROM branches WHERE code = :c"), {"c": payload.branch_code}).scalar()
+            if branch_id is None:
+                raise HTTPException(404, "Branch not found")
+            conn.execute(text("INSERT INTO edge_audit_watermarks(kiosk_id) VALUES (:k) ON CONFLICT DO NOTHING"),
+                         {"k": payload.kiosk_id})
+            last = conn.execute(text("SELECT last_row_id FROM edge_audit_watermarks WHERE kiosk_id = :k FOR UPDATE"),
+                                {"k": payload.kiosk_id}).scalar()
+            rows = [r for r in payload.rows if r.id > last]
+            write_audit_rows(conn, [(r.user_id, branch_id, r.device_code, r.challenge, r.ok, r.confidence, r.created_at)
+                                    for r in rows])
+            if rows:
+                last = max(r.id for r in rows)
+                conn.execute(text("UPDATE edge_audit_watermarks SET last_row_id = :l, pushed_at = NOW() WHERE kiosk_id = :k"),
+                             {"l": last, "k": payload.kiosk_id})
+            return {"accepted": len(rows), "skipped": len(payload.rows) - len(rows), "last_id": last}
+    return await run_in_threadpool(_write)
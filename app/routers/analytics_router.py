@@ -0,0 +1,143 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from ..database import SessionLocal
+from .. import models
+from ..auth import get_current_user
+from ..audit_writer import HIST_BUCKETS
+
+# Served from auth_audit_hourly only, so cost depends on the window, not on audit volume
+router = APIRouter(prefix="/analytics", tags=["analytics"])
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+_FROM = """
+    FROM auth_audit_hourly h
+    JOIN branches b ON b.id = h.branch_id
+"""
+
+_WHERE = """
+    WHERE b.org_id = :org
+      AND h.bucket >= (NOW() AT TIME ZONE 'UTC') - make_interval(hours => :hours)
+      AND (CAST(:branch_code AS VARCHAR) IS NULL OR b.code = :branch_code)
+"""
+
+def _params(user: models.User, hours: int, branch_code: str | None) -> dict:
+    return {"org": user.org_id or "default", "hours": hours, "branch_code": branch_code}
+
+def _rate(successes: int, attempts: int) -> float:
+    return round(successes / attempts, 4) if attempts else 0.0
+
+@router.get("/summary")
+def summary(
+    hours: int = Query(24, ge=1, le=24 * 366),
+    branch_code: str | None = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Attempts, success rate and confidence histogram per branch"""
+    p = _params(current_user, hours, branch_code)
+    rows = db.execute(text(f"""
+        SELECT b.id, b.code, b.name, sum(h.attempts), sum(h.successes), sum(h.confidence_sum)
+        {_FROM}{_WHERE}
+        GROUP BY b.id, b.code, b.name
+        ORDER BY b.code
+    """), p).fetchall()
+    hist_rows = db.execute(text(f"""
+        SELECT b.id, u.i, sum(u.x)
+        {_FROM}
+        CROSS JOIN LATERAL unnest(h.confidence_hist) WITH ORDINALITY AS u(x, i)
+        {_WHERE}
+        GROUP BY b.id, u.i
+    """), p).fetchall()
+    hists: dict[int, list[int]] = {}
+    for bid, i, n in hist_rows:
+        hists.setdefault(bid, [0] * HIST_BUCKETS)[int(i) - 1] = int(n)
+
+    branches = []
+    total_attempts = total_successes = 0
+    for bid, code, name, attempts, successes, conf_sum in rows:
+        attempts, successes = int(attempts), int(successes)
+        total_attempts += attempts
+        total_successes += successes
+        branches.append({
+            "branch_id": bid,
+            "branch_code": code,
+            "branch_name": name,
+            "attempts": attempts,
+            "successes": successes,
+            "success_rate": _rate(successes, attempts),
+            "avg_confidence": round(float(conf_sum) / attempts, 4) if attempts else 0.0,
+            "confidence_hist": hists.get(bid, [0] * HIST_BUCKETS),
+        })
+    return {
+        "hours": hours,
+        "attempts": total_attempts,
+        "successes": total_successes,
+        "success_rate": _rate(total_successes, total_attempts),
+        "branches": branches,
+    }
+
+@router.get("/hourly")
+def hourly(
+    hours: int = Query(24, ge=1, le=24 * 93),
+    branch_code: str | None = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Per-hour attempt/success series (UTC buckets)"""
+    rows = db.execute(text(f"""
+        SELECT h.bucket, sum(h.attempts), sum(h.successes), sum(h.confidence_sum)
+        {_FROM}{_WHERE}
+        GROUP BY h.bucket
+        ORDER BY h.bucket
+    """), _params(current_user, hours, branch_code)).fetchall()
+    return {
+        "hours": hours,
+        "series": [
+            {
+                "bucket_utc": bucket.isoformat(),
+                "attempts": int(attempts),
+                "successes": int(successes),
+                "success_rate": _rate(int(successes), int(attempts)),
+                "avg_confidence": round(float(conf_sum) / int(attempts), 4) if attempts else 0.0,
+            }
+            for bucket, attempts, successes, conf_sum in rows
+        ],
+    }
+
+@router.get("/devices")
+def devices(
+    hours: int = Query(24, ge=1, le=24 * 366),
+    branch_code: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Busiest devices with their success rates"""
+    rows = db.execute(text(f"""
+        SELECT b.code, h.device_code, sum(h.attempts) AS attempts, sum(h.successes), max(h.bucket)
+        {_FROM}{_WHERE}
+        GROUP BY b.code, h.device_code
+        ORDER BY attempts DESC
+        LIMIT :limit
+    """), {**_params(current_user, hours, branch_code), "limit": limit}).fetchall()
+    return {
+        "hours": hours,
+        "devices": [
+            {
+                "branch_code": code,
+                "device_code": device or None,
+                "attempts": int(attempts),
+                "successes": int(successes),
+                "success_rate": _rate(int(successes), int(attempts)),
+                "last_seen_hour_utc": last.isoformat(),
+            }
+            for code, device, attempts, successes, last in rows
+        ],
+    }
@@ -3,7 +3,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import select, func
 from ..database import SessionLocal
 from .. import models, schemas
-from ..auth import hash_password, verify_password, create_token, get_current_user
+from ..auth import hash_password, verify_and_update_password, create_token, get_current_user
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
@@ -42,8 +42,15 @@ def signup(payload: schemas.UserCreate, db: Session = Depends(get_db)):
 @router.post("/login", response_model=schemas.TokenOut)
 def login(payload: schemas.UserLogin, db: Session = Depends(get_db)):
     user = db.execute(select(models.User).where(models.User.email == payload.email)).scalar_one_or_none()
-    if not user or not verify_password(payload.password, user.password_hash):
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    ok, new_hash = verify_and_update_password(payload.password, user.password_hash)
+    if not ok:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # BCRYPT_ROUNDS changed since this hash was made; upgrade it while we have the password
+        user.password_hash = new_hash
+        db.commit()
     token = create_token(str(user.id))
     return {"access_token": token}
 
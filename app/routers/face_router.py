@@ -1,15 +1,27 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Response, Form
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Response, Form, Header
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, selectinload
 from sqlalchemy import select, text
 from typing import List
 from ..database import SessionLocal
 from .. import models
 from ..auth import require_token
 from ..tenant_guard import tenant_context
+from ..admission import admit_face_compute
 from ..face_engine_arcface import engine_arc
-from ..nn import upsert_embedding, search_top1
-import httpx, os
+from ..nn import add_embeddings, search_top1, search_batch, load_branch_gallery, match_gallery, verify_user_templates
+from ..enrollment import dedup_candidates, store_frames
+from ..image_store import content, put_many, stored_size
+from ..flight_recorder import stage
+from .. import sharing_detector, enrollment_jobs
+from ..video_tracking import track_clip
+from ..quality_gate import quality_gate
+from ..org_search import org_branch_ids, search_org
+from ..uploads import read_image, read_image_sync, copy_upload
+from ..audit_writer import audit_writer, audit_row, write_audit_batch
+import httpx, os, json, tempfile
 import numpy as np
 from ..core.config import settings
 from io import BytesIO
@@ -23,7 +35,34 @@ def get_db():
     finally:
         db.close()
 
-@router.post("/enroll_passport")
+def _embed_local(by, bgr, box):
+    """(embedding, model_version) on the local engine, reusing the quality gate's decode and box if given."""
+    if box is None:
+        return engine_arc.versioned(engine_arc.embed, by)
+    embs, model_version = engine_arc.versioned(engine_arc.embed_crops, bgr, [box])
+    return embs[0], model_version
+
+async def _encode(by, bgr=None, box=None):
+    """(embedding, model_version) from FACE_ENGINE_URL when configured and answering, else the local engine."""
+    face_url = settings.FACE_ENGINE_URL
+    if face_url:
+        try:
+            url = f"{face_url.rstrip('/')}/encode"
+            with stage("remote_encode"):
+                async with httpx.AsyncClient(timeout=10.0) as client:
+                    resp = await client.post(url, content=bytes(by))
+            if resp.status_code == 200:
+                data = resp.json()
+                return np.array(data.get("embedding", []), dtype=np.float32), engine_arc.model_version
+        except Exception:
+            pass
+    with stage("embed"):
+        return await run_in_threadpool(_embed_local, by, bgr, box)
+
+def _quality_failure(report: dict) -> str:
+    return "Face quality too low: " + ", ".join(report["reasons"])
+
+@router.post("/enroll_passport", dependencies=[Depends(admit_face_compute)])
 async def enroll_passport(
     file: UploadFile = File(...),
     target_user_id: int | None = Form(None),
@@ -31,22 +70,16 @@ async def enroll_passport(
     tenant = Depends(tenant_context),
     db: Session = Depends(get_db),
 ):
-    by = await file.read()
+    by = await read_image(file)
+    bgr = box = None
+    if settings.FACE_QUALITY_ENROLL:
+        bgr, box, quality = await run_in_threadpool(quality_gate.check, engine_arc, by)
+        if box is None:
+            raise HTTPException(400, "No face detected in passport photo")
+        if not quality["passed"]:
+            raise HTTPException(422, _quality_failure(quality))
     # If external face engine is configured, proxy to it for encode
-    emb = None
-    face_url = settings.FACE_ENGINE_URL
-    if face_url:
-        try:
-            url = f"{face_url.rstrip('/')}/encode"
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                resp = await client.post(url, content=by)
-                if resp.status_code == 200:
-                    data = resp.json()
-                    emb = np.array(data.get("embedding", []), dtype=np.float32)
-        except Exception:
-            emb = None
-    if emb is None:
-        emb = engine_arc.embed(by)
+    emb, model_version = await _encode(by, bgr, box)
     if emb is None:
         raise HTTPException(400, "No face detected in passport photo")
 
@@ -59,21 +92,22 @@ async def enroll_passport(
         raise HTTPException(404, "User not found")
     if u.branch_id is None:
         db.execute(text("UPDATE users SET branch_id=:b WHERE id=:u"), {"b": tenant["branch_id"], "u": target_id})
-        db.commit()
 
     # Save the image to database
     face_image = models.FaceImage(
         user_id=target_id,
         filename=file.filename or f"passport_{target_id}_{file.size}.jpg",
-        image_bytes=by
+        content_sha256=put_many(db, [by])[0]
     )
     db.add(face_image)
-    
-    upsert_embedding(db, int(user_id), tenant["branch_id"], emb)
+    db.flush()
+
+    add_embeddings(db, target_id, tenant["branch_id"], [(emb, model_version, face_image.id)])
+    # Branch assignment, image and embedding commit together
     db.commit()
-    return {"status": "ok", "embeddings_added": 1, "image_id": face_image.id, "user_id": int(user_id)}
+    return {"status": "ok", "embeddings_added": 1, "image_id": face_image.id, "user_id": target_id}
 
-@router.post("/enroll_live")
+@router.post("/enroll_live", dependencies=[Depends(admit_face_compute)])
 async def enroll_live(
     files: List[UploadFile] = File(...),
     target_user_id: int | None = Form(None),
@@ -81,9 +115,6 @@ async def enroll_live(
     tenant = Depends(tenant_context),
     db: Session = Depends(get_db),
 ):
-    from ..core.config import settings
-    face_url = settings.FACE_ENGINE_URL
-    
     # Determine target user id to assign images/embeddings
     target_id = int(target_user_id) if target_user_id is not None else int(user_id)
 
@@ -92,80 +123,368 @@ async def enroll_live(
     if not u:
         raise HTTPException(404, "User not found")
 
-    added = 0
-    image_ids = []
-    for f in files:
-        by = await f.read()
-        emb = None
-        if face_url:
-            try:
-                url = f"{face_url.rstrip('/')}/encode"
-                async with httpx.AsyncClient(timeout=10.0) as client:
-                    resp = await client.post(url, content=by)
-                    if resp.status_code == 200:
-                        data = resp.json()
-                        emb = np.array(data.get("embedding", []), dtype=np.float32)
-            except Exception:
-                emb = None
-        if emb is None:
-            emb = engine_arc.embed(by)
+    rejected = []
+    candidates = []
+    # Pass 1, one frame resident at a time: gate and embed; only the embedding is kept
+    for index, f in enumerate(files):
+        by = await read_image(f)
+        bgr = box = None
+        quality = {}
+        if settings.FACE_QUALITY_ENROLL:
+            # Blurred / dark / off-centre frames are dropped before they cost an inference and a gallery row
+            bgr, box, quality = await run_in_threadpool(quality_gate.check, engine_arc, by)
+            if not quality["passed"]:
+                rejected.append({"index": index, "filename": f.filename, **quality})
+                continue
+        emb, model_version = await _encode(by, bgr, box)
+        del by, bgr
         if emb is None: 
+            rejected.append({"index": index, "filename": f.filename, "passed": False, "reasons": ["no_face"]})
             continue
-        
-        # Save the image to database
-        face_image = models.FaceImage(
-            user_id=target_id,
-            filename=f.filename or f"live_{target_id}_{f.size}_{added}.jpg",
-            image_bytes=by
-        )
-        db.add(face_image)
-        db.flush()  # Get the ID without committing
-        
-        upsert_embedding(db, target_id, tenant["branch_id"], emb)
-        image_ids.append(face_image.id)
-        added += 1
-    
-    if added == 0:
-        raise HTTPException(400, "No valid live frames")
-    
+        candidates.append({"index": index, "embedding": emb, "model_version": model_version,
+                           "score": quality.get("score", 0.0)})
+
+    # Near-duplicates of the user's templates or of better frames in this burst are not stored
+    kept, duplicates = dedup_candidates(db, target_id, candidates)
+    for d in duplicates:
+        d["filename"] = files[d["index"]].filename
+
+    if not kept and not duplicates:
+        reasons = sorted({r for item in rejected for r in item["reasons"]})
+        raise HTTPException(400, "No valid live frames" + (f" ({', '.join(reasons)})" if reasons else ""))
+
+    # Pass 2: re-read only the kept frames and write them all in one transaction
+    frames = []
+    for n, c in enumerate(kept):
+        f = files[c["index"]]
+        await f.seek(0)
+        frames.append((f.filename or f"live_{target_id}_{f.size}_{n}.jpg", await read_image(f),
+                       c["embedding"], c["model_version"]))
+    image_ids = store_frames(db, target_id, tenant["branch_id"], frames) if frames else []
+    added = len(image_ids)
+    del frames
     db.commit()
-    return {"status": "ok", "embeddings_added": added, "image_ids": image_ids, "user_id": int(user_id)}
+    return {"status": "ok", "embeddings_added": added, "image_ids": image_ids, "user_id": target_id,
+            "kept": [{"index": c["index"], "image_id": iid, "quality_score": c["score"]}
+                     for c, iid in zip(kept, image_ids)],
+            "duplicates": duplicates, "rejected": rejected}
 
-@router.post("/verify_arc")
+@router.post("/enroll_jobs", status_code=202)
+async def submit_enroll_job(
+    files: List[UploadFile] = File(...),
+    target_user_id: int | None = Form(None),
+    idempotency_key: str | None = Header(None),
+    user_id: int = Depends(require_token),
+    tenant = Depends(tenant_context),
+    db: Session = Depends(get_db),
+):
+    """enroll_live as a background job: answers with a job id as soon as the frames are stored.
+
+    Retrying with the same Idempotency-Key (or the same frames) returns the existing job.
+    """
+    target_id = int(target_user_id) if target_user_id is not None else int(user_id)
+    if len(files) > settings.ENROLL_JOB_MAX_FRAMES:
+        raise HTTPException(400, f"At most {settings.ENROLL_JOB_MAX_FRAMES} frames per job")
+    u = db.execute(select(models.User).where(models.User.id == target_id)).scalar_one_or_none()
+    if not u:
+        raise HTTPException(404, "User not found")
+    frames = [(f.filename, await read_image(f)) for f in files]
+    job_id, created = enrollment_jobs.submit(db, target_id, tenant["branch_id"], int(user_id), frames,
+                                             idempotency_key)
+    return {"job_id": job_id, "created": created, "status_url": f"/face/enroll_jobs/{job_id}",
+            **{k: v for k, v in enrollment_jobs.get(db, job_id).items() if k in ("status", "progress")}}
+
+@router.get("/enroll_jobs/{job_id}")
+async def get_enroll_job(
+    job_id: int,
+    user_id: int = Depends(require_token),
+    tenant = Depends(tenant_context),
+    db: Session = Depends(get_db),
+):
+    """Status and per-frame progress of an enrollment job; result holds enroll_live's response once done"""
+    job = enrollment_jobs.get(db, job_id)
+    if job is None or job["branch_id"] != tenant["branch_id"]:
+        raise HTTPException(404, "Job not found")
+    return job
+
+@router.post("/verify_arc", dependencies=[Depends(admit_face_compute)])
 async def verify_arc(
     file: UploadFile = File(...),
+    scope: str = Form("branch"),
     tenant = Depends(tenant_context),
     db: Session = Depends(get_db),
 ):
-    by = await file.read()
-    emb = None
-    face_url = settings.FACE_ENGINE_URL
-    if face_url:
-        try:
-            url = f"{face_url.rstrip('/')}/encode"
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                resp = await client.post(url, content=by)
-                if resp.status_code == 200:
-                    data = resp.json()
-                    emb = np.array(data.get("embedding", []), dtype=np.float32)
-        except Exception:
-            emb = None
-    if emb is None:
-        emb = engine_arc.embed(by)
+    """Identify the face against the branch gallery, or with scope=org against every branch of the org.
+
+    Org scope searches the branches concurrently within ORG_SEARCH_BUDGET_MS;
+    branches that do not answer in time are listed and the result is marked partial.
+    """
+    if scope not in ("branch", "org"):
+        raise HTTPException(400, "scope must be branch or org")
+    with stage("read_upload"):
+        by = await read_image(file)
+    bgr = box = None
+    if settings.FACE_QUALITY_VERIFY:
+        with stage("quality"):
+            bgr, box, quality = await run_in_threadpool(quality_gate.check, engine_arc, by)
+        if box is None:
+            raise HTTPException(404, "No face detected")
+        if not quality["passed"]:
+            raise HTTPException(422, _quality_failure(quality))
+    emb, model_version = await _encode(by, bgr, box)
     if emb is None:
         raise HTTPException(404, "No face detected")
 
-    uid, sim = search_top1(db, emb, tenant["branch_id"])
+    if scope == "org":
+        with stage("search_org"):
+            branch_ids = org_branch_ids(db, tenant["branch_id"])
+            res = await run_in_threadpool(search_org, emb, branch_ids, model_version)
+        if not res["matches"]:
+            raise HTTPException(504 if res["partial"] else 404,
+                                "Org search timed out" if res["partial"] else "No enrolled users in org")
+        best = res.pop("matches")
+        await audit_writer.asubmit(best[0]["user_id"], tenant["branch_id"], tenant["device_code"], "verify_arc_org", True,
+                                         best[0]["confidence"])
+        sharing_detector.observe(best[0]["user_id"], tenant["branch_id"], tenant["device_code"],
+                                 best[0]["confidence"] >= settings.FACE_THRESHOLD)
+        return {"matched_user_id": best[0]["user_id"], "matched_branch_id": best[0]["branch_id"],
+                "confidence": best[0]["confidence"], "branch_id": tenant["branch_id"], "candidates": best, **res}
+
+    with stage("search"):
+        uid, sim = search_top1(db, emb, tenant["branch_id"], model_version)
     if uid is None:
         raise HTTPException(404, "No enrolled users in branch")
-    # audit
-    db.execute(text("""
-      INSERT INTO auth_audit(user_id, branch_id, device_code, challenge, ok, confidence)
-      VALUES(:u,:b,:d,:c,:ok,:cf)
-    """), {"u": uid, "b": tenant["branch_id"], "d": tenant["device_code"], "c": "verify_arc", "ok": True, "cf": sim})
-    db.commit()
+    # audit (buffered; flushed in batches by the audit writer)
+    await audit_writer.asubmit(uid, tenant["branch_id"], tenant["device_code"], "verify_arc", True, sim)
+    sharing_detector.observe(uid, tenant["branch_id"], tenant["device_code"], sim >= settings.FACE_THRESHOLD)
     return {"matched_user_id": uid, "confidence": sim, "branch_id": tenant["branch_id"]}
 
+@router.post("/verify_user", dependencies=[Depends(admit_face_compute)])
+async def verify_user(
+    file: UploadFile = File(...),
+    user_id: int = Form(...),
+    tenant = Depends(tenant_context),
+    db: Session = Depends(get_db),
+):
+    """1:1 check of a probe against the claimed user's templates (badge / PIN / QR flows).
+
+    Only that user's templates in the branch are read, through the
+    (user_id, model_version) index, so the cost does not grow with the
+    branch gallery and a look-alike scoring higher cannot fail the check.
+    """
+    with stage("read_upload"):
+        by = await read_image(file)
+    bgr = box = None
+    if settings.FACE_QUALITY_VERIFY:
+        with stage("quality"):
+            bgr, box, quality = await run_in_threadpool(quality_gate.check, engine_arc, by)
+        if box is None:
+            raise HTTPException(404, "No face detected")
+        if not quality["passed"]:
+            raise HTTPException(422, _quality_failure(quality))
+    emb, model_version = await _encode(by, bgr, box)
+    if emb is None:
+        raise HTTPException(404, "No face detected")
+
+    with stage("search"):
+        sim, templates = verify_user_templates(db, emb, user_id, tenant["branch_id"], model_version)
+    if templates == 0:
+        raise HTTPException(404, "User has no enrolled face in branch")
+    verified = sim >= settings.FACE_THRESHOLD
+    await audit_writer.asubmit(user_id, tenant["branch_id"], tenant["device_code"], "verify_user", verified, sim)
+    sharing_detector.observe(user_id, tenant["branch_id"], tenant["device_code"], verified)
+    return {"user_id": user_id, "verified": verified, "confidence": sim, "templates": templates,
+            "branch_id": tenant["branch_id"]}
+
+@router.post("/identify_all", dependencies=[Depends(admit_face_compute)])
+async def identify_all(
+    file: UploadFile = File(...),
+    max_faces: int | None = Form(None),
+    tenant = Depends(tenant_context),
+    db: Session = Depends(get_db),
+):
+    """Identify every face in one frame (group photo, entrance camera).
+
+    Always uses the local engine: crops are embedded in one batch and matched
+    against the branch gallery with a single matrix product.
+    """
+    with stage("read_upload"):
+        by = await read_image(file)
+    limit = min(max_faces or settings.IDENTIFY_MAX_FACES, settings.IDENTIFY_MAX_FACES)
+    with stage("embed"):
+        faces, model_version = await run_in_threadpool(engine_arc.versioned, engine_arc.embed_faces, by, limit)
+    if faces is None:
+        raise HTTPException(400, "Invalid image")
+    if not faces:
+        raise HTTPException(404, "No face detected")
+
+    with stage("search"):
+        matches = search_batch(db, np.stack([emb for _, emb in faces]), tenant["branch_id"], model_version)
+    if matches[0][0] is None:
+        raise HTTPException(404, "No enrolled users in branch")
+
+    results = []
+    for ((x, y, w, h), _), (uid, sim) in zip(faces, matches):
+        matched = sim >= settings.FACE_THRESHOLD
+        await audit_writer.asubmit(uid, tenant["branch_id"], tenant["device_code"], "identify_all", matched, sim)
+        results.append({
+            "box": {"x": x, "y": y, "w": w, "h": h},
+            "matched_user_id": uid if matched else None,
+            "best_user_id": uid,
+            "confidence": sim,
+            "matched": matched,
+        })
+    return {"faces": results, "count": len(results), "branch_id": tenant["branch_id"]}
+
+@router.post("/verify_batch")
+async def verify_batch(
+    files: List[UploadFile] = File(...),
+    stream: bool = Form(False),
+    tenant = Depends(tenant_context),
+    db: Session = Depends(get_db),
+    slot = Depends(admit_face_compute),
+):
+    """verify_arc for a queue of images (e.g. a kiosk catching up after being offline).
+
+    Images are embedded VERIFY_BATCH_SIZE at a time on the local engine and
+    matched against the branch gallery, which is loaded once per request.
+    Results keep upload order; with stream=true they are sent as NDJSON, one
+    line per image, as each batch completes.
+    The request's audit rows are written together, in one transaction, when
+    the last image has been answered or the stream is cut short; a streamed
+    request keeps its compute slot until then.
+    """
+    if len(files) > settings.VERIFY_BATCH_MAX_IMAGES:
+        raise HTTPException(413, f"At most {settings.VERIFY_BATCH_MAX_IMAGES} images per batch")
+    model_version = engine_arc.model_version
+    with stage("load_gallery"):
+        user_ids, gallery = load_branch_gallery(db, tenant["branch_id"], engine_arc.embedding_dim, model_version)
+    if len(user_ids) == 0:
+        raise HTTPException(404, "No enrolled users in branch")
+    galleries = {model_version: (user_ids, gallery)}
+
+    def gallery_for(version: str):
+        # The engine switched models mid-request (re-embedding cutover)
+        if version not in galleries:
+            with SessionLocal() as s:
+                galleries[version] = load_branch_gallery(s, tenant["branch_id"], engine_arc.embedding_dim, version)
+        return galleries[version]
+
+    def read(f: UploadFile):
+        try:
+            return read_image_sync(f)
+        except HTTPException as exc:
+            return exc.detail
+
+    preloaded = {}
+    if stream:
+        # The form's files are closed once this handler returns, before the body streams
+        for i, f in enumerate(files):
+            try:
+                preloaded[i] = await read_image(f)
+            except HTTPException as exc:
+                preloaded[i] = exc.detail
+
+    rows = []
+
+    def results():
+        try:
+            yield from _batches()
+        finally:
+            # The answered images' audit rows in one transaction of their own, not through the shared queue
+            try:
+                write_audit_batch(rows)
+            finally:
+                slot.release()
+
+    def _batches():
+        size = max(1, settings.VERIFY_BATCH_SIZE)
+        for start in range(0, len(files), size):
+            # Without stream, uploads are read a batch at a time so only one batch is resident
+            batch = files[start:start + size]
+            images, errors = {}, {}
+            for i, f in enumerate(batch):
+                data = preloaded.pop(start + i) if stream else read(f)
+                if isinstance(data, str):
+                    errors[i] = data
+                else:
+                    images[i] = data
+            out_embs, version = engine_arc.versioned(engine_arc.embed_many, list(images.values()), size)
+            embs = dict(zip(images, out_embs))
+            found = [i for i, emb in embs.items() if emb is not None]
+            matches = dict(zip(found, match_gallery(np.stack([embs[i] for i in found]), *gallery_for(version)))) if found else {}
+            for i, f in enumerate(batch):
+                item = {"index": start + i, "filename": f.filename}
+                if i in errors:
+                    item["error"] = errors[i]
+                elif i not in matches:
+                    item["error"] = "No face detected"
+                else:
+                    uid, sim = matches[i]
+                    item.update(matched_user_id=uid, confidence=sim)
+                    # Logged as it is handed out, so a cut-off stream audits exactly what was sent
+                    rows.append(audit_row(uid, tenant["branch_id"], tenant["device_code"], "verify_batch", True, sim))
+                yield json.dumps(item) + "\n" if stream else item
+
+    if stream:
+        body = results()
+
+        def finish():
+            # Runs once the response is over, including after a client disconnect
+            try:
+                body.close()
+            except ValueError:
+                return  # still running in a worker thread; its own finally writes and releases
+            slot.release()  # a body that never started has no finally to run
+
+        slot.detach()
+        return StreamingResponse(body, media_type="application/x-ndjson",
+                                 background=BackgroundTask(run_in_threadpool, finish))
+    with stage("embed_search"):
+        items = await run_in_threadpool(lambda: list(results()))
+    return {"results": items, "count": len(items), "branch_id": tenant["branch_id"]}
+
+@router.post("/identify_video", dependencies=[Depends(admit_face_compute)])
+async def identify_video(
+    file: UploadFile = File(...),
+    tenant = Depends(tenant_context),
+    db: Session = Depends(get_db),
+):
+    """Identify the people in a short door-camera clip (anything OpenCV can decode, e.g. MJPEG/MP4).
+
+    Faces are tracked across frames and each track is embedded only when it
+    appears or its face gets noticeably better; one identity per track.
+    """
+    suffix = os.path.splitext(file.filename or "")[1] or ".mp4"
+    # VideoCapture needs a path
+    fd, path = tempfile.mkstemp(prefix="clip-", suffix=suffix)
+    try:
+        with stage("read_upload"), os.fdopen(fd, "wb") as out:
+            await copy_upload(file, out, settings.MAX_VIDEO_SIZE)
+        with stage("track"):
+            try:
+                clip, model_version = await run_in_threadpool(engine_arc.versioned, track_clip, path, engine_arc)
+            except ValueError as exc:
+                raise HTTPException(400, str(exc))
+    finally:
+        os.remove(path)
+    tracks = clip.pop("tracks")
+    if not tracks:
+        return {"tracks": [], "count": 0, "branch_id": tenant["branch_id"], **clip}
+
+    with stage("search"):
+        matches = search_batch(db, np.stack([t.embedding for t in tracks]), tenant["branch_id"], model_version)
+    if matches[0][0] is None:
+        raise HTTPException(404, "No enrolled users in branch")
+    results, rows = [], []
+    for track, (uid, sim) in zip(tracks, matches):
+        matched = sim >= settings.FACE_THRESHOLD
+        rows.append(audit_row(uid, tenant["branch_id"], tenant["device_code"], "identify_video", matched, sim))
+        results.append({**track.to_dict(), "matched_user_id": uid if matched else None,
+                        "best_user_id": uid, "confidence": sim, "matched": matched})
+    await audit_writer.asubmit_rows(rows)
+    return {"tracks": results, "count": len(results), "branch_id": tenant["branch_id"], **clip}
+
 @router.get("/images/{user_id}")
 async def get_user_images(
     user_id: int,
@@ -181,6 +500,7 @@ async def get_user_images(
     # Get images for the user
     images = db.execute(
         select(models.FaceImage).where(models.FaceImage.user_id == user_id)
+        .options(selectinload(models.FaceImage.blob))
         .order_by(models.FaceImage.created_at.desc())
     ).scalars().all()
     
@@ -193,7 +513,7 @@ async def get_user_images(
                 "id": img.id,
                 "filename": img.filename,
                 "created_at": img.created_at.isoformat(),
-                "size": len(img.image_bytes)
+                "size": stored_size(img)
             }
             for img in images
         ],
@@ -214,10 +534,11 @@ async def get_image(
     if not image:
         raise HTTPException(404, "Image not found")
     
-    # Return the image as a streaming response
+    # Return the image as a streaming response: the upload, or its archive rendition once the original is dropped
+    data, media_type = content(image)
     return StreamingResponse(
-        BytesIO(image.image_bytes),
-        media_type="image/jpeg",
+        BytesIO(data),
+        media_type=media_type,
         headers={"Content-Disposition": f"inline; filename={image.filename}"}
     )
 
@@ -251,6 +572,7 @@ async def list_all_images(
     images = db.execute(
         select(models.FaceImage, models.User)
         .join(models.User, models.FaceImage.user_id == models.User.id)
+        .options(selectinload(models.FaceImage.blob))
         .order_by(models.FaceImage.created_at.desc())
     ).all()
     
@@ -260,7 +582,7 @@ async def list_all_images(
                 "id": img.FaceImage.id,
                 "filename": img.FaceImage.filename,
                 "created_at": img.FaceImage.created_at.isoformat(),
-                "size": len(img.FaceImage.image_bytes),
+                "size": stored_size(img.FaceImage),
                 "user_id": img.User.id,
                 "user_name": img.User.full_name,
                 "user_email": img.User.email
@@ -1,19 +1,37 @@
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Form
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
 from ..database import SessionLocal
 from ..auth_api_key import require_api_key
 from ..tenant_guard import tenant_context
+from ..admission import admit_face_compute
+from ..uploads import read_image
 import cv2, numpy as np
-try:
-    import mediapipe as mp  # type: ignore
-except Exception:
-    mp = None
 from ..face_engine_arcface import engine_arc
-from ..nn import search_top1
+from ..nn import search_top1, verify_user_templates
+from ..flight_recorder import stage
+from .. import sharing_detector
+from ..audit_writer import audit_writer
 
 router = APIRouter(prefix="/live", tags=["liveness"])
-mp_face = mp.solutions.face_mesh if mp else None
+
+# mediapipe is slow to import; it is loaded on first use or by warmup()
+_mp_face = None
+_mp_loaded = False
+
+def _get_mp_face():
+    global _mp_face, _mp_loaded
+    if not _mp_loaded:
+        try:
+            import mediapipe as mp  # type: ignore
+            _mp_face = mp.solutions.face_mesh
+        except Exception:
+            _mp_face = None
+        _mp_loaded = True
+    return _mp_face
+
+def warmup() -> dict:
+    return {"mediapipe": _get_mp_face() is not None}
 
 POSE_THRESH_DEG = 12.0
 SIM_THRESH = 0.45
@@ -31,7 +49,7 @@ async def challenge():
     c = random.choice(["turn_left", "turn_right", "blink", "open_mouth"])
     return {"challenge": c, "expires_in": 15}
 
-@router.post("/verify", dependencies=[Depends(require_api_key)])
+@router.post("/verify", dependencies=[Depends(require_api_key), Depends(admit_face_compute)])
 async def verify(
     challenge: str = Form(...),
     uid_hint: int | None = Form(None),
@@ -40,17 +58,19 @@ async def verify(
     tenant = Depends(tenant_context),
     db: Session = Depends(get_db),
 ):
-    def load(b: bytes):
+    def load(b: memoryview):
         arr = np.frombuffer(b, np.uint8)
         return cv2.imdecode(arr, cv2.IMREAD_COLOR)
 
-    a = load(await frame_a.read())
-    b = load(await frame_b.read())
+    with stage("decode"):
+        a = load(await read_image(frame_a))
+        b = load(await read_image(frame_b))
     if a is None or b is None:
         raise HTTPException(400, "Bad images")
 
     # Simple liveness check without MediaPipe - just check if images are different
     # This is a basic fallback when MediaPipe is not available
+    mp_face = _get_mp_face()
     if mp_face is None:
         # Simple pixel difference check as fallback
         diff = cv2.absdiff(a, b)
@@ -58,23 +78,23 @@ async def verify(
         liveness_passed = mean_diff > 10  # Simple threshold
         print(f"[liveness] MediaPipe not available, using simple diff check. Mean diff: {mean_diff}, passed: {liveness_passed}")
     else:
-        liveness_passed = _check_liveness(a, b, challenge)
+        with stage("liveness"):
+            liveness_passed = await run_in_threadpool(_check_liveness, a, b, challenge)
 
     if not liveness_passed:
         raise HTTPException(401, "Liveness failed")
 
-    ok, uid, conf = _identify(b, db, tenant["branch_id"], uid_hint)
-    db.execute(text("""
-      INSERT INTO auth_audit(user_id, branch_id, device_code, challenge, ok, confidence)
-      VALUES(:u,:b,:d,:c,:ok,:cf)
-    """), {"u": uid or -1, "b": tenant["branch_id"], "d": tenant["device_code"], "c": challenge, "ok": ok, "cf": conf})
-    db.commit()
+    with stage("identify"):
+        ok, uid, conf = await run_in_threadpool(_identify, b, db, tenant["branch_id"], uid_hint)
+    await audit_writer.asubmit(uid or -1, tenant["branch_id"], tenant["device_code"], challenge, ok, conf)
+    sharing_detector.observe(uid, tenant["branch_id"], tenant["device_code"], ok)
 
     if not ok:
         raise HTTPException(401, "Face mismatch")
     return {"ok": True, "user_id": uid, "confidence": conf, "branch_id": tenant["branch_id"]}
 
 def _check_liveness(a, b, challenge: str) -> bool:
+    mp_face = _get_mp_face()
     if mp_face is None:
         return False
     with mp_face.FaceMesh(static_image_mode=True, max_num_faces=1, refine_landmarks=True) as fm:
@@ -109,10 +129,13 @@ def _check_liveness(a, b, challenge: str) -> bool:
 def _identify(bgr: np.ndarray, db: Session, branch_id: int, uid_hint: int | None):
     ok, buf = cv2.imencode(".jpg", bgr)
     if not ok: return (False, None, 0.0)
-    emb = engine_arc.embed(buf.tobytes())
+    emb, model_version = engine_arc.versioned(engine_arc.embed, buf.tobytes())
     if emb is None: return (False, None, 0.0)
-    uid, sim = search_top1(db, emb, branch_id)
-    if uid is None: return (False, None, 0.0)
     if uid_hint is not None:
-        return (uid == uid_hint and sim >= SIM_THRESH, uid, float(sim))
+        # 1:1 against the claimed user's templates only; a look-alike cannot outscore them
+        sim, templates = verify_user_templates(db, emb, uid_hint, branch_id, model_version)
+        if templates == 0: return (False, None, 0.0)
+        return (sim >= SIM_THRESH, uid_hint, float(sim))
+    uid, sim = search_top1(db, emb, branch_id, model_version)
+    if uid is None: return (False, None, 0.0)
     return (sim >= SIM_THRESH, uid, float(sim))
\ No newline at end of file
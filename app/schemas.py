@@ -44,4 +44,17 @@ class UserOut(BaseModel):
         return v
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+class EdgeAuditRow(BaseModel):
+    id: int  # the kiosk's row id, increasing
+    user_id: Optional[int] = None
+    device_code: Optional[str] = None
+    challenge: Optional[str] = None
+    ok: bool
+    confidence: float
+    created_at: datetime
+
+class EdgeAuditPush(BaseModel):
+    kiosk_id: str
+    branch_code: str
+    rows: list[EdgeAuditRow]
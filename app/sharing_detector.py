@@ -0,0 +1,151 @@
+"""
+Streaming account-sharing detector over successful verifications.
+
+The verification routes (verify_arc, verify_user, /live/verify) report every
+accepted identity here as they write it to auth_audit. Two patterns raise an
+alert:
+
+  * travel: the same user verified at two different branches within
+    SHARING_TRAVEL_WINDOW_S (branches are the only location a device has);
+  * device cycling: one device verifying more than
+    SHARING_DEVICE_MAX_IDENTITIES distinct users within SHARING_DEVICE_WINDOW_S.
+
+State is a few fields per user and, per device, the users it saw in the
+window ordered by last sighting (capped at the limit + 1). Both maps are
+ordered by last activity, so expiry pops from the front. Each event costs
+O(1) amortised and there are no table scans.
+SHARING_MAX_TRACKED bounds each map; the least recently active key is
+evicted first. An alert for the same user or device is suppressed for
+SHARING_ALERT_COOLDOWN_S.
+
+Like admission control, state is per worker process: with several workers,
+each sees the share of the traffic it serves.
+"""
+
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+from .core.config import settings
+
+
+class SharingDetector:
+    def __init__(self, travel_window_s: float, device_window_s: float, device_max_identities: int,
+                 cooldown_s: float, max_alerts: int, max_tracked: int):
+        self.travel_window = travel_window_s
+        self.device_window = device_window_s
+        self.device_max = max(1, device_max_identities)
+        self.cooldown = cooldown_s
+        self.max_tracked = max(1, max_tracked)
+        self._lock = threading.Lock()
+        # user_id -> (monotonic ts, branch_id, device_code), least recently verified first
+        self._users: OrderedDict = OrderedDict()
+        # device_code -> OrderedDict(user_id -> monotonic ts), least recently active device first
+        self._devices: OrderedDict = OrderedDict()
+        self._last_alert: OrderedDict = OrderedDict()  # (kind, key) -> monotonic ts
+        self._alerts: deque = deque(maxlen=max(1, max_alerts))
+        self._ids = itertools.count(1)
+        self.events = 0
+        self.alerts_raised = {"travel": 0, "device_cycling": 0}
+        self.suppressed = 0
+
+    def observe(self, user_id, branch_id, device_code, ok: bool = True, now: Optional[float] = None) -> None:
+        """Feed one verification; only accepted identities are tracked."""
+        if not ok or user_id is None or user_id < 0:
+            return
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.events += 1
+            self._check_travel(user_id, branch_id, device_code, now)
+            if device_code:
+                self._check_device(device_code, user_id, branch_id, now)
+
+    def _check_travel(self, user_id, branch_id, device_code, now: float) -> None:
+        users = self._users
+        while users:
+            ts = next(iter(users.values()))[0]
+            if now - ts <= self.travel_window:
+                break
+            users.popitem(last=False)
+        prev = users.pop(user_id, None)
+        users[user_id] = (now, branch_id, device_code)
+        if len(users) > self.max_tracked:
+            users.popitem(last=False)
+        if (prev is not None and now - prev[0] <= self.travel_window
+                and prev[1] != branch_id and branch_id is not None and prev[1] is not None):
+            self._raise("travel", user_id, now, user_id=user_id,
+                        branches=[prev[1], branch_id], devices=[prev[2], device_code],
+                        seconds_apart=round(now - prev[0], 1))
+
+    def _check_device(self, device_code: str, user_id, branch_id, now: float) -> None:
+        seen = self._devices.pop(device_code, None)
+        if seen is None:
+            seen = OrderedDict()
+        self._devices[device_code] = seen
+        if len(self._devices) > self.max_tracked:
+            self._devices.popitem(last=False)
+        # Retire the least recently active device if it has gone idle: one check per event
+        first = next(iter(self._devices))
+        idle = self._devices[first]
+        if idle is not seen and (not idle or now - next(reversed(idle.values())) > self.device_window):
+            del self._devices[first]
+        while seen:
+            ts = next(iter(seen.values()))
+            if now - ts <= self.device_window:
+                break
+            seen.popitem(last=False)
+        seen.pop(user_id, None)
+        seen[user_id] = now
+        if len(seen) > self.device_max:
+            self._raise("device_cycling", device_code, now, device_code=device_code, branch_id=branch_id,
+                        identities=len(seen), window_s=self.device_window, user_ids=list(seen))
+            while len(seen) > self.device_max + 1:
+                seen.popitem(last=False)
+
+    def _raise(self, kind: str, key, now: float, **detail) -> None:
+        last = self._last_alert.pop((kind, key), None)
+        if last is not None and now - last < self.cooldown:
+            self._last_alert[(kind, key)] = last
+            self.suppressed += 1
+            return
+        self._last_alert[(kind, key)] = now
+        while len(self._last_alert) > self.max_tracked:
+            self._last_alert.popitem(last=False)
+        self.alerts_raised[kind] += 1
+        self._alerts.append({"id": next(self._ids), "kind": kind, "at": time.time(), **detail})
+        print(f"[sharing] {kind}: {detail}")
+
+    def alerts(self, since_id: int = 0, limit: int = 100) -> list[dict]:
+        with self._lock:
+            return [a for a in self._alerts if a["id"] > since_id][-limit:]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._alerts.clear()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": settings.SHARING_DETECTOR_ENABLED,
+            "events": self.events,
+            "alerts": dict(self.alerts_raised),
+            "suppressed": self.suppressed,
+            "tracked_users": len(self._users),
+            "tracked_devices": len(self._devices),
+        }
+
+
+detector = SharingDetector(
+    settings.SHARING_TRAVEL_WINDOW_S,
+    settings.SHARING_DEVICE_WINDOW_S,
+    settings.SHARING_DEVICE_MAX_IDENTITIES,
+    settings.SHARING_ALERT_COOLDOWN_S,
+    settings.SHARING_ALERTS_MAX,
+    settings.SHARING_MAX_TRACKED,
+)
+
+
+def observe(user_id, branch_id, device_code, ok: bool = True) -> None:
+    if settings.SHARING_DETECTOR_ENABLED:
+        detector.observe(user_id, branch_id, device_code, ok)
@@ -19,17 +19,20 @@ async def tenant_context(
 ):
     if not x_org_id or not x_branch_code:
         raise HTTPException(400, "Missing X-Org-Id or X-Branch-Code")
-    db: Session = next(_db())
-    br = db.execute(select(models.Branch).where(models.Branch.code == x_branch_code)).scalar_one_or_none()
-    if not br:
-        raise HTTPException(404, "Branch not found")
-    if x_device_code:
-        dev = db.execute(
-            select(models.Device).where(
-                models.Device.device_code == x_device_code,
-                models.Device.branch_id == br.id
-            )
-        ).scalar_one_or_none()
-        if not dev or not bool(dev.active):
-            raise HTTPException(401, "Unregistered or inactive device")
-    return {"org_id": x_org_id, "branch_id": br.id, "device_code": x_device_code}
\ No newline at end of file
+    # Closed on the way out: a session left to the garbage collector holds its pooled connection
+    with SessionLocal() as db:
+        br = db.execute(select(models.Branch).where(models.Branch.code == x_branch_code)).scalar_one_or_none()
+        if not br:
+            raise HTTPException(404, "Branch not found")
+        if x_org_id != br.org_id:
+            raise HTTPException(403, "Branch does not belong to org")
+        if x_device_code:
+            dev = db.execute(
+                select(models.Device).where(
+                    models.Device.device_code == x_device_code,
+                    models.Device.branch_id == br.id
+                )
+            ).scalar_one_or_none()
+            if not dev or not bool(dev.active):
+                raise HTTPException(401, "Unregistered or inactive device")
+        return {"org_id": br.org_id, "branch_id": br.id, "branch_code": br.code, "device_code": x_device_code}
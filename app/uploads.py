@@ -0,0 +1,151 @@
+"""
+Size-capped upload handling for the image endpoints.
+
+read_image() pulls an UploadFile in UPLOAD_CHUNK_SIZE pieces: the first chunk
+is sniffed for a known image signature (the client's filename and
+content-type are not trusted) and reading stops as soon as MAX_FILE_SIZE is
+passed, so an oversized or non-image part never becomes one big bytes
+object. The result is a memoryview over the buffer, which np.frombuffer /
+cv2.imdecode and the database driver take without copying.
+
+UploadLimitMiddleware caps the whole request body (MAX_REQUEST_SIZE) while it
+is still being received, before Starlette spools the multipart form.
+"""
+
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile
+
+from .core.config import settings
+
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+# (signature prefix, offset, kind); kinds are matched against ALLOWED_EXTENSIONS
+_SIGNATURES = (
+    (b"\xff\xd8\xff", 0, "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", 0, "png"),
+    (b"RIFF", 0, "webp"),  # confirmed by "WEBP" at offset 8 below
+    (b"BM", 0, "bmp"),
+)
+_EXTENSIONS = {"jpeg": {"jpg", "jpeg"}, "png": {"png"}, "webp": {"webp"}, "bmp": {"bmp"}}
+
+
+def sniff_image(head: bytes) -> Optional[str]:
+    """Image kind from the first bytes of a file, or None."""
+    for sig, offset, kind in _SIGNATURES:
+        if head[offset:offset + len(sig)] == sig:
+            if kind == "webp" and head[8:12] != b"WEBP":
+                continue
+            return kind
+    return None
+
+
+class _ImageBuffer:
+    def __init__(self, max_bytes: int, allowed: list[str]):
+        self.max_bytes = max_bytes
+        self.allowed = allowed
+        self.buf = bytearray()
+
+    def check_declared_size(self, size: Optional[int]) -> None:
+        if size is not None and size > self.max_bytes:
+            raise HTTPException(413, f"File larger than {self.max_bytes} bytes")
+
+    def feed(self, chunk: bytes) -> None:
+        if not self.buf:
+            kind = sniff_image(chunk[:16])
+            if kind is None or not (_EXTENSIONS[kind] & set(self.allowed)):
+                raise HTTPException(415, f"Unsupported image type; allowed: {', '.join(self.allowed)}")
+        if len(self.buf) + len(chunk) > self.max_bytes:
+            raise HTTPException(413, f"File larger than {self.max_bytes} bytes")
+        self.buf += chunk
+
+    def result(self) -> memoryview:
+        if not self.buf:
+            raise HTTPException(400, "Empty file")
+        return memoryview(self.buf)
+
+
+async def read_image(file: UploadFile, max_bytes: Optional[int] = None) -> memoryview:
+    """Read an image upload in chunks; 413 past the size cap, 415 if it is not an allowed image type."""
+    r = _ImageBuffer(max_bytes or settings.MAX_FILE_SIZE, settings.allowed_extensions_list)
+    r.check_declared_size(file.size)
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        r.feed(chunk)
+    return r.result()
+
+
+def read_image_sync(file: UploadFile, max_bytes: Optional[int] = None) -> memoryview:
+    """read_image() for code already running in a worker thread."""
+    r = _ImageBuffer(max_bytes or settings.MAX_FILE_SIZE, settings.allowed_extensions_list)
+    r.check_declared_size(file.size)
+    while chunk := file.file.read(UPLOAD_CHUNK_SIZE):
+        r.feed(chunk)
+    return r.result()
+
+
+async def copy_upload(file: UploadFile, out, max_bytes: int) -> int:
+    """Stream an upload into the binary file object out; 413 past max_bytes."""
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(413, f"File larger than {max_bytes} bytes")
+    total = 0
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        total += len(chunk)
+        if total > max_bytes:
+            raise HTTPException(413, f"File larger than {max_bytes} bytes")
+        out.write(chunk)
+    return total
+
+
+class UploadLimitMiddleware:
+    """Reject request bodies over max_bytes with 413, by Content-Length or while streaming."""
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            return await self.app(scope, receive, send)
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    too_big = int(value) > self.max_bytes
+                except ValueError:
+                    too_big = False
+                if too_big:
+                    return await self._reject(send)
+                break
+
+        received = 0
+        started = False
+
+        async def send_wrapper(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        async def receive_wrapper():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Surfaces through the body parser / exception handlers as a normal 413
+                    raise HTTPException(413, "Request body too large")
+            return message
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        except HTTPException as exc:
+            if exc.status_code != 413 or started:
+                raise
+            await self._reject(send)
+
+    async def _reject(self, send) -> None:
+        body = b'{"detail":"Request body too large"}'
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode()),
+                                (b"connection", b"close")]})
+        await send({"type": "http.response.body", "body": body})
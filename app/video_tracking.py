@@ -0,0 +1,164 @@
+"""
+Face tracking for short video clips.
+
+Frames are decoded one at a time and every VIDEO_FRAME_STRIDE-th frame is run
+through the Haar detector. Boxes are linked to tracks by IoU with the track's
+last box; ArcFace only runs for a track when it is new or when its face is
+clearly better (bigger and sharper) than the crop it was last embedded from.
+Each track keeps the embedding of its best crop, so a clip costs one
+inference per person plus a few refinements instead of one per frame.
+"""
+
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from .core.config import settings
+from .quality_gate import laplacian_variance
+
+
+def iou(a: tuple, b: tuple) -> float:
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+def face_quality(bgr: np.ndarray, box: tuple) -> float:
+    """Box area weighted by sharpness (variance of the Laplacian, saturating at 100)."""
+    x, y, w, h = box
+    gray = cv2.cvtColor(bgr[y:y + h, x:x + w], cv2.COLOR_BGR2GRAY)
+    return w * h * min(1.0, laplacian_variance(gray) / 100.0)
+
+
+class _Track:
+    __slots__ = ("track_id", "box", "first_frame", "last_frame", "hits", "missed",
+                 "best_box", "best_quality", "embedding", "embeddings")
+
+    def __init__(self, track_id: int, box: tuple, frame: int):
+        self.track_id = track_id
+        self.box = box
+        self.first_frame = frame
+        self.last_frame = frame
+        self.hits = 1
+        self.missed = 0
+        self.best_box = box
+        self.best_quality = 0.0
+        self.embedding: Optional[np.ndarray] = None
+        self.embeddings = 0
+
+    def to_dict(self) -> dict:
+        x, y, w, h = self.best_box
+        return {
+            "track_id": self.track_id,
+            "first_frame": self.first_frame,
+            "last_frame": self.last_frame,
+            "frames_seen": self.hits,
+            "box": {"x": x, "y": y, "w": w, "h": h},
+            "embeddings_computed": self.embeddings,
+        }
+
+
+class FaceTracker:
+    """Greedy IoU tracker; tracks not seen for max_missed processed frames are closed."""
+
+    def __init__(self, iou_threshold: float = 0.3, max_missed: int = 5, quality_gain: float = 1.3):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.quality_gain = quality_gain
+        self.active: list[_Track] = []
+        self.closed: list[_Track] = []
+        self._next_id = 1
+
+    def update(self, boxes: list[tuple], frame: int) -> list[tuple[_Track, tuple]]:
+        """Assign this frame's boxes to tracks; returns (track, box) for every matched or new track."""
+        pairs = sorted(
+            ((iou(t.box, b), ti, bi) for ti, t in enumerate(self.active) for bi, b in enumerate(boxes)),
+            reverse=True,
+        )
+        used_t, used_b, seen = set(), set(), []
+        for score, ti, bi in pairs:
+            if score < self.iou_threshold:
+                break
+            if ti in used_t or bi in used_b:
+                continue
+            used_t.add(ti)
+            used_b.add(bi)
+            t = self.active[ti]
+            t.box, t.last_frame, t.missed = boxes[bi], frame, 0
+            t.hits += 1
+            seen.append((t, boxes[bi]))
+
+        still_active = []
+        for ti, t in enumerate(self.active):
+            if ti not in used_t:
+                t.missed += 1
+            (self.closed if t.missed > self.max_missed else still_active).append(t)
+        self.active = still_active
+
+        for bi, b in enumerate(boxes):
+            if bi not in used_b:
+                t = _Track(self._next_id, b, frame)
+                self._next_id += 1
+                self.active.append(t)
+                seen.append((t, b))
+        return seen
+
+    def needs_embedding(self, track: _Track, quality: float) -> bool:
+        return track.embedding is None or quality > track.best_quality * self.quality_gain
+
+    def tracks(self) -> list[_Track]:
+        return sorted(self.closed + self.active, key=lambda t: t.track_id)
+
+
+def track_clip(path: str, engine, max_frames: Optional[int] = None) -> dict:
+    """Decode the clip at path, track faces and embed each track's best crop.
+
+    Returns {"tracks": [_Track, ...], "frames_decoded", "frames_processed",
+    "inferences", "fps"}; tracks shorter than VIDEO_MIN_TRACK_HITS are dropped.
+    """
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError("Could not decode video")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+    if max_frames is None:
+        max_frames = int((fps or 25.0) * settings.VIDEO_MAX_SECONDS)
+    stride = max(1, settings.VIDEO_FRAME_STRIDE)
+    tracker = FaceTracker(settings.VIDEO_TRACK_IOU, settings.VIDEO_TRACK_MAX_MISSED,
+                          settings.VIDEO_REEMBED_QUALITY_GAIN)
+    decoded = processed = inferences = 0
+    try:
+        while decoded < max_frames:
+            # grab() skips the colour conversion for frames we do not look at
+            if not cap.grab():
+                break
+            frame = decoded
+            decoded += 1
+            if frame % stride:
+                continue
+            ok, bgr = cap.retrieve()
+            if not ok:
+                break
+            processed += 1
+            todo = []
+            for track, box in tracker.update(engine._detect_faces(bgr), frame):
+                quality = face_quality(bgr, box)
+                if tracker.needs_embedding(track, quality):
+                    todo.append((track, box, quality))
+            if todo:
+                # All re-embeds of this frame in one batch
+                embs = engine.embed_crops(bgr, [box for _, box, _ in todo])
+                inferences += len(todo)
+                for (track, box, quality), emb in zip(todo, embs):
+                    track.embedding, track.best_box, track.best_quality = emb, box, quality
+                    track.embeddings += 1
+    finally:
+        cap.release()
+    tracks = [t for t in tracker.tracks()
+              if t.embedding is not None and t.hits >= settings.VIDEO_MIN_TRACK_HITS]
+    return {"tracks": tracks, "frames_decoded": decoded, "frames_processed": processed,
+            "inferences": inferences, "fps": fps}
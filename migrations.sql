@@ -48,14 +48,263 @@ CREATE INDEX IF NOT EXISTS idx_face_embeddings_ann
   ON face_embeddings USING ivfflat (embedding vector_cosine_ops) WITH (lists = 100);
 CREATE INDEX IF NOT EXISTS idx_embeddings_branch ON face_embeddings(branch_id);
 
--- Audit to detect sharing
-CREATE TABLE IF NOT EXISTS auth_audit (
+-- Embedding model versions (app/embedding_versions.py, scripts/reembed.py).
+-- Each embedding records the model that produced it; searches only compare
+-- vectors of one version. Exactly one version is 'active'; a re-embedding
+-- job builds a new one next to it and flips the status in one transaction.
+CREATE TABLE IF NOT EXISTS embedding_versions (
+  version VARCHAR(64) PRIMARY KEY,
+  model_path VARCHAR(512),  -- NULL: ARCFACE_MODEL_PATH / ARCFACE_PRECISION from settings
+  status VARCHAR(16) NOT NULL DEFAULT 'building',  -- building | active | retired
+  images_total INT NOT NULL DEFAULT 0,
+  images_done INT NOT NULL DEFAULT 0,
+  checkpoint_image_id INT NOT NULL DEFAULT 0,  -- face_images.id the job has embedded up to
+  created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+  activated_at TIMESTAMP
+);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_embedding_versions_active ON embedding_versions(status) WHERE status = 'active';
+INSERT INTO embedding_versions(version, status, activated_at)
+SELECT 'legacy', 'active', NOW() WHERE NOT EXISTS (SELECT 1 FROM embedding_versions);
+
+ALTER TABLE face_embeddings ADD COLUMN IF NOT EXISTS model_version VARCHAR(64) NOT NULL DEFAULT 'legacy';
+ALTER TABLE face_embeddings ADD COLUMN IF NOT EXISTS face_image_id INT REFERENCES face_images(id) ON DELETE SET NULL;
+CREATE INDEX IF NOT EXISTS idx_embeddings_branch_version ON face_embeddings(branch_id, model_version);
+CREATE INDEX IF NOT EXISTS idx_embeddings_user_version ON face_embeddings(user_id, model_version);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_embeddings_image_version
+  ON face_embeddings(face_image_id, model_version) WHERE face_image_id IS NOT NULL;
+
+-- Change log feeding the memory-mapped gallery index (app/gallery_index.py).
+-- Every insert/update/delete on face_embeddings is recorded here and announced
+-- with NOTIFY; the index writer re-reads just the touched rows.
+CREATE TABLE IF NOT EXISTS face_embedding_changes (
+  id BIGSERIAL PRIMARY KEY,
+  branch_id INT,
+  embedding_id INT NOT NULL,
+  op CHAR(1) NOT NULL,  -- I = present after the change, D = removed
+  created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+-- Writing transaction: ids are handed out before commit, so they do not commit
+-- in order; readers re-read changes of transactions still open at their last read
+ALTER TABLE face_embedding_changes ADD COLUMN IF NOT EXISTS xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+CREATE INDEX IF NOT EXISTS idx_face_embedding_changes_xid ON face_embedding_changes(xid);
+
+CREATE OR REPLACE FUNCTION face_embeddings_log_change() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    INSERT INTO face_embedding_changes(branch_id, embedding_id, op) VALUES (OLD.branch_id, OLD.id, 'D');
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    INSERT INTO face_embedding_changes(branch_id, embedding_id, op) VALUES (NEW.branch_id, NEW.id, 'I');
+    PERFORM pg_notify('face_embeddings_changed', COALESCE(NEW.branch_id, 0)::text);
+  ELSE
+    PERFORM pg_notify('face_embeddings_changed', COALESCE(OLD.branch_id, 0)::text);
+  END IF;
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_face_embeddings_changes ON face_embeddings;
+CREATE TRIGGER trg_face_embeddings_changes
+  AFTER INSERT OR UPDATE OR DELETE ON face_embeddings
+  FOR EACH ROW EXECUTE FUNCTION face_embeddings_log_change();
+
+-- Duplicate-identity scan (app/duplicate_scan.py): user pairs whose faces match
+-- across accounts, and per scope / model version the highest embedding id
+-- already scanned, so nightly runs only compare embeddings enrolled since.
+CREATE TABLE IF NOT EXISTS duplicate_scan_state (
+  scope VARCHAR(160) NOT NULL,
+  model_version VARCHAR(32) NOT NULL,
+  last_embedding_id INT NOT NULL DEFAULT 0,
+  last_run_at TIMESTAMP,
+  PRIMARY KEY (scope, model_version)
+);
+-- xmin of the last run's snapshot: embeddings below last_embedding_id that commit
+-- later are found through face_embedding_changes.xid
+ALTER TABLE duplicate_scan_state ADD COLUMN IF NOT EXISTS last_xmin BIGINT;
+
+CREATE TABLE IF NOT EXISTS duplicate_identity_pairs (
+  id BIGSERIAL PRIMARY KEY,
+  model_version VARCHAR(32) NOT NULL,
+  user_a INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  user_b INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  similarity REAL NOT NULL,
+  embedding_a INT,
+  embedding_b INT,
+  branch_a INT,
+  branch_b INT,
+  first_seen_at TIMESTAMP NOT NULL DEFAULT NOW(),
+  last_seen_at TIMESTAMP NOT NULL DEFAULT NOW(),
+  CHECK (user_a < user_b),
+  UNIQUE (model_version, user_a, user_b)
+);
+CREATE INDEX IF NOT EXISTS idx_duplicate_pairs_similarity ON duplicate_identity_pairs(model_version, similarity DESC);
+
+-- Content-addressed image storage (app/image_store.py): one row per distinct
+-- upload, with a face-centred archive rendition written in the background.
+-- original is NULL once dropped; face_images.image_bytes only holds rows
+-- written before this table existed, until the transcoder moves them here.
+CREATE TABLE IF NOT EXISTS image_blobs (
+  sha256 BYTEA PRIMARY KEY,
+  original BYTEA,
+  original_size INT NOT NULL,
+  original_dropped_at TIMESTAMP,
+  archive BYTEA,
+  archive_format VARCHAR(8),
+  archive_size INT,
+  face_box INT[],
+  created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+  transcoded_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_image_blobs_pending ON image_blobs(created_at) WHERE archive IS NULL;
+
+ALTER TABLE face_images ADD COLUMN IF NOT EXISTS content_sha256 BYTEA REFERENCES image_blobs(sha256);
+ALTER TABLE face_images ALTER COLUMN image_bytes DROP NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_face_images_content ON face_images(content_sha256);
+CREATE INDEX IF NOT EXISTS idx_face_images_inline ON face_images(id) WHERE content_sha256 IS NULL;
+
+-- Asynchronous enrollment jobs (app/enrollment_jobs.py): frames are kept as
+-- image_blobs until the job runs; idempotency_key makes resubmission return
+-- the existing job, lease_token makes a job's writes happen once.
+CREATE TABLE IF NOT EXISTS enrollment_jobs (
   id BIGSERIAL PRIMARY KEY,
+  idempotency_key VARCHAR(128) NOT NULL UNIQUE,
+  user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  branch_id INT REFERENCES branches(id),
+  requested_by INT,
+  status VARCHAR(16) NOT NULL DEFAULT 'queued',
+  total_frames INT NOT NULL,
+  processed_frames INT NOT NULL DEFAULT 0,
+  attempts INT NOT NULL DEFAULT 0,
+  lease_token VARCHAR(32),
+  heartbeat_at TIMESTAMP,
+  result JSONB,
+  error TEXT,
+  created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+  started_at TIMESTAMP,
+  finished_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_enrollment_jobs_runnable ON enrollment_jobs(id) WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS idx_enrollment_jobs_finished ON enrollment_jobs(finished_at) WHERE status IN ('done', 'failed');
+
+CREATE TABLE IF NOT EXISTS enrollment_job_frames (
+  job_id BIGINT NOT NULL REFERENCES enrollment_jobs(id) ON DELETE CASCADE,
+  idx INT NOT NULL,
+  filename VARCHAR(255),
+  content_sha256 BYTEA NOT NULL REFERENCES image_blobs(sha256),
+  status VARCHAR(16) NOT NULL DEFAULT 'pending',
+  image_id INT,
+  detail JSONB,
+  PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS idx_enrollment_job_frames_content ON enrollment_job_frames(content_sha256);
+
+-- Edge kiosks (app/edge.py) push buffered audit rows; the highest kiosk row id
+-- accepted per kiosk makes a retried push a no-op.
+CREATE TABLE IF NOT EXISTS edge_audit_watermarks (
+  kiosk_id VARCHAR(160) PRIMARY KEY,
+  last_row_id BIGINT NOT NULL DEFAULT 0,
+  pushed_at TIMESTAMP
+);
+
+-- Audit to detect sharing: range-partitioned by month on created_at.
+-- created_at (and auth_audit_hourly.bucket) hold naive UTC, whatever the session TimeZone;
+-- the audit writer normalizes before writing and the SQL below takes NOW() in UTC.
+-- Partitions are created ahead and dropped past retention by app/audit_partitions.py;
+-- auth_audit_default catches anything that arrives before its month exists.
+DO $$
+BEGIN
+  IF EXISTS (SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+             WHERE c.relname = 'auth_audit' AND n.nspname = current_schema() AND c.relkind = 'r') THEN
+    ALTER TABLE auth_audit RENAME TO auth_audit_legacy;
+    ALTER TABLE auth_audit_legacy RENAME CONSTRAINT auth_audit_pkey TO auth_audit_legacy_pkey;
+    ALTER SEQUENCE IF EXISTS auth_audit_id_seq RENAME TO auth_audit_legacy_id_seq;
+  END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS auth_audit (
+  id BIGSERIAL,
   user_id INT,
   branch_id INT,
   device_code VARCHAR(128),
   challenge VARCHAR(32),
   ok BOOLEAN,
   confidence REAL,
-  created_at TIMESTAMP DEFAULT NOW()
-);
\ No newline at end of file
+  created_at TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC'),
+  PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+ALTER TABLE auth_audit ALTER COLUMN created_at SET DEFAULT (NOW() AT TIME ZONE 'UTC');
+
+CREATE TABLE IF NOT EXISTS auth_audit_default PARTITION OF auth_audit DEFAULT;
+CREATE INDEX IF NOT EXISTS idx_auth_audit_branch_time ON auth_audit(branch_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_auth_audit_user_time ON auth_audit(user_id, created_at);
+
+-- Create the monthly partition holding month_start, moving any rows that
+-- already landed in the default partition for that range.
+CREATE OR REPLACE FUNCTION auth_audit_ensure_partition(month_start DATE) RETURNS TEXT AS $$
+DECLARE
+  s DATE := date_trunc('month', month_start)::date;
+  e DATE := (date_trunc('month', month_start) + INTERVAL '1 month')::date;
+  part TEXT := format('auth_audit_y%sm%s', to_char(s, 'YYYY'), to_char(s, 'MM'));
+BEGIN
+  IF to_regclass(part) IS NOT NULL THEN
+    RETURN part;
+  END IF;
+  EXECUTE format('CREATE TABLE %I (LIKE auth_audit INCLUDING DEFAULTS)', part);
+  EXECUTE format('WITH moved AS (DELETE FROM auth_audit_default WHERE created_at >= %L AND created_at < %L RETURNING *)
+                  INSERT INTO %I SELECT * FROM moved', s, e, part);
+  EXECUTE format('ALTER TABLE auth_audit ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', part, s, e);
+  RETURN part;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT auth_audit_ensure_partition((date_trunc('month', NOW() AT TIME ZONE 'UTC') + make_interval(months => m))::date)
+FROM generate_series(0, 1) AS m;
+
+-- Hourly rollups per branch/device, maintained incrementally by the audit writer.
+-- confidence_hist counts confidences in ten 0.1-wide buckets.
+CREATE TABLE IF NOT EXISTS auth_audit_hourly (
+  branch_id INT NOT NULL,
+  device_code VARCHAR(128) NOT NULL DEFAULT '',
+  bucket TIMESTAMP NOT NULL,
+  attempts BIGINT NOT NULL DEFAULT 0,
+  successes BIGINT NOT NULL DEFAULT 0,
+  confidence_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+  confidence_hist BIGINT[] NOT NULL DEFAULT array_fill(0::bigint, ARRAY[10]),
+  PRIMARY KEY (branch_id, device_code, bucket)
+);
+CREATE INDEX IF NOT EXISTS idx_auth_audit_hourly_bucket ON auth_audit_hourly(bucket);
+
+-- One-time move of a pre-partitioning auth_audit into the partitioned table.
+-- Its created_at came from NOW() in the session time zone; it is converted to UTC on the way.
+DO $$
+DECLARE
+  m DATE;
+BEGIN
+  IF to_regclass('auth_audit_legacy') IS NOT NULL THEN
+    CREATE TEMP TABLE auth_audit_legacy_utc ON COMMIT DROP AS
+      SELECT id, user_id, branch_id, device_code, challenge, ok, confidence,
+             COALESCE(created_at AT TIME ZONE current_setting('TimeZone') AT TIME ZONE 'UTC',
+                      NOW() AT TIME ZONE 'UTC') AS created_at,
+             created_at IS NOT NULL AS dated
+      FROM auth_audit_legacy;
+    FOR m IN SELECT DISTINCT date_trunc('month', created_at)::date FROM auth_audit_legacy_utc LOOP
+      PERFORM auth_audit_ensure_partition(m);
+    END LOOP;
+    INSERT INTO auth_audit(id, user_id, branch_id, device_code, challenge, ok, confidence, created_at)
+    SELECT id, user_id, branch_id, device_code, challenge, ok, confidence, created_at
+    FROM auth_audit_legacy_utc;
+    INSERT INTO auth_audit_hourly AS h (branch_id, device_code, bucket, attempts, successes, confidence_sum, confidence_hist)
+    SELECT COALESCE(branch_id, -1), COALESCE(device_code, ''), date_trunc('hour', created_at),
+           count(*), count(*) FILTER (WHERE ok), COALESCE(sum(confidence), 0),
+           ARRAY[count(*) FILTER (WHERE bk = 0), count(*) FILTER (WHERE bk = 1),
+                 count(*) FILTER (WHERE bk = 2), count(*) FILTER (WHERE bk = 3),
+                 count(*) FILTER (WHERE bk = 4), count(*) FILTER (WHERE bk = 5),
+                 count(*) FILTER (WHERE bk = 6), count(*) FILTER (WHERE bk = 7),
+                 count(*) FILTER (WHERE bk = 8), count(*) FILTER (WHERE bk = 9)]
+    FROM (SELECT *, LEAST(GREATEST(floor(COALESCE(confidence, 0) * 10)::int, 0), 9) AS bk
+          FROM auth_audit_legacy_utc WHERE dated) a
+    GROUP BY 1, 2, 3
+    ON CONFLICT (branch_id, device_code, bucket) DO NOTHING;
+    PERFORM setval(pg_get_serial_sequence('auth_audit', 'id'), GREATEST((SELECT max(id) FROM auth_audit), 1));
+    DROP TABLE auth_audit_legacy;
+  END IF;
+END $$;
@@ -0,0 +1,14 @@
+"""Create upcoming auth_audit partitions and drop expired ones (run daily from cron)."""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.audit_partitions import maintain  # noqa: E402
+
+
+if __name__ == "__main__":
+    result = maintain()
+    print(f"Partitions ensured: {', '.join(result['partitions'])}")
+    print(f"Partitions dropped: {', '.join(result['dropped']) or 'none'}")
+    print(f"Rollup rows pruned: {result['rollup_rows_pruned']}")
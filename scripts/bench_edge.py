@@ -0,0 +1,107 @@
+"""
+Edge-mode latency check: a synthetic branch gallery in a temporary SQLite file.
+
+    python scripts/bench_edge.py [--gallery 20000] [--runs 200] [--image face.jpg] [--max-search-ms 10]
+
+Reports p50/p95 of the in-memory index search (1:N and 1:1), and of a full
+/face/verify_arc request through app.edge_app, which includes decoding and
+embedding. Without --image the request uses a synthetic frame, with
+detection stubbed to a fixed box. Exits 1 if the 1:N search p95 is above
+--max-search-ms. No database or server is needed.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.core.config import settings  # noqa: E402
+
+
+def _pcts(ms: list[float]) -> str:
+    ms = sorted(ms)
+    return f"p50 {statistics.median(ms):.2f} ms, p95 {ms[int(0.95 * (len(ms) - 1))]:.2f} ms"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gallery", type=int, default=20000, help="templates in the synthetic branch")
+    parser.add_argument("--per-user", type=int, default=3)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--image", help="face photo; default: synthetic frame with stubbed detection")
+    parser.add_argument("--max-search-ms", type=float, default=10.0)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    settings.EDGE_DB_PATH = path
+    settings.WARMUP_ON_STARTUP = False
+    from fastapi.testclient import TestClient
+
+    from app import edge
+    from app.edge_app import app
+    from app.face_engine_arcface import engine_arc
+
+    try:
+        rng = np.random.default_rng(0)
+        vecs = rng.standard_normal((args.gallery, 512)).astype(np.float32)
+        users = np.arange(args.gallery) // args.per_user + 1
+        store = edge.EdgeStore(path)
+        engine_arc.load()
+        store.replace_gallery(np.arange(1, args.gallery + 1), users, vecs, {}, engine_arc.model_version,
+                              {"id": 1, "code": "bench", "org_id": "default"})
+        idx = edge.index()
+        probes = vecs[rng.integers(0, args.gallery, args.runs)] + 0.3 * rng.standard_normal((args.runs, 512))
+
+        search, one = [], []
+        for p in probes:
+            t0 = time.perf_counter()
+            idx.refresh()
+            idx.search(p)
+            search.append((time.perf_counter() - t0) * 1000)
+            t0 = time.perf_counter()
+            idx.verify(p, 1)
+            one.append((time.perf_counter() - t0) * 1000)
+        print(f"1:N search over {args.gallery} templates: {_pcts(search)}")
+        print(f"1:1 verify: {_pcts(one)}")
+
+        if args.image:
+            by = Path(args.image).read_bytes()
+        else:
+            frame = (rng.random((480, 640, 3)) * 255).astype(np.uint8)
+            engine_arc._detect_faces = lambda bgr: [(160, 120, 320, 240)]
+            settings.FACE_QUALITY_VERIFY = False
+            by = cv2.imencode(".jpg", frame)[1].tobytes()
+        client = TestClient(app)
+        headers = {"X-Org-Id": "default", "X-Branch-Code": "bench"}
+        client.post("/face/verify_arc", files={"file": ("p.jpg", by, "image/jpeg")}, headers=headers)
+        req = []
+        for _ in range(min(args.runs, 50)):
+            t0 = time.perf_counter()
+            r = client.post("/face/verify_arc", files={"file": ("p.jpg", by, "image/jpeg")}, headers=headers)
+            req.append((time.perf_counter() - t0) * 1000)
+            if r.status_code != 200:
+                print(f"verify_arc returned {r.status_code}: {r.text}")
+                return 1
+        print(f"/face/verify_arc end to end (decode + embed + search + audit): {_pcts(req)}")
+        store.close()
+        idx.store.close()
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    if sorted(search)[int(0.95 * (len(search) - 1))] > args.max_search_ms:
+        print(f"1:N search p95 above {args.max_search_ms} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Enrollment write-path benchmark and commit-count check.
+
+    python scripts/bench_enrollment.py --user-id 1 --branch main-branch [--image face.jpg]
+        [--frames 10] [--runs 20] [--max-commits 1]
+
+Posts --frames frames to /face/enroll_live --runs times through the ASGI app
+and reports latency percentiles with the number of COMMITs and SQL statements
+per request. Exits 1 if a request committed more than --max-commits times,
+so it can gate changes that reintroduce per-frame commits. The rows it
+creates are deleted afterwards.
+
+Without --image a synthetic frame is used, with face detection stubbed to a
+fixed box and the quality gate off: only the write path is measured then.
+Enrollment dedup is switched off so every frame is stored.
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import event, text  # noqa: E402
+
+from app.auth import create_token  # noqa: E402
+from app.core.config import settings  # noqa: E402
+from app.database import engine  # noqa: E402
+from app.face_engine_arcface import engine_arc  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", type=int, required=True, help="existing user to enroll frames for")
+    parser.add_argument("--branch", required=True, help="branch code (X-Branch-Code)")
+    parser.add_argument("--org", default="default", help="org id (X-Org-Id)")
+    parser.add_argument("--image", help="face photo; default: synthetic frame with stubbed detection")
+    parser.add_argument("--frames", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--max-commits", type=int, default=1)
+    args = parser.parse_args()
+
+    settings.ENROLL_DEDUP_ENABLED = False
+    rng = np.random.default_rng(0)
+    if args.image:
+        base = cv2.imread(args.image)
+        if base is None:
+            parser.error(f"cannot read {args.image}")
+    else:
+        base = (rng.random((480, 640, 3)) * 255).astype(np.uint8)
+        h, w = base.shape[:2]
+        engine_arc._detect_faces = lambda bgr: [(w // 4, h // 4, w // 2, h // 2)]
+        settings.FACE_QUALITY_ENROLL = False
+    # Slightly different frames, as a live burst would have
+    frames = [cv2.imencode(".jpg", np.clip(base.astype(np.int16) + rng.integers(-3, 4, base.shape), 0, 255)
+                           .astype(np.uint8))[1].tobytes() for _ in range(args.frames)]
+
+    counts = {"commit": 0, "statements": 0}
+    event.listen(engine, "commit", lambda conn: counts.__setitem__("commit", counts["commit"] + 1))
+    event.listen(engine, "before_cursor_execute",
+                 lambda *a: counts.__setitem__("statements", counts["statements"] + 1))
+
+    client = TestClient(app)
+    headers = {"Authorization": f"Bearer {create_token(str(args.user_id))}",
+               "X-Org-Id": args.org, "X-Branch-Code": args.branch}
+    files = [("files", (f"frame{i}.jpg", by, "image/jpeg")) for i, by in enumerate(frames)]
+    engine_arc.load()
+    engine_arc.embed(frames[0])  # warm up the session outside the timings
+
+    latencies, commits, statements, image_ids = [], [], [], []
+    try:
+        for _ in range(args.runs):
+            counts.update(commit=0, statements=0)
+            t0 = time.perf_counter()
+            r = client.post("/face/enroll_live", files=files, headers=headers)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if r.status_code != 200:
+                print(f"enroll_live returned {r.status_code}: {r.text}")
+                return 1
+            image_ids += r.json()["image_ids"]
+            commits.append(counts["commit"])
+            statements.append(counts["statements"])
+    finally:
+        if image_ids:
+            with engine.begin() as conn:
+                conn.execute(text("DELETE FROM face_embeddings WHERE face_image_id = ANY(:ids)"), {"ids": image_ids})
+                conn.execute(text("DELETE FROM face_images WHERE id = ANY(:ids)"), {"ids": image_ids})
+
+    latencies.sort()
+    print(f"enroll_live x{args.runs}, {args.frames} frames: "
+          f"p50 {statistics.median(latencies):.1f} ms, p95 {latencies[int(0.95 * (len(latencies) - 1))]:.1f} ms, "
+          f"commits/request {max(commits)}, statements/request {statistics.median(statements):.0f}")
+    if max(commits) > args.max_commits:
+        print(f"More than {args.max_commits} commit(s) per enrollment; writes must share one transaction")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
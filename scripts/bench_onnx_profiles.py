@@ -0,0 +1,109 @@
+"""
+Compare ONNX Runtime session profiles for the ArcFace model.
+
+    python scripts/bench_onnx_profiles.py [--model app/models/arcface_r100.onnx]
+        [--iterations 200] [--concurrency 1] [--profiles legacy,settings,...]
+
+For each profile this reports session creation time (cold and with the cached
+optimized model), single-request latency percentiles and throughput with
+--concurrency threads sharing one session, which approximates one worker.
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.core.config import settings  # noqa: E402
+from app.face_engine_arcface import ArcFaceCPU, onnx_profile_from_settings, _available_cpus  # noqa: E402
+
+
+def profiles() -> dict:
+    base = onnx_profile_from_settings()
+    return {
+        # What ArcFaceCPU did before it was settings-driven
+        "legacy": {**base, "intra_op_threads": max(1, _available_cpus() // 2), "allow_spinning": True,
+                   "cache_optimized_model": False, "io_binding": False},
+        "settings": base,
+        "no_io_binding": {**base, "io_binding": False},
+        "spinning": {**base, "allow_spinning": True},
+        "parallel": {**base, "execution_mode": "parallel", "inter_op_threads": 2},
+        "extended": {**base, "graph_optimization": "extended"},
+        "no_arena": {**base, "cpu_mem_arena": False, "mem_pattern": False},
+    }
+
+
+def bench(name: str, model: str, profile: dict, iterations: int, concurrency: int) -> dict:
+    cache_dir = tempfile.mkdtemp(prefix="onnx-bench-")
+    profile = {**profile, "optimized_model_dir": cache_dir}
+    try:
+        cold = ArcFaceCPU(model, profile)
+        cold.load()
+        if cold.sess is None:
+            raise SystemExit(f"Could not load {model}")
+        warm = ArcFaceCPU(model, profile)
+        warm.load()
+        blob = np.random.default_rng(0).standard_normal((1, 3, 112, 112)).astype(np.float32)
+        for _ in range(10):
+            warm._infer(blob)
+
+        lat = []
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            warm._infer(blob)
+            lat.append((time.perf_counter() - t0) * 1000)
+
+        def work(_):
+            warm._infer(blob)
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(work, range(iterations)))
+        throughput = iterations / (time.perf_counter() - t0)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return {
+        "profile": name,
+        "create_cold_ms": cold.session_info["create_ms"],
+        "create_cached_ms": warm.session_info["create_ms"],
+        "cache_hit": warm.session_info["optimized_cache_hit"],
+        "p50_ms": float(np.percentile(lat, 50)),
+        "p95_ms": float(np.percentile(lat, 95)),
+        "mean_ms": float(np.mean(lat)),
+        "throughput_rps": throughput,
+        "threads": warm.session_info["intra_op_threads"],
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--model", default=settings.ARCFACE_MODEL_PATH)
+    ap.add_argument("--iterations", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=1)
+    ap.add_argument("--profiles", default="", help="comma-separated subset of: " + ", ".join(profiles()))
+    args = ap.parse_args()
+
+    selected = profiles()
+    if args.profiles:
+        selected = {k: v for k, v in selected.items() if k in args.profiles.split(",")}
+    print(f"model={args.model} cpus={_available_cpus()} WEB_CONCURRENCY={settings.WEB_CONCURRENCY} "
+          f"iterations={args.iterations} concurrency={args.concurrency}")
+    header = f"{'profile':<14}{'threads':>8}{'cold ms':>10}{'cached ms':>11}{'p50 ms':>9}{'p95 ms':>9}{'mean ms':>9}{'rps':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, profile in selected.items():
+        r = bench(name, args.model, profile, args.iterations, args.concurrency)
+        cached = f"{r['create_cached_ms']:.1f}" + ("" if r["cache_hit"] else "*")
+        print(f"{name:<14}{r['threads']:>8}{r['create_cold_ms']:>10.1f}{cached:>11}{r['p50_ms']:>9.2f}"
+              f"{r['p95_ms']:>9.2f}{r['mean_ms']:>9.2f}{r['throughput_rps']:>9.1f}")
+    print("* optimized-model cache not used by this profile")
+
+
+if __name__ == "__main__":
+    main()
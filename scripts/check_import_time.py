@@ -0,0 +1,36 @@
+"""
+Fail if importing the API module exceeds a wall-clock budget.
+
+Importing app.main must not load models, open DB connections or run DDL; those
+happen in the startup hook and warmup thread. Usage:
+
+    python scripts/check_import_time.py [budget_ms]
+"""
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+DEFAULT_BUDGET_MS = 2000
+RUNS = 3
+
+
+def measure_ms() -> float:
+    code = "import time; t = time.perf_counter(); import app.main; print((time.perf_counter() - t) * 1000)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def main() -> int:
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET_MS
+    # Best of N: the first run also pays for cold .pyc compilation and disk cache
+    best = min(measure_ms() for _ in range(RUNS))
+    print(f"import app.main: {best:.0f} ms (budget {budget:.0f} ms)")
+    if best > budget:
+        print("Import-time budget exceeded; move heavy imports/initialisation behind warmup()")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+"""
+Find enrolled accounts that share a face (see app/duplicate_scan.py).
+
+    python scripts/duplicate_scan.py scan --scope org:default          # only embeddings new since the last run
+    python scripts/duplicate_scan.py scan --scope branch:main-branch --full --threshold 0.65
+    python scripts/duplicate_scan.py list --scope org:default --min 0.7
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+# The scan parallelises over tiles itself; multi-threaded BLAS inside each tile would oversubscribe
+for _var in ("OPENBLAS_NUM_THREADS", "OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(_var, "1")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app import duplicate_scan  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["scan", "list"])
+    parser.add_argument("--scope", default="all", help="all, org:<org_id> or branch:<branch_code>")
+    parser.add_argument("--full", action="store_true", help="scan: compare the whole gallery, not just new rows")
+    parser.add_argument("--threshold", type=float, default=None, help="scan: default DUPLICATE_SCAN_SIMILARITY")
+    parser.add_argument("--min", type=float, default=0.0, help="list: minimum similarity")
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    try:
+        if args.command == "scan":
+            result = duplicate_scan.scan(args.scope, args.full, args.threshold)
+            print("[duplicates] " + " ".join(f"{k}={v}" for k, v in result.items()))
+        else:
+            for p in duplicate_scan.list_pairs(args.scope, args.min, args.limit):
+                print(f"{p['similarity']:.4f}  {p['user_a']} <{p['email_a']}> (branch {p['branch_a']})"
+                      f"  ~  {p['user_b']} <{p['email_b']}> (branch {p['branch_b']})  since {p['first_seen_at']}")
+    except ValueError as exc:
+        print(f"[duplicates] {exc}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
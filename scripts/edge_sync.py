@@ -0,0 +1,55 @@
+"""
+Sync an edge kiosk with the central server (see app/edge.py).
+
+    python scripts/edge_sync.py                       # pull the branch gallery, then push buffered audit
+    python scripts/edge_sync.py pull --branch main-branch --server https://faceid.example --api-key ...
+    python scripts/edge_sync.py push
+    python scripts/edge_sync.py status
+
+Defaults come from EDGE_SERVER_URL, EDGE_SERVER_API_KEY, EDGE_BRANCH_CODE and
+EDGE_DB_PATH. A running app.edge_app picks a pulled gallery up on its next
+request. Run it from cron; a failed run changes nothing locally.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app import edge  # noqa: E402
+from app.core.config import settings  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", nargs="?", default="sync", choices=["sync", "pull", "push", "status"])
+    parser.add_argument("--server", default=settings.EDGE_SERVER_URL)
+    parser.add_argument("--api-key", default=settings.EDGE_SERVER_API_KEY)
+    parser.add_argument("--branch", default=settings.EDGE_BRANCH_CODE)
+    parser.add_argument("--db", default=settings.EDGE_DB_PATH)
+    args = parser.parse_args()
+
+    store = edge.EdgeStore(args.db)
+    if args.command == "status":
+        print("[edge] " + " ".join(f"{k}={v}" for k, v in {**store.state(), **store.counts()}.items()))
+        return 0
+    if not args.server:
+        parser.error("--server (or EDGE_SERVER_URL) is required")
+    branch = args.branch or store.state().get("branch_code")
+    try:
+        if args.command in ("sync", "pull"):
+            if not branch:
+                parser.error("--branch (or EDGE_BRANCH_CODE) is required for the first pull")
+            result = edge.pull(store, args.server, args.api_key, branch)
+            print("[edge] pulled " + " ".join(f"{k}={v}" for k, v in result.items()))
+        if args.command in ("sync", "push"):
+            result = edge.push(store, args.server, args.api_key)
+            print("[edge] pushed " + " ".join(f"{k}={v}" for k, v in result.items()))
+    except Exception as exc:
+        print(f"[edge] {exc}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
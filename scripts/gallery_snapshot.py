@@ -0,0 +1,58 @@
+"""
+Export / import gallery snapshots (see app/gallery_snapshot.py).
+
+    python scripts/gallery_snapshot.py export --scope all --out gallery.fsnp [--dtype float16]
+    python scripts/gallery_snapshot.py export --scope branch:main-branch --out branch.fsnp
+    python scripts/gallery_snapshot.py export --scope org:default --out org.fsnp --version r100-int8
+    python scripts/gallery_snapshot.py verify gallery.fsnp
+    python scripts/gallery_snapshot.py import branch.fsnp [--create-branches] [--dry-run]
+
+import appends rows: branches are matched by code, users by email.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app import gallery_snapshot  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["export", "verify", "import"])
+    parser.add_argument("path", nargs="?", help="snapshot file (verify / import)")
+    parser.add_argument("--scope", default="all", help="all, org:<org_id> or branch:<branch_code>")
+    parser.add_argument("--out", help="export: file to write")
+    parser.add_argument("--version", help="export: embedding version (default: the active one)")
+    parser.add_argument("--dtype", default="float32", choices=sorted(gallery_snapshot.DTYPES))
+    parser.add_argument("--create-branches", action="store_true", help="import: create branches missing here")
+    parser.add_argument("--dry-run", action="store_true", help="import: roll back at the end")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    try:
+        if args.command == "export":
+            if not args.out:
+                parser.error("--out is required")
+            result = gallery_snapshot.export_snapshot(args.out, args.scope, args.version, args.dtype)
+        elif not args.path:
+            parser.error("a snapshot path is required")
+        elif args.command == "verify":
+            snap = gallery_snapshot.read_snapshot(args.path)
+            result = {"scope": snap.meta["scope"], "model_version": snap.model_version, "dtype": snap.dtype,
+                      "dim": snap.dim, "count": snap.count, "branches": len(snap.branches()),
+                      "cursor": snap.cursor, "xmin": snap.meta.get("xmin"), "created_at": snap.meta["created_at"]}
+        else:
+            result = gallery_snapshot.import_snapshot(args.path, args.create_branches, args.dry_run)
+    except ValueError as exc:
+        print(f"[snapshot] {exc}", file=sys.stderr)
+        return 1
+    print(f"[snapshot] {args.command} in {time.perf_counter() - t0:.2f}s: "
+          + " ".join(f"{k}={v}" for k, v in result.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
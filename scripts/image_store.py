@@ -0,0 +1,49 @@
+"""
+Image storage status and manual transcoder runs (see app/image_store.py).
+
+    python scripts/image_store.py stats
+    python scripts/image_store.py run [--drop-originals]    # until the backlog is drained
+
+The API workers run the same steps in the background (IMAGE_TRANSCODE_ENABLED);
+a manual run is for draining a large backfill off-peak. Space freed by dropped
+originals returns to the OS only after VACUUM FULL image_blobs (or pg_repack).
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app import image_store  # noqa: E402
+from app.database import engine  # noqa: E402
+
+
+def _stats() -> dict:
+    with engine.connect() as conn:
+        return image_store.storage_stats(conn)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["stats", "run"])
+    parser.add_argument("--drop-originals", action="store_true",
+                        help="run: drop embedded originals even if IMAGE_DROP_ORIGINAL is off")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        t0 = time.perf_counter()
+        drop = True if args.drop_originals else None
+        while image_store.transcoder.run_once(drop):
+            pass
+        stats = image_store.transcoder.stats()
+        print("[images] " + " ".join(f"{k}={v}" for k, v in stats.items() if k != "enabled")
+              + f" seconds={time.perf_counter() - t0:.1f}")
+        if stats["errors"]:
+            return 1
+    print("[images] " + " ".join(f"{k}={v}" for k, v in _stats().items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,5 @@
 import os
+import re
 from pathlib import Path
 from dotenv import load_dotenv, find_dotenv
 import psycopg
@@ -9,6 +10,21 @@ def read_sql_file(path: Path) -> str:
         return f.read()
 
 
+def split_sql_statements(sql: str) -> list[str]:
+    """Split on ';' while keeping $$-quoted function/DO bodies intact."""
+    statements, buf, in_dollar = [], [], False
+    for part in re.split(r"(\$\$|;)", sql):
+        if part == "$$":
+            in_dollar = not in_dollar
+        elif part == ";" and not in_dollar:
+            statements.append("".join(buf))
+            buf = []
+            continue
+        buf.append(part)
+    statements.append("".join(buf))
+    return statements
+
+
 def ensure_database_exists():
     load_dotenv(find_dotenv())
     db_user = os.getenv("POSTGRES_USER", "postgres")
@@ -44,7 +60,7 @@ def run_migrations():
     dsn = f"host={db_host} port={db_port} dbname={db_name} user={db_user} password={db_pass}"
     with psycopg.connect(dsn, autocommit=True) as conn:
         with conn.cursor() as cur:
-            for statement in sql.split(';'):
+            for statement in split_sql_statements(sql):
                 stmt = statement.strip()
                 if not stmt:
                     continue
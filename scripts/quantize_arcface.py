@@ -0,0 +1,193 @@
+"""
+Build an INT8 ArcFace model and gate it on agreement with the FP32 model.
+
+    python scripts/quantize_arcface.py --images path/to/face_images
+        [--mode static|dynamic] [--model app/models/arcface_r100.onnx]
+        [--output app/models/arcface_r100.int8.onnx]
+
+Static mode calibrates activation ranges on face crops from --images (the same
+Haar crop + normalisation ArcFaceCPU uses at runtime). Afterwards both models
+embed the evaluation images (--eval-images, default: the calibration set) and
+the INT8 file is deleted again unless
+
+  * mean cosine(fp32, int8) per image >= --min-cosine, and
+  * the fraction of image pairs where both models make the same match decision
+    >= --min-agreement, at every --threshold. Thresholds apply to the served
+    (boosted) confidence, as in the API; the default is FACE_THRESHOLD and the
+    liveness SIM_THRESH.
+
+A JSON report is written next to the output either way. Enable the result with
+ARCFACE_PRECISION=int8.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.core.config import settings  # noqa: E402
+from app.face_engine_arcface import ArcFaceCPU, onnx_profile_from_settings  # noqa: E402
+from app.nn import _boost_confidence_score  # noqa: E402
+from app.routers.liveness_router import SIM_THRESH  # noqa: E402
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+_boost = np.vectorize(_boost_confidence_score, otypes=[np.float64])
+
+
+def load_blobs(detector: ArcFaceCPU, directory: str, limit: int) -> list[np.ndarray]:
+    """Face crops as (1, 3, 112, 112) blobs; images without a detectable face are skipped."""
+    blobs = []
+    for path in sorted(Path(directory).rglob("*")):
+        if path.suffix.lower() not in IMAGE_EXTS:
+            continue
+        bgr = cv2.imread(str(path), cv2.IMREAD_COLOR)
+        if bgr is None:
+            continue
+        blob = detector._detect(bgr)
+        if blob is not None:
+            blobs.append(blob)
+        if len(blobs) >= limit:
+            break
+    return blobs
+
+
+class _BlobReader:
+    """CalibrationDataReader over preprocessed blobs."""
+
+    def __init__(self, input_name: str, blobs: list[np.ndarray]):
+        self._it = iter([{input_name: b} for b in blobs])
+
+    def get_next(self):
+        return next(self._it, None)
+
+
+def quantize(model: str, output: str, mode: str, blobs: list[np.ndarray], per_channel: bool) -> None:
+    from onnxruntime.quantization import (  # type: ignore
+        CalibrationMethod, QuantFormat, QuantType, quantize_dynamic, quantize_static,
+    )
+    with tempfile.TemporaryDirectory(prefix="arcface-quant-") as tmp_dir:
+        try:
+            # Shape inference + graph cleanup gives the quantizer more ops to work with
+            from onnxruntime.quantization.shape_inference import quant_pre_process  # type: ignore
+            src = os.path.join(tmp_dir, "preprocessed.onnx")
+            quant_pre_process(model, src, skip_symbolic_shape=True)
+        except Exception as exc:
+            print(f"Pre-processing skipped: {exc}")
+            src = model
+        if mode == "dynamic":
+            quantize_dynamic(src, output, weight_type=QuantType.QInt8, per_channel=per_channel)
+        else:
+            probe = ArcFaceCPU(model_path=model, profile={**onnx_profile_from_settings(), "cache_optimized_model": False})
+            probe.load()
+            quantize_static(
+                src, output, _BlobReader(probe.input_name, blobs),
+                quant_format=QuantFormat.QDQ,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                per_channel=per_channel,
+                calibrate_method=CalibrationMethod.MinMax,
+            )
+
+
+def embed_all(model: str, blobs: list[np.ndarray]) -> tuple[np.ndarray, float]:
+    engine = ArcFaceCPU(model_path=model, profile={**onnx_profile_from_settings(), "cache_optimized_model": False})
+    engine.load()
+    if engine.sess is None:
+        raise SystemExit(f"Could not load {model}")
+    engine._infer(blobs[0])
+    t0 = time.perf_counter()
+    out = np.concatenate([engine._infer(b) for b in blobs]).astype(np.float32)
+    ms = (time.perf_counter() - t0) * 1000 / len(blobs)
+    out /= np.linalg.norm(out, axis=1, keepdims=True) + 1e-9
+    return out, ms
+
+
+def compare(fp32: np.ndarray, int8: np.ndarray, thresholds: list[float]) -> dict:
+    per_image = np.sum(fp32 * int8, axis=1)
+    iu = np.triu_indices(len(fp32), k=1)
+    sims32 = (fp32 @ fp32.T)[iu]
+    sims8 = (int8 @ int8.T)[iu]
+    # Decisions are taken on the boosted score the API serves, not on the raw cosine
+    conf32, conf8 = _boost(sims32), _boost(sims8)
+    agree = {str(t): float(np.mean((conf32 >= t) == (conf8 >= t))) if len(sims32) else 1.0 for t in thresholds}
+    nn32 = np.argmax(fp32 @ fp32.T - 2 * np.eye(len(fp32)), axis=1)
+    nn8 = np.argmax(int8 @ int8.T - 2 * np.eye(len(int8)), axis=1)
+    return {
+        "images": int(len(fp32)),
+        "pairs": int(len(sims32)),
+        "cosine_mean": float(per_image.mean()),
+        "cosine_min": float(per_image.min()),
+        "decision_agreement": min(agree.values()),
+        "decision_agreement_by_threshold": agree,
+        "nearest_neighbour_agreement": float(np.mean(nn32 == nn8)) if len(fp32) > 1 else 1.0,
+        "max_pair_sim_delta": float(np.max(np.abs(sims32 - sims8))) if len(sims32) else 0.0,
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--model", default=settings.ARCFACE_MODEL_PATH)
+    ap.add_argument("--output", default=settings.ARCFACE_INT8_MODEL_PATH)
+    ap.add_argument("--mode", choices=("static", "dynamic"), default="static")
+    ap.add_argument("--images", required=True, help="calibration images (face photos)")
+    ap.add_argument("--eval-images", default=None, help="evaluation images (default: --images)")
+    ap.add_argument("--max-images", type=int, default=500)
+    ap.add_argument("--per-channel", action=argparse.BooleanOptionalAction, default=True)
+    ap.add_argument("--threshold", type=float, action="append",
+                    help="served (boosted) confidence threshold; repeatable "
+                         f"(default: FACE_THRESHOLD {settings.FACE_THRESHOLD} and liveness SIM_THRESH {SIM_THRESH})")
+    ap.add_argument("--min-cosine", type=float, default=0.98)
+    ap.add_argument("--min-agreement", type=float, default=0.99)
+    args = ap.parse_args()
+    thresholds = args.threshold or [settings.FACE_THRESHOLD, SIM_THRESH]
+
+    detector = ArcFaceCPU(model_path=args.model)
+    calib = load_blobs(detector, args.images, args.max_images)
+    evals = load_blobs(detector, args.eval_images, args.max_images) if args.eval_images else calib
+    if len(evals) < 2:
+        print("Need at least two images with a detectable face")
+        return 2
+    print(f"Calibration crops: {len(calib)}, evaluation crops: {len(evals)}")
+
+    t0 = time.perf_counter()
+    quantize(args.model, args.output, args.mode, calib, args.per_channel)
+    print(f"Quantized ({args.mode}) in {time.perf_counter() - t0:.1f}s -> {args.output}")
+
+    fp32, fp32_ms = embed_all(args.model, evals)
+    int8, int8_ms = embed_all(args.output, evals)
+    report = compare(fp32, int8, thresholds)
+    report.update({
+        "mode": args.mode,
+        "thresholds": thresholds,
+        "fp32_ms_per_image": fp32_ms,
+        "int8_ms_per_image": int8_ms,
+        "speedup": fp32_ms / int8_ms if int8_ms else None,
+        "fp32_bytes": os.path.getsize(args.model),
+        "int8_bytes": os.path.getsize(args.output),
+    })
+    passed = report["cosine_mean"] >= args.min_cosine and report["decision_agreement"] >= args.min_agreement
+    report["accepted"] = passed
+    with open(f"{args.output}.report.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    for key in ("cosine_mean", "cosine_min", "decision_agreement", "nearest_neighbour_agreement",
+                "fp32_ms_per_image", "int8_ms_per_image", "speedup"):
+        print(f"  {key:<28} {report[key]:.4f}")
+    if not passed:
+        os.remove(args.output)
+        print(f"REJECTED: below gate (min cosine {args.min_cosine}, min agreement {args.min_agreement}); "
+              f"{args.output} removed")
+        return 1
+    print("ACCEPTED: set ARCFACE_PRECISION=int8 to serve it")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
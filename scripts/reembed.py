@@ -0,0 +1,59 @@
+"""
+Move the face gallery to a new embedding model (see app/reembed.py).
+
+    python scripts/reembed.py status
+    python scripts/reembed.py build --version r100-int8 --model app/models/arcface_r100.int8.onnx [--cutover]
+    python scripts/reembed.py cutover --version r100-int8
+    python scripts/reembed.py purge --version legacy
+
+build can be interrupted and rerun; it continues from its checkpoint.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app import reembed  # noqa: E402
+
+
+def _progress(stats: dict) -> None:
+    print(f"[reembed] {stats['version']}: {stats['images']} images "
+          f"({stats['embedded']} embedded, {stats['skipped']} without face/branch), "
+          f"checkpoint {stats['checkpoint']}, {stats['images_per_s']}/s", flush=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["status", "build", "cutover", "purge"])
+    parser.add_argument("--version", help="embedding version name (at most 32 bytes)")
+    parser.add_argument("--model", help="ONNX model to build the version with")
+    parser.add_argument("--workers", type=int, default=0, help="default: REEMBED_WORKERS")
+    parser.add_argument("--batch", type=int, default=0, help="default: REEMBED_BATCH_SIZE")
+    parser.add_argument("--cutover", action="store_true", help="with build: make the version active when done")
+    parser.add_argument("--grace", type=float, default=None,
+                        help="seconds to let workers switch before the final catch-up")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        for row in reembed.status():
+            print(" ".join(f"{k}={v}" for k, v in row.items()))
+        return 0
+    if not args.version:
+        parser.error("--version is required")
+    if args.command == "build":
+        stats = reembed.build(args.version, args.model, args.workers, args.batch, _progress)
+        print(f"[reembed] built {args.version}: {stats['images']} images in this run")
+        if not args.cutover:
+            return 0
+    if args.command in ("build", "cutover"):
+        result = reembed.cutover(args.version, args.workers, args.batch, args.grace, _progress)
+        print(f"[reembed] {result['previous']} -> {result['version']} is active; "
+              f"{result['caught_up_after_switch']} images caught up after the switch")
+    elif args.command == "purge":
+        print(f"[reembed] removed {reembed.purge(args.version)} embeddings of {args.version}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())